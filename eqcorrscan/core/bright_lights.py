@@ -27,15 +27,18 @@ import numpy as np
 import warnings
 import csv
 import glob
-import sys
 import os
+import json
+import hashlib
 
-from obspy import Stream, Trace, read as obsread
+from obspy import Stream, read as obsread
 from multiprocessing import Pool, cpu_count
 from copy import deepcopy
+from bisect import bisect_left
 from obspy.core.event import Catalog, Event, Pick, WaveformStreamID, Origin
 from obspy.core.event import EventDescription, CreationInfo, Comment
 
+from eqcorrscan import EQcorrscanDeprecationWarning
 from eqcorrscan.core.match_filter import DETECTION, normxcorr2
 from eqcorrscan.utils import findpeaks
 from eqcorrscan.core.template_gen import _template_gen
@@ -89,8 +92,7 @@ def _read_tt(path, stations, phase, phaseout='S', ps_ratio=1.68,
     gridfiles = []
     stations_out = []
     for station in stations:
-        gridfiles += (glob.glob(path + '*.' + phase + '.' + station +
-                      '.time.csv'))
+        gridfiles += _grid_files(path=path, station=station, phase=phase)
         if glob.glob(path + '*.' + phase + '.' + station + '*.csv'):
             stations_out += [station]
     if not stations_out:
@@ -129,6 +131,23 @@ def _read_tt(path, stations, phase, phaseout='S', ps_ratio=1.68,
     return stations_out, allnodes, alllags
 
 
+def _grid_files(path, station, phase):
+    """
+    Find the Grid2Time .csv travel-time files for a station.
+
+    :type path: str
+    :param path: The path to the .csv Grid2Time outputs
+    :type station: str
+    :param station: Station name.
+    :type phase: str
+    :param phase: Phase type.
+
+    :returns: List of file names.
+    :rtype: list
+    """
+    return glob.glob(path + '*.' + phase + '.' + station + '.time.csv')
+
+
 def _resample_grid(stations, nodes, lags, mindepth, maxdepth, corners):
     """
     Resample the lagtime grid to a given volume.
@@ -195,9 +214,10 @@ def _rm_similarlags(stations, nodes, lags, threshold):
     Remove nodes that have a very similar network moveout to another node.
 
     This function will, for each node, calculate the difference in lagtime
-    at each station at every node, then sum these for each node to get a
-    cumulative difference in network moveout.  This will result in an
-    array of arrays with zeros on the diagonal.
+    at each station to every other node, then sum these to get a
+    cumulative difference in network moveout.  Nodes are taken in order and
+    kept if their cumulative difference to every node already kept is
+    greater than the threshold.
 
     :type stations: list
     :param stations:
@@ -229,28 +249,126 @@ def _rm_similarlags(stations, nodes, lags, threshold):
         to station[1] and lags[1][1] nodes[n][n] is a tuple of latitude,
         longitude and depth.
     """
-    netdif = abs((lags.T -
-                  lags.T[0]).sum(axis=1).reshape(1, len(nodes))) > threshold
-    for i in range(len(nodes)):
-        _netdif = abs((lags.T -
-                       lags.T[i]).sum(axis=1).reshape(1, len(nodes)))\
-            > threshold
-        netdif = np.concatenate((netdif, _netdif), axis=0)
-        sys.stdout.write("\r" + str(float(i) // len(nodes) * 100) + "% \r")
-        sys.stdout.flush()
-    nodes_out = [nodes[0]]
-    node_indeces = [0]
-    print("\n")
-    print(len(nodes))
-    for i in range(1, len(nodes)):
-        if np.all(netdif[i][node_indeces]):
-            node_indeces.append(i)
-            nodes_out.append(nodes[i])
+    # The difference in network moveout between two nodes is the
+    # difference of their summed lags, so nodes can be compared by a single
+    # value.  Keep a sorted list of the kept moveouts: only the nearest kept
+    # moveout either side of a node can be within the threshold.
+    moveouts = np.asarray(lags).sum(axis=0)
+    kept_moveouts = []
+    nodes_out = []
+    node_indeces = []
+    for i, moveout in enumerate(moveouts):
+        k = bisect_left(kept_moveouts, moveout)
+        if k > 0 and moveout - kept_moveouts[k - 1] <= threshold:
+            continue
+        if k < len(kept_moveouts) and kept_moveouts[k] - moveout <= threshold:
+            continue
+        kept_moveouts.insert(k, moveout)
+        node_indeces.append(i)
+        nodes_out.append(nodes[i])
     lags_out = lags.T[node_indeces].T
     print("Removed " + str(len(nodes) - len(nodes_out)) + " duplicate nodes")
     return stations, nodes_out, lags_out
 
 
+def prepare_grid(path, stations, phase, phaseout='S', ps_ratio=1.68,
+                 mindepth=None, maxdepth=None, corners=None, threshold=None,
+                 cache_dir=None):
+    """
+    Read, resample and decimate a travel-time grid, with optional caching.
+
+    Runs :func:`_read_tt`, then :func:`_resample_grid` if corners are given
+    and :func:`_rm_similarlags` if threshold is given.  If cache_dir is
+    given the prepared grid is saved there as binary files, keyed on the
+    modification times of the grid files and the parameters, and later
+    calls with the same grid and parameters load the lags memory-mapped
+    rather than preparing the grid again.
+
+    :type path: str
+    :param path: The path to the .csv Grid2Time outputs
+    :type stations: list
+    :param stations: List of station names to read slowness files for.
+    :type phase: str
+    :param phase: Input phase type.
+    :type phaseout: str
+    :param phaseout: What phase to return the lagtimes in.
+    :type ps_ratio: float
+    :param ps_ratio: p to s ratio for conversion
+    :type mindepth: float
+    :param mindepth: Upper limit of volume, see :func:`_resample_grid`
+    :type maxdepth: float
+    :param maxdepth: Lower limit of volume, see :func:`_resample_grid`
+    :type corners: matplotlib.path.Path
+    :param corners:
+        matplotlib Path of the corners for the 2D polygon to cut to in lat and
+        lon, if None the grid will not be resampled.
+    :type threshold: float
+    :param threshold:
+        Threshold for removal of similar nodes in seconds, if None no nodes
+        will be removed, see :func:`_rm_similarlags`
+    :type cache_dir: str
+    :param cache_dir:
+        Directory to cache prepared grids in, defaults to None which does
+        not cache.
+
+    :returns: Stations
+    :rtype: list
+    :returns: List of tuples of node locations
+    :rtype: list
+    :returns: Array of lags.
+    :rtype: :class:`numpy.ndarray`
+    """
+    if cache_dir:
+        gridfiles = sorted([gridfile for station in stations
+                            for gridfile in _grid_files(path=path,
+                                                        station=station,
+                                                        phase=phase)])
+        if not gridfiles:
+            raise IOError('No slowness files found')
+        if corners is not None:
+            vertices = np.asarray(corners.vertices).tolist()
+        else:
+            vertices = None
+        key = json.dumps([[(gridfile, os.path.getmtime(gridfile))
+                           for gridfile in gridfiles],
+                          list(stations), phase, phaseout, ps_ratio,
+                          mindepth, maxdepth, vertices, threshold])
+        cache_name = os.path.join(
+            cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+        if os.path.isfile(cache_name + '_lags.npy'):
+            with open(cache_name + '_stations.json', 'r') as f:
+                stations_out = json.load(f)
+            nodes = [tuple(node) for node in
+                     np.load(cache_name + '_nodes.npy').tolist()]
+            lags = np.load(cache_name + '_lags.npy', mmap_mode='r')
+            return stations_out, nodes, lags
+    stations_out, nodes, lags = _read_tt(path=path, stations=stations,
+                                         phase=phase, phaseout=phaseout,
+                                         ps_ratio=ps_ratio)
+    if corners is not None:
+        stations_out, nodes, lags = _resample_grid(
+            stations=stations_out, nodes=nodes, lags=lags,
+            mindepth=mindepth, maxdepth=maxdepth, corners=corners)
+    if threshold is not None:
+        stations_out, nodes, lags = _rm_similarlags(
+            stations=stations_out, nodes=nodes, lags=lags,
+            threshold=threshold)
+    if cache_dir:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(cache_name + '_stations.json', 'w') as f:
+            json.dump(list(stations_out), f)
+        np.save(cache_name + '_nodes.npy', np.array(nodes, dtype=np.float64))
+        # Lags are written last, under a temporary name, so that an
+        # interrupted write is not read as a complete cache
+        with open(cache_name + '_lags.tmp', 'wb') as f:
+            np.save(f, np.asarray(lags, dtype=np.float64))
+        if os.path.isfile(cache_name + '_lags.npy'):
+            os.remove(cache_name + '_lags.npy')
+        os.rename(cache_name + '_lags.tmp', cache_name + '_lags.npy')
+    return stations_out, nodes, lags
+
+
 def _rms(array):
     """
     Calculate RMS of array.
@@ -264,145 +382,105 @@ def _rms(array):
     return np.sqrt(np.mean(np.square(array)))
 
 
-def _node_loop(stations, lags, stream, clip_level,
-               i=0, mem_issue=False, instance=0, plot=False):
+def _station_energy(stations, stream, clip_level):
     """
-    Internal function to allow for brightness to be paralleled.
+    Compute the energy envelope of each trace for the brightness stack.
+
+    The energy of a trace does not depend on the node, only its lag does,
+    so envelopes are computed once and shifted for each node.
 
     :type stations: list
     :param stations: List of stations to use.
-    :type lags: numpy.ndarray
-    :param lags: List of lags where lags[i[:]] are the lags for stations[i].
     :type stream: obspy.core.stream.Stream
     :param stream: Data stream to find the brightness for.
     :type clip_level: float
     :param clip_level: Upper limit for energy as a multiplier to the mean \
         energy.
-    :type i: int
-    :param i: Index of loop for parallelisation.
-    :type mem_issue: bool
-    :param mem_issue: If True will write to disk rather than storing data in \
-        RAM.
-    :type instance: int
-    :param instance: instance for bulk parallelisation, only used if \
-        mem_issue=true.
-    :type plot: bool
-    :param plot: Turn plotting on or off, defaults to False.
 
-    :returns: index
-    :rtype: int
-    :returns: network response
+    :returns: Energy envelopes, one row per trace with a matching station, \
+        scaled to a maximum of 500.
     :rtype: numpy.ndarray
+    :returns: Index into stations of each row of the envelopes.
+    :rtype: list
     """
-    if plot:
-        import matplotlib.pyplot as plt
-        fig, axes = plt.subplots(len(stream) + 1, 1, sharex=True)
-        axes = axes.ravel()
-
-    for l, tr in enumerate(stream):
+    envelopes = []
+    station_indices = []
+    for tr in stream:
         j = [k for k in range(len(stations))
              if stations[k] == tr.stats.station]
         # Check that there is only one matching station
         if len(j) > 1:
             warnings.warn('Too many stations')
-            j = [j[0]]
         if len(j) == 0:
             warnings.warn('No station match')
             continue
-        lag = lags[j[0]]
-        pad = np.zeros(int(round(lag * tr.stats.sampling_rate)))
-        lagged_energy = np.square(np.concatenate((tr.data, pad)))[len(pad):]
+        energy = np.square(tr.data.astype(np.float64))
         # Clip energy
-        lagged_energy = np.clip(lagged_energy, 0,
-                                clip_level * np.mean(lagged_energy))
-        if 'energy' not in locals():
-            energy = (lagged_energy /
-                      _rms(lagged_energy)).reshape(1, len(lagged_energy))
-            # Cope with zeros enountered
-            energy = np.nan_to_num(energy)
-            # This is now an array of floats - we can convert this to int16
-            # normalize to have max at max of int16 range
-            if not max(energy[0]) == 0.0:
-                scalor = 1 / max(energy[0])
-                energy = (500 * (energy * scalor)).astype(np.int16)
-            else:
-                energy = energy.astype(np.int16)
-        else:
-            norm_energy = (lagged_energy /
-                           _rms(lagged_energy)).reshape(1, len(lagged_energy))
-            norm_energy = np.nan_to_num(norm_energy)
-            # Convert to int16
-            if not max(norm_energy[0]) == 0.0:
-                scalor = 1 / max(norm_energy[0])
-                norm_energy = (500 * (norm_energy * scalor)).astype(np.int16)
-            else:
-                norm_energy = norm_energy.astype(np.int16)
-            # Apply lag to data and add it to energy - normalize the data here
-            energy = np.concatenate((energy, norm_energy), axis=0)
-        if plot:
-            axes[l].plot(lagged_energy * 200, 'r')
-            axes[l].plot(tr.data, 'k')
-            # energy_tr=Trace(energy[l])
-            energy_tr = Trace(lagged_energy)
-            # energy_tr=Trace(tr.data)
-            energy_tr.stats.station = tr.stats.station
-            energy_tr.stats.sampling_rate = tr.stats.sampling_rate
-            if 'energy_stream' not in locals():
-                energy_stream = Stream(energy_tr)
-            else:
-                energy_stream += energy_tr
-    energy = np.sum(energy, axis=0).reshape(1, len(lagged_energy))
-    energy = energy.astype(np.uint16)
-    # Convert any nans to zeros
-    energy = np.nan_to_num(energy)
-    if plot:
-        energy_tr = Trace(energy[0])
-        energy_tr.stats.station = 'Stack'
-        energy_tr.stats.sampling_rate = tr.stats.sampling_rate
-        energy_tr.stats.network = 'Energy'
-        energy_stream += energy_tr
-        axes[-1].plot(energy[0])
-        plt.subplots_adjust(hspace=0)
-        plt.show()
-        # energy_stream.plot(equal_scale=False, size=(800,600))
-    if not mem_issue:
-        return i, energy
-    else:
-        if not os.path.isdir('tmp' + str(instance)):
-            os.makedirs('tmp' + str(instance))
-        np.save('tmp' + str(instance) + '/node_' + str(i), energy)
-        return i, str('tmp' + str(instance) + '/node_' + str(i))
+        energy = np.clip(energy, 0, clip_level * np.mean(energy))
+        # Cope with zeros enountered
+        energy = np.nan_to_num(energy / _rms(energy))
+        # Convert to integers to conserve memory, normalized to have max of
+        # 500 so that the stack of up to 130 channels fits in uint16
+        if not max(energy) == 0.0:
+            energy = 500 * (energy / max(energy))
+        envelopes.append(energy.astype(np.uint16))
+        station_indices.append(j[0])
+    return np.array(envelopes), station_indices
+
+
+def _node_loop(energy, lags, i=0):
+    """
+    Compute the network response for a single node.
 
+    :type energy: numpy.ndarray
+    :param energy: Energy envelopes from :func:`_station_energy`.
+    :type lags: numpy.ndarray
+    :param lags: Lag in samples for each row of energy.
+    :type i: int
+    :param i: Index of node.
+
+    :returns: index
+    :rtype: int
+    :returns: network response
+    :rtype: numpy.ndarray
+    """
+    npts = energy.shape[1]
+    response = np.zeros(npts, dtype=np.uint16)
+    for envelope, lag in zip(energy, lags):
+        # Shift the envelope back by the lag, zeros fill the end
+        if lag < npts:
+            response[0:npts - lag] += envelope[lag:]
+    return i, response.reshape(1, npts)
 
-def _cum_net_resp(node_lis, instance=0):
+
+def _cum_net_resp(energy, lags, node_lis):
     """
-    Compute the cumulative network response by reading saved energy .npy files.
+    Compute the cumulative network response of a set of nodes.
 
-    :type node_lis: numpy.ndarray
-    :param node_lis: List of nodes (ints) to read from
-    :type instance: int
-    :param instance: Instance flag for parallel workflows, defaults to 0.
+    Keeps only the running maximum response and the node giving it, so
+    memory does not grow with the number of nodes.
+
+    :type energy: numpy.ndarray
+    :param energy: Energy envelopes from :func:`_station_energy`.
+    :type lags: numpy.ndarray
+    :param lags: Lags in samples, rows for rows of energy and columns for \
+        nodes in node_lis.
+    :type node_lis: list
+    :param node_lis: List of nodes (ints) to compute.
 
     :returns: cumulative network response
     :rtype: numpy.ndarray
     :returns: node indeces for each sample of the cumulative network response.
-    :rtype: list
+    :rtype: numpy.ndarray
     """
-    cum_net_resp = np.load('tmp' + str(instance) +
-                           '/node_' + str(node_lis[0]) + '.npy')[0]
-    os.remove('tmp' + str(instance) + '/node_' + str(node_lis[0]) + '.npy')
-    indeces = np.ones(len(cum_net_resp)) * node_lis[0]
-    for i in node_lis[1:]:
-        node_energy = np.load('tmp' + str(instance) + '/node_' +
-                              str(i) + '.npy')[0]
-        updated_indeces = np.argmax([cum_net_resp, node_energy], axis=0)
-        temp = np.array([cum_net_resp, node_energy])
-        cum_net_resp = np.array([temp[updated_indeces[j]][j]
-                                 for j in range(len(updated_indeces))])
-        del temp, node_energy
-        updated_indeces[updated_indeces == 1] = i
-        indeces = updated_indeces
-        os.remove('tmp' + str(instance) + '/node_' + str(i) + '.npy')
+    cum_net_resp = _node_loop(energy=energy, lags=lags[:, 0])[1][0]
+    indeces = np.zeros(len(cum_net_resp), dtype=np.int64) + node_lis[0]
+    for k, i in enumerate(node_lis[1:]):
+        node_energy = _node_loop(energy=energy, lags=lags[:, k + 1])[1][0]
+        # Ties keep the first node, as for argmax
+        updated = node_energy > cum_net_resp
+        cum_net_resp = np.maximum(cum_net_resp, node_energy)
+        indeces = np.where(updated, i, indeces)
     return cum_net_resp, indeces
 
 
@@ -530,7 +608,7 @@ def coherence(stream_in, stations=['all'], clip=False):
 def brightness(stations, nodes, lags, stream, threshold, thresh_type,
                template_length, template_saveloc, coherence_thresh,
                coherence_stations=['all'], coherence_clip=False,
-               gap=2.0, clip_level=100, instance=0, pre_pick=0.2,
+               gap=2.0, clip_level=100, instance=None, pre_pick=0.2,
                plotsave=True, cores=1, debug=0):
     """
     Calculate the brightness function for a single day.
@@ -593,7 +671,8 @@ def brightness(stations, nodes, lags, stream, threshold, thresh_type,
         spikes) from the energy stack.
     :type instance: int
     :param instance:
-        Optional, used for tracking when using a distributed computing system.
+        Deprecated and ignored: no temporary files are written, so instances
+        on a distributed computing system no longer need to be kept apart.
     :type pre_pick: float
     :param pre_pick: Seconds before the detection time to include in template
     :type plotsave: bool
@@ -610,6 +689,9 @@ def brightness(stations, nodes, lags, stream, threshold, thresh_type,
     :return: list of templates as :class:`obspy.core.stream.Stream` objects
     :rtype: list
     """
+    if instance is not None:
+        warnings.warn('instance is ignored and will be removed in a future '
+                      'version', EQcorrscanDeprecationWarning)
     if plotsave:
         import matplotlib
         matplotlib.use('Agg')
@@ -632,98 +714,48 @@ def brightness(stations, nodes, lags, stream, threshold, thresh_type,
             # Make sure that the data aren't clipped it they are high gain
             # scale the data
         tr.data = tr.data.astype(np.int16)
-    # The internal _node_loop converts energy to int16 too to converse memory,
-    # to do this it forces the maximum of a single energy trace to be 500 and
-    # normalises to this level - this only works for fewer than 65 channels of
-    # data
+    # The internal _station_energy converts energy to uint16 to conserve
+    # memory, to do this it forces the maximum of a single energy trace to be
+    # 500 and normalises to this level - this only works for fewer than 130
+    # channels of data
     if len(stream_copy) > 130:
         raise OverflowError('Too many streams, either re-code and cope with' +
                             'either more memory usage, or less precision, or' +
                             'reduce data volume')
     detections = []
     detect_lags = []
-    parallel = True
     plotvar = False
-    mem_issue = False
-    # Loop through each node in the input
-    # Linear run
     print('Computing the energy stacks')
-    if not parallel:
-        for i in range(0, len(nodes)):
-            print(i)
-            if not mem_issue:
-                j, a = _node_loop(stations, lags[:, i], stream, plot=True)
-                if 'energy' not in locals():
-                    energy = a
-                else:
-                    energy = np.concatenate((energy, a), axis=0)
-                print('energy: ' + str(np.shape(energy)))
-            else:
-                j, filename = _node_loop(stations, lags[:, i], stream, i,
-                                         mem_issue)
-        energy = np.array(energy)
-        print(np.shape(energy))
-    else:
-        # Parallel run
-        num_cores = cores
-        if num_cores > len(nodes):
-            num_cores = len(nodes)
-        if num_cores > cpu_count():
-            num_cores = cpu_count()
-        pool = Pool(processes=num_cores)
-        results = [pool.apply_async(_node_loop, args=(stations, lags[:, i],
-                                                      stream, i, clip_level,
-                                                      mem_issue, instance))
-                   for i in range(len(nodes))]
-        pool.close()
-        if not mem_issue:
-            print('Computing the cumulative network response from memory')
-            energy = [p.get() for p in results]
-            pool.join()
-            energy.sort(key=lambda tup: tup[0])
-            energy = [node[1] for node in energy]
-            energy = np.concatenate(energy, axis=0)
-            print(energy.shape)
-        else:
-            pool.join()
+    energy, station_indices = _station_energy(stations=stations,
+                                              stream=stream,
+                                              clip_level=clip_level)
+    # Lags as an integer index matrix of traces by nodes
+    lag_samples = np.round(np.asarray(lags)[station_indices] *
+                           stream[0].stats.sampling_rate).astype(np.int64)
+    num_cores = max(min(cores, len(nodes), cpu_count()), 1)
+    node_splits = np.array_split(np.arange(len(nodes)), num_cores)
     # Now compute the cumulative network response and then detect possible
     # events
-    if not mem_issue:
-        print(energy.shape)
-        indeces = np.argmax(energy, axis=0)  # Indeces of maximum energy
-        print(indeces.shape)
-        cum_net_resp = np.array([np.nan] * len(indeces))
-        cum_net_resp[0] = energy[indeces[0]][0]
-        peak_nodes = [nodes[indeces[0]]]
-        for i in range(1, len(indeces)):
-            cum_net_resp[i] = energy[indeces[i]][i]
-            peak_nodes.append(nodes[indeces[i]])
-        del energy, indeces
+    if num_cores == 1:
+        results = [_cum_net_resp(energy=energy, lags=lag_samples,
+                                 node_lis=node_splits[0])]
     else:
-        print('Reading the temp files and computing network response')
-        node_splits = int(len(nodes) // num_cores)
-        indeces = [range(node_splits)]
-        for i in range(1, num_cores - 1):
-            indeces.append(range(node_splits * i, node_splits * (i + 1)))
-        indeces.append(range(node_splits * (i + 1), len(nodes)))
         pool = Pool(processes=num_cores)
-        results = [pool.apply_async(_cum_net_resp, args=(indeces[i], instance))
-                   for i in range(num_cores)]
+        results = [pool.apply_async(_cum_net_resp,
+                                    args=(energy, lag_samples[:, node_lis],
+                                          node_lis))
+                   for node_lis in node_splits]
         pool.close()
         results = [p.get() for p in results]
         pool.join()
-        responses = [result[0] for result in results]
-        print(np.shape(responses))
-        node_indeces = [result[1] for result in results]
-        cum_net_resp = np.array(responses)
-        indeces = np.argmax(cum_net_resp, axis=0)
-        print(indeces.shape)
-        print(cum_net_resp.shape)
-        cum_net_resp = np.array([cum_net_resp[indeces[i]][i]
-                                 for i in range(len(indeces))])
-        peak_nodes = [nodes[node_indeces[indeces[i]][i]]
-                      for i in range(len(indeces))]
-        del indeces, node_indeces
+    del energy
+    cum_net_resp, indeces = results[0]
+    for response, node_indeces in results[1:]:
+        updated = response > cum_net_resp
+        cum_net_resp = np.maximum(cum_net_resp, response)
+        indeces = np.where(updated, node_indeces, indeces)
+    peak_nodes = [nodes[i] for i in indeces]
+    del indeces
     if plotvar:
         cum_net_trace = deepcopy(stream[0])
         cum_net_trace.data = cum_net_resp
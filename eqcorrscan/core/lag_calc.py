@@ -14,21 +14,24 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import numpy as np
-import scipy
 import warnings
 import logging
 import sys
+import os
+import shutil
+import tempfile
 
 from multiprocessing import Pool, cpu_count
 from collections import Counter
+from scipy.fftpack import next_fast_len
 
-from obspy import Stream
+from obspy import Stream, Trace
 from obspy.core.event import Catalog
 from obspy.core.event import Event, Pick, WaveformStreamID
 from obspy.core.event import ResourceIdentifier, Comment
 
 from eqcorrscan.utils.plotting import plot_repicked, detection_multiplot
-from eqcorrscan.core.match_filter import normxcorr2
+from eqcorrscan.core.match_filter import normxcorr2, _shared_data
 
 # Set up logging
 log = logging.getLogger(__name__)
@@ -69,43 +72,105 @@ def _xcorr_interp(ccc, dt):
         cc = ccc[0]
     else:
         cc = ccc
-    # Code borrowed from obspy.signal.cross_correlation.xcorr_pick_correction
-    cc_curvature = np.concatenate((np.zeros(1), np.diff(cc, 2), np.zeros(1)))
-    cc_t = np.arange(0, len(cc) * dt, dt)
-    peak_index = cc.argmax()
-    first_sample = peak_index
-    # XXX this could be improved..
-    while first_sample > 0 and cc_curvature[first_sample - 1] <= 0:
-        first_sample -= 1
-    last_sample = peak_index
-    while last_sample < len(cc) - 1 and cc_curvature[last_sample + 1] <= 0:
-        last_sample += 1
-    num_samples = last_sample - first_sample + 1
-    if num_samples < 3:
+    shifts, coeffs, num_samples = _multi_xcorr_interp(cccs=cc[np.newaxis],
+                                                      dt=dt)
+    if num_samples[0] < 3:
         msg = "Less than 3 samples selected for fit to cross " + \
-              "correlation: %s" % num_samples
+              "correlation: %s" % num_samples[0]
         raise IndexError(msg)
-    if num_samples < 5:
+    return shifts[0], coeffs[0]
+
+
+def _multi_xcorr_interp(cccs, dt):
+    """
+    Interpolate around the maxima of many correlation functions at once.
+
+    A parabola is fitted by least-squares to the samples around the maximum
+    of each correlation function, extending either side of the maximum
+    while the curvature is not positive (as in
+    obspy.signal.cross_correlation.xcorr_pick_correction).  All the fits
+    are solved together in closed form.
+
+    :type cccs: numpy.ndarray
+    :param cccs: 2-D array of correlation functions, one per row.
+    :type dt: float
+    :param dt: Sample interval in seconds.
+
+    :returns:
+        Array of positions of the interpolated maxima in seconds from the
+        start of each correlation function, array of the interpolated
+        maximum correlations, and array of the number of samples used in
+        each fit.  Fits to fewer than 3 samples are not made, and the
+        position and value of the sampled maximum are returned instead.
+    :rtype: tuple
+    """
+    cccs = np.asarray(cccs, dtype=np.float64)
+    n, length = cccs.shape
+    rows = np.arange(n)
+    samples = np.arange(length)
+    peak_index = cccs.argmax(axis=1)
+    curvature = np.zeros(cccs.shape)
+    curvature[:, 1:-1] = np.diff(cccs, 2, axis=1)
+    positive = curvature > 0
+    # Nearest positive curvature either side of each sample
+    last_positive = np.maximum.accumulate(
+        np.where(positive, samples, -1), axis=1)
+    next_positive = np.minimum.accumulate(
+        np.where(positive, samples, length)[:, ::-1], axis=1)[:, ::-1]
+    first_sample = np.where(
+        peak_index > 0,
+        last_positive[rows, np.maximum(peak_index - 1, 0)] + 1, 0)
+    last_sample = np.where(
+        peak_index < length - 1,
+        next_positive[rows, np.minimum(peak_index + 1, length - 1)] - 1,
+        length - 1)
+    num_samples = last_sample - first_sample + 1
+    fitted = num_samples >= 3
+    if np.any(fitted & (num_samples < 5)):
         msg = "Less than 5 samples selected for fit to cross " + \
-              "correlation: %s" % num_samples
+              "correlation for %i of %i correlations" % (
+                  np.sum(fitted & (num_samples < 5)), n)
         warnings.warn(msg)
-    coeffs, residual = scipy.polyfit(
-        cc_t[first_sample:last_sample + 1],
-        cc[first_sample:last_sample + 1], deg=2, full=True)[:2]
-    # check results of fit
-    if coeffs[0] >= 0:
-        msg = "Fitted parabola opens upwards!"
+    # Least-squares fit of y = a * x ** 2 + b * x + c, with x in samples
+    # relative to the peak to keep the normal equations well conditioned.
+    window = ((samples >= first_sample[:, np.newaxis]) &
+              (samples <= last_sample[:, np.newaxis]))
+    x = (samples - peak_index[:, np.newaxis]).astype(np.float64)
+    x_powers = [np.sum(window * x ** k, axis=1) for k in range(5)]
+    y = np.where(window, cccs, 0)
+    xy = [np.sum(y * x ** k, axis=1) for k in range(3)]
+    normal = np.empty((n, 3, 3))
+    for row in range(3):
+        for column in range(3):
+            normal[:, row, column] = x_powers[4 - row - column]
+    rhs = np.stack([xy[2], xy[1], xy[0]], axis=1)
+    # Solve an identity for fits not made to avoid singular matrices
+    normal[~fitted] = np.eye(3)
+    coeffs = np.linalg.solve(normal, rhs[:, :, np.newaxis])[:, :, 0]
+    a, b, c = coeffs[:, 0], coeffs[:, 1], coeffs[:, 2]
+    residual = np.sum(
+        window * (cccs - (a[:, np.newaxis] * x ** 2 +
+                          b[:, np.newaxis] * x + c[:, np.newaxis])) ** 2,
+        axis=1)
+    # Check results of fit
+    if np.any(fitted & (a >= 0)):
+        msg = "Fitted parabola opens upwards for %i of %i correlations" % (
+            np.sum(fitted & (a >= 0)), n)
         warnings.warn(msg)
-    if residual > 0.1:
+    if np.any(fitted & (residual > 0.1)):
         msg = "Residual in quadratic fit to cross correlation maximum " + \
-              "larger than 0.1: %s" % residual
+              "larger than 0.1 for %i of %i correlations" % (
+                  np.sum(fitted & (residual > 0.1)), n)
         warnings.warn(msg)
     # X coordinate of vertex of parabola gives time shift to correct
     # differential pick time. Y coordinate gives maximum correlation
     # coefficient.
-    shift = -coeffs[1] / 2.0 / coeffs[0]
-    coeff = (4 * coeffs[0] * coeffs[2] - coeffs[1] ** 2) / (4 * coeffs[0])
-    return shift, coeff
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shifts = np.where(fitted, (peak_index - b / (2.0 * a)) * dt,
+                          peak_index * dt)
+        coeffs = np.where(fitted, c - b ** 2 / (4.0 * a),
+                          cccs[rows, peak_index])
+    return shifts, coeffs, num_samples
 
 
 def _channel_loop(detection, template, min_cc, detection_id, interpolate, i,
@@ -143,6 +208,62 @@ def _channel_loop(detection, template, min_cc, detection_id, interpolate, i,
         Number of channels originally used in detections, must match the number
         used here to allow for cccsum checking.
 
+    :returns:
+        Event object containing network, station, channel and pick information.
+    :rtype: :class:`obspy.core.event.Event`
+    """
+    correlations = []
+    for tr in template:
+        image = detection.select(station=tr.stats.station,
+                                 channel=tr.stats.channel)
+        if not image:
+            correlations.append(None)
+            continue
+        ccc = normxcorr2(tr.data, image[0].data)
+        if interpolate:
+            try:
+                shift, cc_max = _xcorr_interp(ccc=ccc,
+                                              dt=image[0].stats.delta)
+            except IndexError:
+                log.error('Could not interpolate ccc, not smooth')
+                cc_max = np.amax(ccc)
+                shift = np.argmax(ccc) * image[0].stats.delta
+        else:
+            cc_max = np.amax(ccc)
+            shift = np.argmax(ccc) * image[0].stats.delta
+        # Convert the maximum cross-correlation time to an actual time
+        correlations.append((cc_max, np.amax(ccc),
+                             image[0].stats.starttime + shift))
+    event = _make_event(
+        template=template, correlations=correlations, min_cc=min_cc,
+        detection_id=detection_id, pre_lag_ccsum=pre_lag_ccsum,
+        detect_chans=detect_chans)
+    return i, event
+
+
+def _make_event(template, correlations, min_cc, detection_id,
+                pre_lag_ccsum=None, detect_chans=0):
+    """
+    Make an event with picks from the correlations of a detection.
+
+    :type template: obspy.core.stream.Stream
+    :param template: Stream of data as the template for the detection.
+    :type correlations: list
+    :param correlations:
+        List of one tuple of (maximum correlation, maximum sampled
+        correlation, pick time) for each trace of the template, or None for
+        traces with no data for the detection.
+    :type min_cc: float
+    :param min_cc: Minimum cross-correlation value to allow a pick to be made.
+    :type detection_id: str
+    :param detection_id: Detection ID to associate the event with.
+    :type pre_lag_ccsum: float
+    :param pre_lag_ccsum:
+        Cross-correlation sum before lag-calc, see
+        :func:`eqcorrscan.core.lag_calc._channel_loop`.
+    :type detect_chans: int
+    :param detect_chans: Number of channels originally used in detections.
+
     :returns:
         Event object containing network, station, channel and pick information.
     :rtype: :class:`obspy.core.event.Event`
@@ -153,70 +274,51 @@ def _channel_loop(detection, template, min_cc, detection_id, interpolate, i,
     cccsum = 0
     checksum = 0
     used_chans = 0
-    for tr in template:
+    for tr, correlation in zip(template, correlations):
+        if correlation is None:
+            continue
+        cc_max, ccc_max, picktime = correlation
         temp_net = tr.stats.network
         temp_sta = tr.stats.station
         temp_chan = tr.stats.channel
-        image = detection.select(station=temp_sta,
-                                 channel=temp_chan)
-        if image:
-            if interpolate:
-                try:
-                    ccc = normxcorr2(tr.data, image[0].data)
-                    shift, cc_max = _xcorr_interp(ccc=ccc,
-                                                  dt=image[0].stats.delta)
-                except IndexError:
-                    log.error('Could not interpolate ccc, not smooth')
-                    ccc = normxcorr2(tr.data, image[0].data)
-                    cc_max = np.amax(ccc)
-                    shift = np.argmax(ccc) * image[0].stats.delta
-                # Convert the maximum cross-correlation time to an actual time
-                picktime = image[0].stats.starttime + shift
-            else:
-                # Convert the maximum cross-correlation time to an actual time
-                ccc = normxcorr2(tr.data, image[0].data)
-                cc_max = np.amax(ccc)
-                picktime = image[0].stats.starttime + (np.argmax(ccc) *
-                                                       image[0].stats.delta)
-            log.debug('********DEBUG: Maximum cross-corr=%s' % cc_max)
-            checksum += cc_max
-            used_chans += 1
-            if cc_max < min_cc:
-                continue
-            cccsum += cc_max
-            # Perhaps weight each pick by the cc val or cc val^2?
-            # weight = np.amax(ccc) ** 2
-            if temp_chan[-1:] == 'Z':
-                phase = 'P'
-            # Only take the S-pick with the best correlation
-            elif temp_chan[-1:] in ['E', 'N']:
-                phase = 'S'
-                if temp_sta not in s_stachans and np.amax(ccc) > min_cc:
-                    s_stachans[temp_sta] = ((temp_chan, np.amax(ccc),
-                                             picktime))
-                elif temp_sta in s_stachans and np.amax(ccc) > min_cc:
-                    if np.amax(ccc) > s_stachans[temp_sta][1]:
-                        picktime = picktime
-                    else:
-                        picktime = s_stachans[temp_sta][2]
-                        temp_chan = s_stachans[temp_sta][0]
-                elif np.amax(ccc) < min_cc and temp_sta not in used_s_sta:
-                    used_s_sta.append(temp_sta)
+        log.debug('********DEBUG: Maximum cross-corr=%s' % cc_max)
+        checksum += cc_max
+        used_chans += 1
+        if cc_max < min_cc:
+            continue
+        cccsum += cc_max
+        # Perhaps weight each pick by the cc val or cc val^2?
+        # weight = np.amax(ccc) ** 2
+        if temp_chan[-1:] == 'Z':
+            phase = 'P'
+        # Only take the S-pick with the best correlation
+        elif temp_chan[-1:] in ['E', 'N']:
+            phase = 'S'
+            if temp_sta not in s_stachans and ccc_max > min_cc:
+                s_stachans[temp_sta] = ((temp_chan, ccc_max, picktime))
+            elif temp_sta in s_stachans and ccc_max > min_cc:
+                if ccc_max > s_stachans[temp_sta][1]:
+                    picktime = picktime
                 else:
-                    continue
+                    picktime = s_stachans[temp_sta][2]
+                    temp_chan = s_stachans[temp_sta][0]
+            elif ccc_max < min_cc and temp_sta not in used_s_sta:
+                used_s_sta.append(temp_sta)
             else:
-                phase = None
-            _waveform_id = WaveformStreamID(network_code=temp_net,
-                                            station_code=temp_sta,
-                                            channel_code=temp_chan)
-            event.picks.append(Pick(waveform_id=_waveform_id,
-                                    time=picktime,
-                                    method_id=ResourceIdentifier('EQcorrscan'),
-                                    phase_hint=phase,
-                                    creation_info='eqcorrscan.core.lag_calc',
-                                    comments=[Comment(text='cc_max=%s'
-                                                      % cc_max)]))
-            event.resource_id = detection_id
+                continue
+        else:
+            phase = None
+        _waveform_id = WaveformStreamID(network_code=temp_net,
+                                        station_code=temp_sta,
+                                        channel_code=temp_chan)
+        event.picks.append(Pick(waveform_id=_waveform_id,
+                                time=picktime,
+                                method_id=ResourceIdentifier('EQcorrscan'),
+                                phase_hint=phase,
+                                creation_info='eqcorrscan.core.lag_calc',
+                                comments=[Comment(text='cc_max=%s'
+                                                  % cc_max)]))
+        event.resource_id = detection_id
     ccc_str = ("detect_val=%s" % cccsum)
     event.comments.append(Comment(text=ccc_str))
     if used_chans == detect_chans:
@@ -228,11 +330,199 @@ def _channel_loop(detection, template, min_cc, detection_id, interpolate, i,
         warnings.warn('Cannot check is cccsum is better, used %i channels '
                       'for detection, but %i are used here'
                       % (detect_chans, used_chans))
-    return i, event
+    return event
+
+
+def _stacked_normxcorr(template, images):
+    """
+    Normalised cross-correlation of one template with many images at once.
+
+    All images are Fourier transformed together, with the normalisation of
+    :func:`cv2.TM_CCOEFF_NORMED` (as used by
+    :func:`eqcorrscan.core.match_filter.normxcorr2`) computed for every
+    window of every image by running sums.
+
+    :type template: numpy.ndarray
+    :param template: 1-D template array.
+    :type images: numpy.ndarray
+    :param images: 2-D array of images of the same length, one per row.
+
+    :returns:
+        2-D array of correlations of shape
+        (len(images), images.shape[1] - len(template) + 1).  Windows with no
+        variance, and templates with no variance, give zero correlations.
+    :rtype: numpy.ndarray
+    """
+    template = np.asarray(template, dtype=np.float64)
+    images = np.atleast_2d(np.asarray(images, dtype=np.float64))
+    template_len = len(template)
+    ccc_len = images.shape[1] - template_len + 1
+    ccc = np.zeros((len(images), ccc_len))
+    template = template - template.mean()
+    norm = np.sqrt(np.sum(template ** 2))
+    if norm == 0:
+        return ccc
+    images = images - images.mean(axis=1)[:, np.newaxis]
+    zeros = np.zeros((len(images), 1))
+    cumsum = np.concatenate([zeros, np.cumsum(images, axis=1)], axis=1)
+    cumsum_sq = np.concatenate([zeros, np.cumsum(images ** 2, axis=1)],
+                               axis=1)
+    window_sum = cumsum[:, template_len:] - cumsum[:, :-template_len]
+    window_energy = (cumsum_sq[:, template_len:] -
+                     cumsum_sq[:, :-template_len] -
+                     (window_sum ** 2) / template_len)
+    # Energies at the level of rounding error are zero-variance windows
+    min_energy = 10 * np.finfo(np.float64).eps * cumsum_sq[:, -1:]
+    valid = window_energy > min_energy
+    fft_len = next_fast_len(images.shape[1])
+    corr = np.fft.irfft(
+        np.fft.rfft(images, n=fft_len, axis=1) *
+        np.conj(np.fft.rfft(template / norm, n=fft_len)),
+        n=fft_len, axis=1)[:, 0:ccc_len]
+    ccc[valid] = corr[valid] / np.sqrt(window_energy[valid])
+    return ccc
+
+
+def _stack_loop(template, images, dt, interpolate, i=0):
+    """
+    Correlate a stack of detection windows with one template trace.
+
+    :type template: numpy.ndarray
+    :param template: Data of the template trace.
+    :type images: numpy.ndarray or tuple
+    :param images:
+        2-D array of detection windows of the same length, one per row, or
+        a tuple of (path, offset, shape) giving the position of the windows
+        in a memory-mapped file written by
+        :func:`eqcorrscan.core.lag_calc._batch_loop`, so that windows are
+        not copied to worker processes.
+    :type dt: float
+    :param dt: Sample interval in seconds.
+    :type interpolate: bool
+    :param interpolate:
+        Interpolate the correlation function to achieve sub-sample precision.
+    :type i: int
+    :param i: Used to track which process has occurred when run in parallel.
+
+    :returns:
+        Tuple of (i, shifts, cc_maxes, ccc_maxes, unfitted) where shifts are
+        the times of the maximum correlations in seconds from the start of
+        each window, cc_maxes the (interpolated) maximum correlations,
+        ccc_maxes the maximum sampled correlations and unfitted the number
+        of correlations which could not be interpolated.
+    :rtype: tuple
+    """
+    if not isinstance(images, np.ndarray):
+        path, offset, shape = images
+        images = np.asarray(_shared_data(path)[
+            offset:offset + shape[0] * shape[1]]).reshape(shape)
+    if images.shape[1] < len(template):
+        raise LagCalcError('Detection data are shorter than the template')
+    cccs = _stacked_normxcorr(template, images)
+    ccc_maxes = cccs.max(axis=1)
+    unfitted = 0
+    if interpolate:
+        shifts, cc_maxes, num_samples = _multi_xcorr_interp(cccs=cccs, dt=dt)
+        unfitted = int(np.sum(num_samples < 3))
+    else:
+        shifts = cccs.argmax(axis=1) * dt
+        cc_maxes = ccc_maxes
+    return i, shifts, cc_maxes, ccc_maxes, unfitted
+
+
+def _batch_loop(detection_streams, template, min_cc, detections,
+                interpolate, pool=None, shared_dir=None):
+    """
+    Correlate all detections of one template together, channel by channel.
+
+    For each trace of the template the windows of all detections with data
+    for that channel are stacked and correlated in one call to
+    :func:`eqcorrscan.core.lag_calc._stacked_normxcorr`, giving the same
+    events as running :func:`eqcorrscan.core.lag_calc._channel_loop` for
+    each detection.
+
+    :type detection_streams: list
+    :param detection_streams:
+        List of :class:`obspy.core.stream.Stream` of data for each detection.
+    :type template: obspy.core.stream.Stream
+    :param template: The template used to make the detections.
+    :type min_cc: float
+    :param min_cc: Minimum cross-correlation value to be allowed for a pick.
+    :type detections: list
+    :param detections:
+        List of detections to associate events with an input detection.
+    :type interpolate: bool
+    :param interpolate:
+        Interpolate the correlation function to achieve sub-sample precision.
+    :type pool: multiprocessing.Pool
+    :param pool:
+        Pool of processes to correlate the stacks of each channel in
+        parallel, or None to run in serial.
+    :type shared_dir: str
+    :param shared_dir:
+        Directory to write the detection windows to for sharing with the
+        pool, required if pool is given.
+
+    :returns: List of events, one per detection.
+    :rtype: list
+    """
+    # Group windows by channel and length so that each group can be stacked
+    stacks = []
+    for j, tr in enumerate(template):
+        groups = {}
+        for i, detection_stream in enumerate(detection_streams):
+            image = detection_stream.select(station=tr.stats.station,
+                                            channel=tr.stats.channel)
+            if not image:
+                continue
+            groups.setdefault(len(image[0].data), []).append((i, image[0]))
+        stacks.extend([(j, members) for members in groups.values()])
+    if pool is None or len(stacks) == 0:
+        results = [_stack_loop(
+            template=template[j].data, images=np.array(
+                [image.data for _, image in members], dtype=np.float32),
+            dt=members[0][1].stats.delta, interpolate=interpolate, i=k)
+            for k, (j, members) in enumerate(stacks)]
+    else:
+        # Hold the windows for every channel in one contiguous buffer that
+        # the workers index into.
+        shapes = [(len(members), len(members[0][1].data))
+                  for _, members in stacks]
+        offsets = np.cumsum([0] + [n * m for n, m in shapes])
+        handle, path = tempfile.mkstemp(suffix='.npy', dir=shared_dir)
+        os.close(handle)
+        shared = np.lib.format.open_memmap(
+            path, mode='w+', dtype=np.float32, shape=(int(offsets[-1]), ))
+        for (_, members), offset, shape in zip(stacks, offsets, shapes):
+            shared[offset:offset + shape[0] * shape[1]] = np.concatenate(
+                [image.data for _, image in members])
+        shared.flush()
+        del shared
+        results = [pool.apply_async(_stack_loop, args=(
+            template[j].data, (path, int(offset), shape),
+            members[0][1].stats.delta, interpolate, k))
+            for k, ((j, members), offset, shape) in enumerate(
+                zip(stacks, offsets, shapes))]
+        results = [result.get() for result in results]
+    correlations = [[None] * len(template) for _ in detection_streams]
+    for (j, members), result in zip(stacks, results):
+        _, shifts, cc_maxes, ccc_maxes, unfitted = result
+        if unfitted:
+            log.error('Could not interpolate ccc, not smooth')
+        for (i, image), shift, cc_max, ccc_max in zip(
+                members, shifts, cc_maxes, ccc_maxes):
+            # Convert the maximum cross-correlation time to an actual time
+            correlations[i][j] = (cc_max, ccc_max,
+                                  image.stats.starttime + shift)
+    return [_make_event(
+        template=template, correlations=correlations[i], min_cc=min_cc,
+        detection_id=detection.id, pre_lag_ccsum=detection.detect_val,
+        detect_chans=detection.no_chans)
+        for i, detection in enumerate(detections)]
 
 
 def _day_loop(detection_streams, template, min_cc, detections, interpolate,
-              cores, parallel):
+              cores, parallel, pool=None, shared_dir=None):
     """
     Function to loop through multiple detections for one template.
 
@@ -255,49 +545,93 @@ def _day_loop(detection_streams, template, min_cc, detections, interpolate,
     :type interpolate: bool
     :param interpolate:
         Interpolate the correlation function to achieve sub-sample precision.
+    :type cores: int
+    :param cores:
+        Number of processes to use if running in parallel without a pool.
+    :type parallel: bool
+    :param parallel:
+        Whether to correlate the channels of the template in parallel.
+    :type pool: multiprocessing.Pool
+    :param pool:
+        Pool of processes to re-use if running in parallel, if None a pool
+        is made and closed for this template when more than one process is
+        used.
+    :type shared_dir: str
+    :param shared_dir:
+        Directory to share detection windows with the pool through, required
+        if pool is given.
 
     :returns:
         Catalog object containing Event objects for each detection created by
         this template.
     :rtype: :class:`obspy.core.event.Catalog`
     """
-    if not cores:
-        num_cores = cpu_count()
+    detections = detections[0:len(detection_streams)]
+    num_cores = cores or cpu_count()
+    if not parallel or (pool is None and num_cores == 1):
+        events = _batch_loop(
+            detection_streams=detection_streams, template=template,
+            min_cc=min_cc, detections=detections, interpolate=interpolate)
+    elif pool is not None:
+        events = _batch_loop(
+            detection_streams=detection_streams, template=template,
+            min_cc=min_cc, detections=detections, interpolate=interpolate,
+            pool=pool, shared_dir=shared_dir)
     else:
-        num_cores = cores
-    if num_cores > len(detection_streams):
-        num_cores = len(detection_streams)
-    if parallel:
         pool = Pool(processes=num_cores)
         log.debug('Made pool of %i workers' % num_cores)
-        # Parallelize generation of events for each detection:
-        # results will be a list of (i, event class)
-        results = [pool.apply_async(_channel_loop, args=(detection_streams[i],
-                                                         template, min_cc,
-                                                         detections[i].id,
-                                                         interpolate, i,
-                                                         detections[i].
-                                                         detect_val,
-                                                         detections[i].
-                                                         no_chans))
-                   for i in range(len(detection_streams))]
-        pool.close()
-        events_list = [p.get() for p in results]
-        pool.join()
-        events_list.sort(key=lambda tup: tup[0])  # Sort based on index.
-    else:
-        events_list = []
-        for i in range(len(detection_streams)):
-            events_list.append(_channel_loop(detection_streams[i],
-                                             template, min_cc,
-                                             detections[i].id, interpolate, i,
-                                             detections[i].detect_val,
-                                             detections[i].no_chans))
+        shared_dir = tempfile.mkdtemp()
+        try:
+            events = _batch_loop(
+                detection_streams=detection_streams, template=template,
+                min_cc=min_cc, detections=detections,
+                interpolate=interpolate, pool=pool, shared_dir=shared_dir)
+        finally:
+            pool.close()
+            pool.join()
+            shutil.rmtree(shared_dir)
     temp_catalog = Catalog()
-    temp_catalog.events = [event_tup[1] for event_tup in events_list]
+    temp_catalog.events = events
     return temp_catalog
 
 
+def _slice_trace(tr, starttime, endtime):
+    """
+    Cut a trace between two times without copying its data.
+
+    Samples are selected as in :func:`obspy.core.trace.Trace.trim` with
+    nearest_sample=True, and the data of the returned trace are a view of
+    the data of the input trace.
+
+    :type tr: obspy.core.trace.Trace
+    :param tr: Trace to cut.
+    :type starttime: obspy.core.utcdatetime.UTCDateTime
+    :param starttime: Start of the window.
+    :type endtime: obspy.core.utcdatetime.UTCDateTime
+    :param endtime: End of the window.
+
+    :rtype: obspy.core.trace.Trace
+    """
+    def _round_away(number):
+        return int(np.sign(number) * np.floor(abs(number) + 0.5))
+
+    sampling_rate = tr.stats.sampling_rate
+    start = _round_away(round((starttime - tr.stats.starttime) *
+                              sampling_rate, 7))
+    end_cut = _round_away(round((tr.stats.endtime - endtime) *
+                                sampling_rate, 7))
+    start = min(max(start, 0), tr.stats.npts)
+    end = max(tr.stats.npts - max(end_cut, 0), start)
+    if tr.stats.starttime + start * tr.stats.delta > endtime:
+        # The nearest sample to the start is after the end of the window
+        end = start
+    data = tr.data[start:end]
+    header = tr.stats.copy()
+    header.npts = len(data)
+    header.starttime = tr.stats.starttime + start * tr.stats.delta
+    return Trace(data=data, header=header)
+
+
 def _prepare_data(detect_data, detections, zipped_templates, delays,
                   shift_len, plot):
     """
@@ -321,63 +655,66 @@ def _prepare_data(detect_data, detections, zipped_templates, delays,
 
     :returns: List of detect_streams to be worked on
     :rtype: list
+
+    .. note::
+        The traces of the detect_streams share their data with the traces
+        of detect_data (they are views of the same arrays), so should not
+        be edited in place.
     """
+    # Look-ups of template traces and delays by template name and stachan
+    templates = {}
+    for name, template in zipped_templates:
+        templates.setdefault(str(name), template)
+    template_lengths = {}
+    for name, template in templates.items():
+        lengths = template_lengths.setdefault(name, {})
+        for tr in template:
+            lengths.setdefault((tr.stats.station, tr.stats.channel),
+                               len(tr) / tr.stats.sampling_rate)
+    template_delays = {}
+    for name, temp_delays in delays:
+        name_delays = template_delays.setdefault(str(name), {})
+        for sta, chan, delay in temp_delays:
+            name_delays.setdefault((sta, chan), delay)
     detect_streams = []
     for detection in detections:
         # Stream to be saved for new detection
         detect_stream = []
         max_delay = 0
+        name = str(detection.template_name)
+        if name not in templates:
+            warnings.warn('No template with name: %s' %
+                          detection.template_name)
+            continue
+        lengths = template_lengths[name]
         for tr in detect_data:
-            tr_copy = tr.copy()
-            # Right now, copying each trace hundreds of times...
-            template = [t for t in zipped_templates
-                        if str(t[0]) == str(detection.template_name)]
-            if len(template) > 0:
-                template = template[0]
-            else:
-                warnings.warn('No template with name: %s' %
-                              detection.template_name)
-                for t in zipped_templates:
-                    print(t)
+            stachan = (tr.stats.station, tr.stats.channel)
+            if stachan not in lengths:
+                # If there is no template-data match then skip the trace
                 continue
-            template = template[1].select(station=tr.stats.station,
-                                          channel=tr.stats.channel)
-            if template:
-                # Save template trace length in seconds
-                template_len = len(template[0]) / \
-                    template[0].stats.sampling_rate
-            else:
-                continue
-                # If there is no template-data match then skip the rest
-                # of the trace loop.
-            # Grab the delays for the desired template: [(sta, chan, delay)]
-            delay = [delay for delay in delays if delay[0] == detection.
-                     template_name][0][1]
-            # Now grab the delay for the desired trace for this template
-            delay = [d for d in delay if d[0] == tr.stats.station and
-                     d[1] == tr.stats.channel][0][2]
+            # Save template trace length in seconds
+            template_len = lengths[stachan]
+            delay = template_delays[name][stachan]
             if delay > max_delay:
                 max_delay = delay
-            detect_stream.append(tr_copy.trim(starttime=detection.detect_time -
-                                              shift_len + delay,
-                                              endtime=detection.detect_time +
-                                              delay + shift_len +
-                                              template_len))
-            del tr_copy
-        for tr in detect_stream:
-            if len(tr.data) == 0:
+            window = _slice_trace(
+                tr, starttime=detection.detect_time - shift_len + delay,
+                endtime=detection.detect_time + delay + shift_len +
+                template_len)
+            if len(window.data) == 0:
                 msg = ('No data in %s.%s for detection at time %s' %
                        (tr.stats.station, tr.stats.channel,
                         detection.detect_time))
                 log.debug(msg)
                 warnings.warn(msg)
-                detect_stream.remove(tr)
-            if tr.stats.endtime - tr.stats.starttime < template_len:
+                continue
+            if window.stats.endtime - window.stats.starttime < template_len:
                 msg = ("Insufficient data for %s.%s will not use."
                        % (tr.stats.station, tr.stats.channel))
                 log.debug(msg)
                 warnings.warn(msg)
-                detect_stream.remove(tr)
+                continue
+            detect_stream.append(window)
         # Check for duplicate traces
         stachans = [(tr.stats.station, tr.stats.channel)
                     for tr in detect_stream]
@@ -535,45 +872,62 @@ def lag_calc(detections, detect_data, template_names, templates,
         del _template
     # Segregate detections by template, then feed to day_loop
     initial_cat = Catalog()
-    for template in zipped_templates:
-        log.info('Running lag-calc for template %s' % template[0])
-        template_detections = [detection for detection in detections
-                               if detection.template_name == template[0]]
-        log.info('There are %i detections' % len(template_detections))
-        detect_streams = _prepare_data(detect_data=detect_data,
-                                       detections=template_detections,
-                                       zipped_templates=zipped_templates,
-                                       delays=delays, shift_len=shift_len,
-                                       plot=prep_plot)
-        detect_streams = [detect_stream[1] for detect_stream in detect_streams]
-        if len(template_detections) > 0:
-            template_cat = _day_loop(detection_streams=detect_streams,
-                                     template=template[1], min_cc=min_cc,
-                                     detections=template_detections,
-                                     interpolate=interpolate, cores=cores,
-                                     parallel=parallel)
-            initial_cat += template_cat
-            if plot:
-                for i, event in enumerate(template_cat):
-                    if len(event.picks) == 0:
-                        log.warning('Made no picks for event at time %s' %
-                                    event)
-                        continue
-                    plot_stream = detect_streams[i].copy()
-                    pick_stachans = [(pick.waveform_id.station_code,
-                                      pick.waveform_id.channel_code)
-                                     for pick in event.picks]
-                    for tr in plot_stream:
-                        if (tr.stats.station, tr.stats.channel) \
-                                not in pick_stachans:
-                            plot_stream.remove(tr)
-                    template_plot = template[1].copy()
-                    for tr in template_plot:
-                        if (tr.stats.station, tr.stats.channel) \
-                                not in pick_stachans:
-                            template_plot.remove(tr)
-                    plot_repicked(template=template_plot, picks=event.picks,
-                                  det_stream=plot_stream)
+    pool, shared_dir = None, None
+    # A single process gains nothing from a pool
+    parallel = parallel and (cores or cpu_count()) > 1
+    if parallel:
+        # One pool for all templates, sharing data through files in
+        # shared_dir
+        pool = Pool(processes=cores or cpu_count())
+        shared_dir = tempfile.mkdtemp()
+    try:
+        for template in zipped_templates:
+            log.info('Running lag-calc for template %s' % template[0])
+            template_detections = [detection for detection in detections
+                                   if detection.template_name == template[0]]
+            log.info('There are %i detections' % len(template_detections))
+            detect_streams = _prepare_data(detect_data=detect_data,
+                                           detections=template_detections,
+                                           zipped_templates=zipped_templates,
+                                           delays=delays, shift_len=shift_len,
+                                           plot=prep_plot)
+            detect_streams = [detect_stream[1]
+                              for detect_stream in detect_streams]
+            if len(template_detections) > 0:
+                template_cat = _day_loop(detection_streams=detect_streams,
+                                         template=template[1], min_cc=min_cc,
+                                         detections=template_detections,
+                                         interpolate=interpolate, cores=cores,
+                                         parallel=parallel, pool=pool,
+                                         shared_dir=shared_dir)
+                initial_cat += template_cat
+                if plot:
+                    for i, event in enumerate(template_cat):
+                        if len(event.picks) == 0:
+                            log.warning('Made no picks for event at time %s' %
+                                        event)
+                            continue
+                        plot_stream = detect_streams[i].copy()
+                        pick_stachans = [(pick.waveform_id.station_code,
+                                          pick.waveform_id.channel_code)
+                                         for pick in event.picks]
+                        for tr in plot_stream:
+                            if (tr.stats.station, tr.stats.channel) \
+                                    not in pick_stachans:
+                                plot_stream.remove(tr)
+                        template_plot = template[1].copy()
+                        for tr in template_plot:
+                            if (tr.stats.station, tr.stats.channel) \
+                                    not in pick_stachans:
+                                template_plot.remove(tr)
+                        plot_repicked(template=template_plot,
+                                      picks=event.picks,
+                                      det_stream=plot_stream)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+            shutil.rmtree(shared_dir)
     sys.stdout.flush()
     # Order the catalogue to match the input
     output_cat = Catalog()
@@ -26,17 +26,21 @@ import numpy as np
 import cv2
 import warnings
 import ast
+import bisect
 import os
 import time
 import copy
+import shutil
+import tempfile
 
 from multiprocessing import Pool
-from collections import Counter
+from collections import Counter, deque
+from scipy.fftpack import next_fast_len
 from obspy import Trace, Catalog, UTCDateTime, Stream
-from obspy.core.event import Event, Pick, CreationInfo, ResourceIdentifier
+from obspy.core.event import Event, Pick, CreationInfo
 from obspy.core.event import Comment, WaveformStreamID
 
-from eqcorrscan.utils.timer import Timer
+from eqcorrscan.utils.profiling import Profile, cpu_time
 from eqcorrscan.utils import findpeaks
 
 
@@ -88,6 +92,30 @@ class DETECTION(object):
         :func:`eqcorrscan.core.match_filter.DETECTION.write`
     :type id: str
     :param id: Identification for detection (should be unique).
+    :type template_index: int
+    :param template_index:
+        Index of the template in the template bank used for detection.
+    :type sample_index: int
+    :param sample_index:
+        Index of the sample of the correlation sum at which the detection
+        was made.
+    :type chan_mask: numpy.ndarray
+    :param chan_mask:
+        Boolean array of the channels of the template bank used for this
+        detection.
+    :type context: eqcorrscan.core.match_filter._DetectionContext
+    :param context:
+        Template channels and delays to build the event from, shared by all
+        detections from one run of match_filter.
+
+    .. note::
+        Detections made by
+        :func:`eqcorrscan.core.match_filter.match_filter` only build their
+        `event` when it is first accessed, from the compact template_index,
+        sample_index and chan_mask, to save time and memory when making
+        many detections.  Use
+        :func:`eqcorrscan.core.match_filter.get_catalog` to build the events
+        of many detections at once.
 
     .. todo:: Use Obspy.core.event class instead of detection. Requires \
         internal knowledge of template parameters - which needs changes to \
@@ -97,7 +125,8 @@ class DETECTION(object):
     def __init__(self, template_name, detect_time,
                  no_chans, detect_val,
                  threshold, typeofdet,
-                 chans=None, event=None, id=None):
+                 chans=None, event=None, id=None, template_index=None,
+                 sample_index=None, chan_mask=None, context=None):
         """Main class of DETECTION."""
         self.template_name = template_name
         self.detect_time = detect_time
@@ -106,15 +135,59 @@ class DETECTION(object):
         self.detect_val = detect_val
         self.threshold = threshold
         self.typeofdet = typeofdet
-        self.event = event
+        self.template_index = template_index
+        self.sample_index = sample_index
+        self.chan_mask = chan_mask
+        self._context = context
         if id is not None:
             self.id = id
         else:
             self.id = (''.join(template_name.split(' ')) + '_' +
                        detect_time.strftime('%Y%m%d-%H%M%S%f'))
+        self.event = event
+
+    @property
+    def event(self):
+        """
+        Obspy Event for this detection, built on first access if needed.
+
+        :rtype: obspy.core.event.event.Event
+        """
+        return self.build_event()
+
+    @event.setter
+    def event(self, event):
+        self._event = event
         if event is not None:
             event.resource_id = self.id
 
+    def build_event(self, creation_time=None):
+        """
+        Build the event for this detection if it has not been built.
+
+        :type creation_time: obspy.core.utcdatetime.UTCDateTime
+        :param creation_time:
+            Creation time of the event, defaults to now.
+
+        :returns: The event, None if there is no event and no context to
+            build it from.
+        :rtype: obspy.core.event.event.Event
+        """
+        if self._event is None and self._context is not None:
+            self.event = _detection_event(
+                self, self._context, creation_time or UTCDateTime())
+        return self._event
+
+    def __setstate__(self, state):
+        """Restore detections, including those pickled by older versions."""
+        state = dict(state)
+        if '_event' not in state:
+            state['_event'] = state.pop('event', None)
+        for key in ['_context', 'template_index', 'sample_index',
+                    'chan_mask']:
+            state.setdefault(key, None)
+        self.__dict__.update(state)
+
     def __repr__(self):
         """Simple print."""
         print_str = ' '.join(['template name=', self.template_name, '\n',
@@ -164,6 +237,299 @@ class DETECTION(object):
         f.close()
 
 
+class TemplateBank(object):
+    """
+    Templates prepared once for repeated correlation with continuous data.
+
+    Holds a set of templates in a single aligned channel layout, so that
+    :func:`eqcorrscan.core.match_filter.match_filter` does not need to copy,
+    pad and sort the templates on every call.  Banks can be written to, and
+    read from, disk (HDF5) so that daily runs can load a ready-to-correlate
+    bank.
+
+    :type names: list
+    :param names: List of template names, one per template.
+    :type stachans: list
+    :param stachans:
+        List of tuples of (network, station, location, channel), one per
+        channel of the layout, sorted.  Station-channels that occur more than
+        once in a template (e.g. P and S picks on one channel) occur as many
+        times in the layout.
+    :type data: numpy.ndarray
+    :param data:
+        3-D float32 array of template data of shape
+        (templates, channels, samples).  Channels missing from a template are
+        NaN.
+    :type delays: numpy.ndarray
+    :param delays:
+        2-D array of shape (templates, channels) of the delay in seconds of
+        each channel from the start of its template.
+    :type sampling_rate: float
+    :param sampling_rate: Sampling rate in Hz of all templates.
+    :type cache_ffts: bool
+    :param cache_ffts:
+        Whether to keep the Fourier transforms of the templates computed by
+        :func:`eqcorrscan.core.match_filter.TemplateBank.template_ffts` for
+        re-use.  Only sensible for short data (e.g. chunked detection), the
+        transforms of one template-channel for a day of 100 Hz data use
+        around 70 MB.
+    """
+    def __init__(self, names=None, stachans=None, data=None, delays=None,
+                 sampling_rate=None, cache_ffts=False):
+        self.names = names
+        self.stachans = stachans
+        self.data = data
+        self.delays = delays
+        self.sampling_rate = sampling_rate
+        self.cache_ffts = cache_ffts
+        self._ffts = {}
+        if data is not None:
+            self._prepare()
+
+    def __repr__(self):
+        if self.names:
+            out = 'TemplateBank of ' + str(len(self)) + ' templates'
+        else:
+            out = 'Empty TemplateBank object'
+        return out
+
+    def __len__(self):
+        if self.names is None:
+            return 0
+        return len(self.names)
+
+    def __eq__(self, other):
+        if not isinstance(other, TemplateBank):
+            return False
+        for key in ['names', 'stachans', 'sampling_rate']:
+            if not self.__getattribute__(key) == other.__getattribute__(key):
+                return False
+        if not self.data.shape == other.data.shape:
+            return False
+        if not np.array_equal(self.used, other.used):
+            return False
+        if not np.allclose(self.data[self.used], other.data[other.used]):
+            return False
+        return np.allclose(self.delays, other.delays)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __getitem__(self, index):
+        """Get a new bank of a subset of templates, given indices."""
+        index = np.arange(len(self))[index]
+        if np.ndim(index) == 0:
+            index = [index]
+        return TemplateBank(
+            names=[self.names[i] for i in index], stachans=self.stachans,
+            data=self.data[index], delays=self.delays[index],
+            sampling_rate=self.sampling_rate, cache_ffts=self.cache_ffts)
+
+    def _shift(self, offsets):
+        """
+        Get a new bank with the delays of each template reduced by an offset.
+
+        :type offsets: numpy.ndarray
+        :param offsets: Offset in seconds for each template.
+
+        :rtype: :class:`eqcorrscan.core.match_filter.TemplateBank`
+        """
+        bank = copy.copy(self)
+        bank.delays = self.delays - np.asarray(offsets)[:, np.newaxis]
+        return bank
+
+    @property
+    def npts(self):
+        """Number of samples in each template."""
+        return self.data.shape[2]
+
+    @property
+    def pads(self):
+        """Delays of each channel from the start of its template in samples.
+        """
+        return np.round(self.delays * self.sampling_rate).astype(int)
+
+    @property
+    def length(self):
+        """Longest time span in seconds of a template in the bank."""
+        return (np.max(np.where(self.used, self.delays, 0)) +
+                self.npts / self.sampling_rate)
+
+    def _prepare(self):
+        """Pre-compute the channels used, means and norms of the templates.
+        """
+        self.used = ~np.any(np.isnan(self.data), axis=2)
+        self.means = np.zeros(self.used.shape)
+        self.norms = np.zeros(self.used.shape)
+        for i in range(len(self.data)):
+            data = self.data[i][self.used[i]].astype(np.float64)
+            self.means[i][self.used[i]] = data.mean(axis=1)
+            self.norms[i][self.used[i]] = np.sqrt(np.sum(
+                (data - self.means[i][self.used[i]][:, np.newaxis]) ** 2,
+                axis=1))
+        self._ffts = {}
+
+    def construct(self, templates, names):
+        """
+        Construct the bank from a list of templates.
+
+        :type templates: list
+        :param templates:
+            List of :class:`obspy.core.stream.Stream` templates.  All
+            traces must have the same length and sampling rate.
+        :type names: list
+        :param names: List of template names in the same order as templates.
+
+        :returns: This bank.
+        :rtype: :class:`eqcorrscan.core.match_filter.TemplateBank`
+        """
+        if not len(templates) == len(names):
+            raise MatchFilterError('Not the same number of templates as names')
+        npts = set()
+        sampling_rates = set()
+        n_slots = {}
+        for template, name in zip(templates, names):
+            if len(set([tr.stats.npts for tr in template])) > 1:
+                msg = ('Template %s contains traces of differing length, '
+                       'this is not currently supported' % name)
+                raise MatchFilterError(msg)
+            for tr in template:
+                if isinstance(tr.data, np.ma.core.MaskedArray):
+                    raise MatchFilterError('Template contains masked array,'
+                                           ' split first')
+                npts.add(tr.stats.npts)
+                sampling_rates.add(tr.stats.sampling_rate)
+            counts = Counter([_stachan(tr) for tr in template])
+            for stachan, count in counts.items():
+                n_slots[stachan] = max(n_slots.get(stachan, 0), count)
+        if len(npts) > 1 or len(sampling_rates) > 1:
+            raise MatchFilterError('All templates must have the same length '
+                                   'and sampling rate')
+        stachans = sorted([stachan for stachan in n_slots.keys()
+                           for _ in range(n_slots[stachan])])
+        slots = {}
+        for j, stachan in enumerate(stachans):
+            slots.setdefault(stachan, []).append(j)
+        data = np.empty((len(templates), len(stachans), max(npts or [0])),
+                        dtype=np.float32)
+        data.fill(np.nan)
+        delays = np.zeros((len(templates), len(stachans)))
+        for i, template in enumerate(templates):
+            if len(template) == 0:
+                continue
+            starttime = min([tr.stats.starttime for tr in template])
+            # Duplicate channels are ordered by start-time
+            traces = sorted(template, key=lambda tr: (_stachan(tr),
+                                                      tr.stats.starttime))
+            filled = Counter()
+            for tr in traces:
+                stachan = _stachan(tr)
+                j = slots[stachan][filled[stachan]]
+                filled[stachan] += 1
+                data[i, j] = tr.data
+                delays[i, j] = tr.stats.starttime - starttime
+        self.names = list(names)
+        self.stachans = stachans
+        self.data = data
+        self.delays = delays
+        self.sampling_rate = sampling_rates.pop() if sampling_rates else None
+        self._prepare()
+        return self
+
+    def template_ffts(self, fft_len, index):
+        """
+        Get the Fourier transforms of one channel of the templates.
+
+        Templates have their mean removed and are normalised to unit norm,
+        channels missing from a template are zero.
+
+        :type fft_len: int
+        :param fft_len: Length of the transform.
+        :type index: int
+        :param index: Index of the channel in the bank to transform.
+
+        :returns: Complex array of shape (templates, fft_len // 2 + 1).
+        :rtype: numpy.ndarray
+        """
+        if (fft_len, index) in self._ffts:
+            return self._ffts[(fft_len, index)]
+        used = self.used[:, index]
+        norms = np.where(used, self.norms[:, index], 1.0)
+        norms[norms == 0] = 1.0
+        normalised = np.where(
+            used[:, np.newaxis], self.data[:, index].astype(np.float64) -
+            self.means[:, index][:, np.newaxis], 0.0) / norms[:, np.newaxis]
+        ffts = np.fft.rfft(normalised, n=fft_len, axis=1)
+        if self.cache_ffts:
+            self._ffts[(fft_len, index)] = ffts
+        return ffts
+
+    def write(self, filename):
+        """
+        Write bank to a file - uses HDF5 file format.
+
+        :type filename: str
+        :param filename: Filename to save the bank to.
+        """
+        import h5py
+        import getpass
+        import eqcorrscan
+        f = h5py.File(filename, "w")
+        dset = f.create_dataset(name="data", data=self.data)
+        dset.attrs['sampling_rate'] = self.sampling_rate
+        dset.attrs['user'] = getpass.getuser()
+        dset.attrs['eqcorrscan_version'] = str(eqcorrscan.__version__)
+        f.create_dataset(name="delays", data=self.delays)
+        f.create_dataset(name="names", data=np.array(
+            [name.encode("ascii", "ignore") for name in self.names]))
+        f.create_dataset(name="stachans", data=np.array(
+            ['.'.join(stachan).encode("ascii", "ignore")
+             for stachan in self.stachans]))
+        f.flush()
+        f.close()
+        return self
+
+    def read(self, filename):
+        """
+        Read bank from a file, must be HDF5 format.
+
+        :type filename: str
+        :param filename: Filename to read the bank from.
+        """
+        import h5py
+        f = h5py.File(filename, "r")
+        self.data = f['data'][...]
+        self.sampling_rate = float(f['data'].attrs['sampling_rate'])
+        self.delays = f['delays'][...]
+        self.names = [name.decode('ascii') for name in f['names'][...]]
+        self.stachans = [tuple(stachan.decode('ascii').split('.'))
+                         for stachan in f['stachans'][...]]
+        f.close()
+        self._prepare()
+        return self
+
+
+def read_template_bank(filename):
+    """
+    Read template bank from a filename.
+
+    :type filename: str
+    :param filename: Filename to read the bank from.
+
+    :return: TemplateBank object
+    :rtype: eqcorrscan.core.match_filter.TemplateBank
+    """
+    bank = TemplateBank()
+    bank.read(filename=filename)
+    return bank
+
+
+def _stachan(tr):
+    """Get the (network, station, location, channel) tuple of a trace."""
+    return (tr.stats.network, tr.stats.station, tr.stats.location,
+            tr.stats.channel)
+
+
 def read_detections(fname):
     """Read detections from a file to a list of DETECTION objects.
 
@@ -202,6 +568,248 @@ def read_detections(fname):
     return detections
 
 
+class DetectionStore(object):
+    """
+    Columnar on-disk store of detections, using the HDF5 file format.
+
+    Detections are held as one row each in a structured array of fixed-size
+    fields, with template names and channels held once in interned tables,
+    so that detections can be appended in batches, and selected by template,
+    time and value by reading only the columns needed, without building or
+    parsing every detection.
+
+    :type filename: str
+    :param filename: File to hold the detections, created if not present.
+    :type block_size: int
+    :param block_size:
+        Number of rows to read at a time when selecting detections, bounding
+        the memory used to filter very large stores.
+
+    .. rubric:: Example
+
+    >>> store = DetectionStore('detections.h5') # doctest: +SKIP
+    >>> store.append(detections) # doctest: +SKIP
+    >>> detections = store.read(
+    ...     template_names=['a'], starttime=UTCDateTime(2016, 1, 1),
+    ...     min_value=5.0) # doctest: +SKIP
+
+    .. note::
+        As for :func:`eqcorrscan.core.match_filter.DETECTION.write`, the
+        event of each detection is not stored.
+    """
+    dtype = np.dtype([('template', np.int32), ('time', np.float64),
+                      ('no_chans', np.int32), ('chans', np.int32),
+                      ('detect_val', np.float64), ('threshold', np.float64),
+                      ('typeofdet', 'S8')])
+
+    def __init__(self, filename, block_size=1000000):
+        self.filename = filename
+        self.block_size = block_size
+
+    def __repr__(self):
+        return 'DetectionStore of %i detections in %s' % (
+            len(self), self.filename)
+
+    def __len__(self):
+        if not os.path.isfile(self.filename):
+            return 0
+        import h5py
+        with h5py.File(self.filename, "r") as f:
+            return len(f['detections'])
+
+    def _create(self, f):
+        """Create empty, resizable datasets in an open HDF5 file."""
+        import h5py
+        import getpass
+        import eqcorrscan
+        text = h5py.special_dtype(vlen=str)
+        dset = f.create_dataset(name="detections", shape=(0, ),
+                                maxshape=(None, ), dtype=self.dtype,
+                                chunks=True)
+        dset.attrs['user'] = getpass.getuser()
+        dset.attrs['eqcorrscan_version'] = str(eqcorrscan.__version__)
+        f.create_dataset(name="templates", shape=(0, ), maxshape=(None, ),
+                         dtype=text, chunks=True)
+        f.create_dataset(name="channels", shape=(0, ), maxshape=(None, ),
+                         dtype=text, chunks=True)
+        f.create_dataset(name="chan_sets", shape=(0, ), maxshape=(None, ),
+                         dtype=h5py.special_dtype(vlen=np.dtype('int32')),
+                         chunks=True)
+
+    @staticmethod
+    def _table(dset):
+        """Read an interned table to a list."""
+        return [value.decode('utf-8') if isinstance(value, bytes) else value
+                for value in dset[...]]
+
+    @staticmethod
+    def _extend(dset, values):
+        """Append values to a resizable dataset."""
+        if len(values) == 0:
+            return
+        start = len(dset)
+        dset.resize((start + len(values), ))
+        for i, value in enumerate(values):
+            dset[start + i] = value
+
+    def append(self, detections):
+        """
+        Append a batch of detections to the store.
+
+        :type detections: list
+        :param detections:
+            List of :class:`eqcorrscan.core.match_filter.DETECTION` to add.
+
+        :returns: This store.
+        :rtype: :class:`eqcorrscan.core.match_filter.DetectionStore`
+        """
+        import h5py
+        with h5py.File(self.filename, "a") as f:
+            if 'detections' not in f:
+                self._create(f)
+            templates = self._table(f['templates'])
+            template_ids = dict((name, i) for i, name in enumerate(templates))
+            channels = self._table(f['channels'])
+            channel_ids = dict((chan, i) for i, chan in enumerate(channels))
+            chan_set_ids = dict(
+                (tuple([int(j) for j in chan_set]), i)
+                for i, chan_set in enumerate(f['chan_sets'][...]))
+            new_templates, new_channels, new_chan_sets = [], [], []
+            rows = np.empty(len(detections), dtype=self.dtype)
+            for row, detection in enumerate(detections):
+                if detection.template_name not in template_ids:
+                    template_ids[detection.template_name] = len(template_ids)
+                    new_templates.append(detection.template_name)
+                chan_set = []
+                for chan in detection.chans or []:
+                    chan = '.'.join(chan)
+                    if chan not in channel_ids:
+                        channel_ids[chan] = len(channel_ids)
+                        new_channels.append(chan)
+                    chan_set.append(channel_ids[chan])
+                chan_set = tuple(chan_set)
+                if chan_set not in chan_set_ids:
+                    chan_set_ids[chan_set] = len(chan_set_ids)
+                    new_chan_sets.append(np.array(chan_set, dtype=np.int32))
+                rows[row] = (template_ids[detection.template_name],
+                             detection.detect_time.timestamp,
+                             detection.no_chans, chan_set_ids[chan_set],
+                             detection.detect_val, detection.threshold,
+                             detection.typeofdet.encode('ascii', 'ignore'))
+            self._extend(f['templates'], new_templates)
+            self._extend(f['channels'], new_channels)
+            self._extend(f['chan_sets'], new_chan_sets)
+            dset = f['detections']
+            start = len(dset)
+            dset.resize((start + len(rows), ))
+            dset[start:] = rows
+        return self
+
+    def read_array(self, template_names=None, starttime=None, endtime=None,
+                   min_value=None):
+        """
+        Read selected detections as a structured array.
+
+        Only the columns needed to select detections are read for rows
+        which are not selected.
+
+        :type template_names: list
+        :param template_names: Names of templates to select, or None for all.
+        :type starttime: obspy.core.utcdatetime.UTCDateTime
+        :param starttime: Earliest detection time to select, or None.
+        :type endtime: obspy.core.utcdatetime.UTCDateTime
+        :param endtime: Latest detection time to select, or None.
+        :type min_value: float
+        :param min_value:
+            Smallest absolute detection value to select, or None.
+
+        :returns:
+            Structured array with fields template (index of the template
+            name in :attr:`template_names`), time (POSIX timestamp),
+            no_chans, chans (index of the channel list), detect_val,
+            threshold and typeofdet.
+        :rtype: numpy.ndarray
+        """
+        import h5py
+        if not os.path.isfile(self.filename):
+            return np.empty(0, dtype=self.dtype)
+        with h5py.File(self.filename, "r") as f:
+            dset = f['detections']
+            template_ids = None
+            if template_names is not None:
+                templates = self._table(f['templates'])
+                template_names = set(template_names)
+                template_ids = [i for i, name in enumerate(templates)
+                                if name in template_names]
+            blocks = []
+            for start in range(0, len(dset), self.block_size):
+                block = slice(start, start + self.block_size)
+                keep = np.ones(min(self.block_size, len(dset) - start),
+                               dtype=bool)
+                if template_ids is not None:
+                    keep &= np.isin(dset['template', block], template_ids)
+                if starttime is not None or endtime is not None:
+                    times = dset['time', block]
+                    if starttime is not None:
+                        keep &= times >= starttime.timestamp
+                    if endtime is not None:
+                        keep &= times <= endtime.timestamp
+                if min_value is not None:
+                    keep &= np.abs(dset['detect_val', block]) >= min_value
+                if np.any(keep):
+                    blocks.append(dset[block][keep])
+        if len(blocks) == 0:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(blocks)
+
+    @property
+    def template_names(self):
+        """Interned table of template names, indexed by template."""
+        import h5py
+        with h5py.File(self.filename, "r") as f:
+            return self._table(f['templates'])
+
+    def read(self, template_names=None, starttime=None, endtime=None,
+             min_value=None):
+        """
+        Read selected detections.
+
+        Arguments are as for
+        :func:`eqcorrscan.core.match_filter.DetectionStore.read_array`.
+
+        :returns: list of :class:`eqcorrscan.core.match_filter.DETECTION`
+        :rtype: list
+        """
+        import h5py
+        rows = self.read_array(
+            template_names=template_names, starttime=starttime,
+            endtime=endtime, min_value=min_value)
+        if len(rows) == 0:
+            return []
+        with h5py.File(self.filename, "r") as f:
+            templates = self._table(f['templates'])
+            channels = [tuple(chan.split('.'))
+                        for chan in self._table(f['channels'])]
+            chan_sets = f['chan_sets'][...]
+        # Detections with the same channels share one list, as from
+        # match_filter
+        chan_lists = {}
+        detections = []
+        for row in rows:
+            chan_set = int(row['chans'])
+            if chan_set not in chan_lists:
+                chan_lists[chan_set] = [channels[j]
+                                        for j in chan_sets[chan_set]]
+            detections.append(DETECTION(
+                template_name=templates[row['template']],
+                detect_time=UTCDateTime(float(row['time'])),
+                no_chans=int(row['no_chans']), detect_val=float(
+                    row['detect_val']), threshold=float(row['threshold']),
+                typeofdet=row['typeofdet'].decode('ascii'),
+                chans=chan_lists[chan_set]))
+        return detections
+
+
 def write_catalog(detections, fname, format="QUAKEML"):
     """Write events contained within detections to a catalog file.
 
@@ -235,11 +843,60 @@ def get_catalog(detections):
         and read back in.
     """
     catalog = Catalog()
+    creation_time = UTCDateTime()
     for detection in detections:
-        catalog.append(detection.event)
+        catalog.append(detection.build_event(creation_time=creation_time))
     return catalog
 
 
+class _DetectionContext(object):
+    """
+    Template channels and pick delays needed to build detection events.
+
+    :type stachans: list
+    :param stachans: (network, station, location, channel) of each channel.
+    :type delays: numpy.ndarray
+    :param delays: (templates, channels) array of delays in seconds.
+    """
+
+    def __init__(self, stachans, delays):
+        self.stachans = stachans
+        self.delays = delays
+
+
+def _detection_event(detection, context, creation_time):
+    """
+    Build the obspy Event for a detection from its compact fields.
+
+    :type detection: eqcorrscan.core.match_filter.DETECTION
+    :param detection: Detection with a template_index and chan_mask.
+    :type context: eqcorrscan.core.match_filter._DetectionContext
+    :param context: Template channels and delays of the detection.
+    :type creation_time: obspy.core.utcdatetime.UTCDateTime
+    :param creation_time: Creation time of the event.
+
+    :rtype: obspy.core.event.event.Event
+    """
+    ev = Event()
+    ev.creation_info = CreationInfo(author='EQcorrscan',
+                                    creation_time=creation_time)
+    # All detection info in Comments for lack of a better idea
+    ev.comments.append(Comment(text='threshold=' + str(detection.threshold)))
+    ev.comments.append(Comment(text='detect_val=' +
+                               str(detection.detect_val)))
+    ev.comments.append(Comment(text='channels used: ' + ' '.join(
+        [str(pair) for pair in detection.chans])))
+    delays = context.delays[detection.template_index]
+    for j in np.flatnonzero(detection.chan_mask):
+        stachan = context.stachans[j]
+        wv_id = WaveformStreamID(network_code=stachan[0],
+                                 station_code=stachan[1],
+                                 channel_code=stachan[3])
+        ev.picks.append(Pick(time=detection.detect_time + delays[j],
+                             waveform_id=wv_id))
+    return ev
+
+
 def extract_from_stream(stream, detections, pad=2.0, length=30.0):
     """
     Extract waveforms for a list of detections from a stream.
@@ -318,6 +975,103 @@ def normxcorr2(template, image):
     return ccc
 
 
+def multi_normxcorr(templates, image, pads=None, template_ffts=None):
+    """
+    Frequency-domain normalised cross-correlation of many templates.
+
+    Correlates every template with a single image using one Fourier
+    transform of the image, which is then re-used for all templates.  The
+    normalisation is the same as :func:`cv2.TM_CCOEFF_NORMED` (as used by
+    :func:`eqcorrscan.core.match_filter.normxcorr2`), with the energy of the
+    image computed for every window by running sums.
+
+    :type templates: numpy.ndarray
+    :param templates:
+        2-D array of templates, one template per row, all of the same length.
+    :type image: numpy.ndarray
+    :param image: 1-D array of data to scan the templates through.
+    :type pads: list
+    :param pads:
+        Optional list of ints, one per template, giving the number of samples
+        to shift the correlation by for that template (delay of the channel
+        within the template).  The correlation is shifted to earlier times
+        and zero-padded at the end, as in
+        :func:`eqcorrscan.core.match_filter._template_loop`.
+    :type template_ffts: numpy.ndarray
+    :param template_ffts:
+        Optional pre-computed Fourier transforms of the templates, with their
+        means removed and normalised to unit norm, of length
+        `scipy.fftpack.next_fast_len(len(image))`, as given by
+        :func:`eqcorrscan.core.match_filter.TemplateBank.template_ffts`.
+
+    :return:
+        2-D array of correlations of shape
+        (len(templates), len(image) - len(templates[0]) + 1).
+    :rtype: numpy.ndarray
+
+    .. note::
+        Templates containing NaN values, and templates or windows of the
+        image with no variance, give zero correlations.
+
+    >>> import numpy as np
+    >>> template = np.random.randn(100)
+    >>> image = np.random.randn(1000)
+    >>> image[200:300] = template
+    >>> ccc = multi_normxcorr(np.array([template, -template]), image)
+    >>> ccc.shape
+    (2, 901)
+    >>> print(round(ccc[0].max(), 4), round(ccc[1].min(), 4))
+    1.0 -1.0
+    """
+    templates = np.atleast_2d(np.asarray(templates, dtype=np.float64))
+    image = np.asarray(image, dtype=np.float64)
+    n_templates, template_len = templates.shape
+    if template_len > len(image):
+        raise MatchFilterError('Templates are longer than the image')
+    ccc_len = len(image) - template_len + 1
+    ccc = np.zeros((n_templates, ccc_len), dtype=np.float32)
+    if pads is None:
+        pads = [0] * n_templates
+    # Remove the mean and compute the norm of each template, templates with
+    # NaN values (used to pad missing channels) are left as zeros.
+    usable = ~np.any(np.isnan(templates), axis=1)
+    templates = np.where(usable[:, np.newaxis], templates, 0.0)
+    templates -= templates.mean(axis=1)[:, np.newaxis]
+    norms = np.sqrt(np.sum(templates ** 2, axis=1))
+    usable &= norms > 0
+    if not np.any(usable):
+        return ccc
+    # Running window sums of the image to give the energy in each window
+    image = image - image.mean()
+    cumsum = np.concatenate([[0.0], np.cumsum(image)])
+    cumsum_sq = np.concatenate([[0.0], np.cumsum(image ** 2)])
+    window_sum = cumsum[template_len:] - cumsum[:-template_len]
+    window_energy = (cumsum_sq[template_len:] - cumsum_sq[:-template_len] -
+                     (window_sum ** 2) / template_len)
+    # Energies at the level of rounding error are zero-variance windows
+    min_energy = 10 * np.finfo(np.float64).eps * cumsum_sq[-1]
+    valid = window_energy > min_energy
+    norm_image = np.zeros(ccc_len)
+    norm_image[valid] = 1.0 / np.sqrt(window_energy[valid])
+    # Single transform of the image, re-used for every template
+    fft_len = next_fast_len(len(image))
+    image_fft = np.fft.rfft(image, n=fft_len)
+    for i in np.where(usable)[0]:
+        if template_ffts is not None:
+            template_fft = template_ffts[i]
+        else:
+            template_fft = np.fft.rfft(templates[i] / norms[i], n=fft_len)
+        corr = np.fft.irfft(image_fft * np.conj(template_fft),
+                            n=fft_len)[0:ccc_len]
+        corr *= norm_image
+        pad = int(pads[i])
+        if pad == 0:
+            ccc[i] = corr
+        elif pad < ccc_len:
+            ccc[i][0:ccc_len - pad] = corr[pad:]
+    return ccc
+
+
 def _template_loop(template, chan, stream_ind, debug=0, i=0):
     """
     Handle individual template correlations.
@@ -345,43 +1099,147 @@ def _template_loop(template, chan, stream_ind, debug=0, i=0):
     channel = template_data.stats.channel
     # template per-channel
     delay = template_data.stats.starttime - \
-        template.sort(['starttime'])[0].stats.starttime
-    pad = np.array([0] * int(round(delay *
-                                   template_data.stats.sampling_rate)))
-    image = np.append(chan, pad)[len(pad):]
-    ccc = (normxcorr2(template_data.data, image))
-    ccc = ccc.astype(np.float16)
+        min([tr.stats.starttime for tr in template])
+    pad = int(round(delay * template_data.stats.sampling_rate))
+    if debug >= 3:
+        print('********* DEBUG:  Correlating ' + station + '.' + channel)
+    ccc = _padded_normxcorr(template=template_data.data, chan=chan, pad=pad,
+                            debug=debug, i=i)
+    if debug >= 3:
+        print("Parallel worker " + str(i) + " complete")
+    return i, ccc
+
+
+def _padded_normxcorr(template, chan, pad, debug=0, i=0,
+                      precision='float16'):
+    """
+    Correlate a single-channel template with delayed continuous data.
+
+    :type template: numpy.ndarray
+    :param template: Single channel of template data.
+    :type chan: numpy.ndarray
+    :param chan: Single channel of continuous data to correlate
+    :type pad: int
+    :param pad: Delay in samples of this channel within the template.
+    :type debug: int
+    :param debug: Debug level from 0-5, higher is more output.
+    :type i: int
+    :param i: Index used to name debug output files.
+    :type precision: str
+    :param precision: Precision of returned correlations, float16 or float32
+
+    :returns: Correlations of shape (1, len(chan) - len(template) + 1)
+    :rtype: numpy.ndarray
+    """
+    image = np.append(chan, np.zeros(pad))[pad:]
+    ccc = (normxcorr2(template, image))
+    ccc = ccc.astype(precision)
     # Convert to float16 to save memory for large problems - lose some
-    # accuracy which will affect detections very close to threshold
+    # accuracy which will affect detections very close to threshold, see
+    # the precision argument of match_filter.
     #
     # There is an interesting issue found in the tests that sometimes what
     # should be a perfect correlation results in a max of ccc of 0.99999994
     # Converting to float16 'corrects' this to 1.0 - bad workaround.
     if debug >= 3:
-        print('********* DEBUG:  ' + station + '.' +
-              channel + ' ccc MAX: ' + str(np.max(ccc[0])))
-        print('********* DEBUG:  ' + station + '.' +
-              channel + ' ccc MEAN: ' + str(np.mean(ccc[0])))
+        print('********* DEBUG:  ccc MAX: ' + str(np.max(ccc[0])))
+        print('********* DEBUG:  ccc MEAN: ' + str(np.mean(ccc[0])))
     if np.isinf(np.mean(ccc[0])):
         warnings.warn('Mean of ccc is infinite, check!')
         if debug >= 3:
             np.save('inf_cccmean_ccc_%02d.npy' % i, ccc[0])
-            np.save('inf_cccmean_template_%02d.npy' % i, template_data.data)
+            np.save('inf_cccmean_template_%02d.npy' % i, template)
             np.save('inf_cccmean_image_%02d.npy' % i, image)
-        ccc = np.zeros(len(ccc))
-        ccc = ccc.reshape((1, len(ccc)))
+        ccc = np.zeros(ccc.shape, dtype=precision)
         # Returns zeros
     if debug >= 3:
         print('shape of ccc: ' + str(np.shape(ccc)))
         print('A single ccc is using: ' + str(ccc.nbytes / 1000000) + 'MB')
-        print('ccc type is: ' + str(type(ccc)))
+    return ccc
+
+
+def _multi_template_loop(templates, chan, pads, xcorr_func='time_domain',
+                         row=0, debug=0, i=0, template_ffts=None,
+                         precision='float32'):
+    """
+    Handle correlations of a block of templates with one channel of data.
+
+    Sister loop to :func:`eqcorrscan.core.match_filter._channel_loop`:
+    correlates a block of single-channel templates with a single channel of
+    continuous data.  The continuous data can be given either as an array, or
+    as the path to the memory-mapped file written by
+    :func:`eqcorrscan.core.match_filter._channel_loop`, in which case the
+    data are read without copying them into the worker process.
+
+    :type templates: numpy.ndarray
+    :param templates: 2-D array of single-channel templates, one per row.
+    :type chan: numpy.ndarray or str
+    :param chan:
+        Single channel of continuous data to correlate, or path to
+        memory-mapped 2-D array of continuous data.
+    :type pads: list
+    :param pads: Delay in samples of this channel for each template.
+    :type xcorr_func: str
+    :param xcorr_func: Correlation engine, 'time_domain' or 'frequency_domain'
+    :type row: int
+    :param row: Row of the memory-mapped data to use, if `chan` is a path.
+    :type debug: int
+    :param debug: Debug level from 0-5, higher is more output.
+    :type i: int
+    :param i:
+        Optional argument, used to keep track of which process is being run.
+    :type template_ffts: numpy.ndarray
+    :param template_ffts:
+        Optional pre-computed Fourier transforms of the templates for the
+        frequency_domain engine, see
+        :func:`eqcorrscan.core.match_filter.multi_normxcorr`.
+    :type precision: str
+    :param precision: Precision of returned correlations, float16 or float32
+
+    :returns: tuple of (i, cccs) with cccs as a 2-D :class:`numpy.ndarray`
+    :rtype: tuple
+    """
+    if not isinstance(chan, np.ndarray):
+        chan = np.asarray(_shared_data(chan)[row])
+    if xcorr_func == 'frequency_domain':
+        cccs = multi_normxcorr(templates=templates, image=chan, pads=pads,
+                               template_ffts=template_ffts).astype(precision)
+    else:
+        cccs = np.concatenate([_padded_normxcorr(template=template, chan=chan,
+                                                 pad=pad, debug=debug, i=i,
+                                                 precision=precision)
+                               for template, pad in zip(templates, pads)],
+                              axis=0)
     if debug >= 3:
-        print('shape of ccc: ' + str(np.shape(ccc)))
+        print('shape of cccs: ' + str(np.shape(cccs)))
         print("Parallel worker " + str(i) + " complete")
-    return i, ccc
+    return i, cccs
+
+
+# Memory-mapped continuous data, cached for the life of a worker process
+_SHARED_DATA = {}
+
+
+def _shared_data(path):
+    """
+    Memory-map continuous data shared between processes.
 
+    :type path: str
+    :param path: Path to .npy file written by _channel_loop.
 
-def _channel_loop(templates, stream, cores=1, debug=0):
+    :returns: Read-only memory-mapped 2-D array, one row per channel.
+    :rtype: numpy.memmap
+    """
+    if path not in _SHARED_DATA:
+        # Only keep the current data mapped
+        _SHARED_DATA.clear()
+        _SHARED_DATA[path] = np.load(path, mmap_mode='r')
+    return _SHARED_DATA[path]
+
+
+def _channel_loop(templates, stream, cores=1, debug=0,
+                  xcorr_func='time_domain', memmap_dir=None,
+                  precision='float32', profile=None):
     """
     Internal loop for parallel processing.
 
@@ -393,20 +1251,45 @@ def _channel_loop(templates, stream, cores=1, debug=0):
     :param templates:
         A list of templates, where each one should be an obspy.Stream object
         containing multiple traces of seismic data and the relevant header
-        information.
+        information, or a
+        :class:`eqcorrscan.core.match_filter.TemplateBank`.
     :type stream: obspy.core.stream.Stream
     :param stream:
         A single Stream object to be correlated with the templates.  This is
-        in effect the image in normxcorr2 and cv2.
+        in effect the image in normxcorr2 and cv2.  Channels of the templates
+        without data in the stream are not correlated.
     :type cores: int
     :param cores: Number of cores to loop over
     :type debug: int
     :param debug: Debug level.
+    :type xcorr_func: str
+    :param xcorr_func:
+        Correlation engine to use, either 'time_domain' to correlate each
+        template separately using
+        :func:`eqcorrscan.core.match_filter.normxcorr2`, or 'frequency_domain'
+        to correlate blocks of templates using
+        :func:`eqcorrscan.core.match_filter.multi_normxcorr`.
+    :type memmap_dir: str
+    :param memmap_dir:
+        Directory to hold the correlation sums in an on-disk memory-mapped
+        file, if None (default) they are held in memory.  The file is written
+        to a new temporary directory within memmap_dir, which the caller
+        should remove when finished with the returned array.  The directory
+        is removed here if the correlations fail.
+    :type precision: str
+    :param precision:
+        Precision of the correlations and correlation sums, either 'float32'
+        (default) or 'float16' to halve their memory use.
+    :type profile: eqcorrscan.utils.profiling.Profile
+    :param profile:
+        Profile to record the share_data, correlation and summation stages
+        in.  If None a profile is made which prints stages when debug >= 1.
 
     :returns:
-        New list of :class:`numpy.ndarray` objects.  These will contain
-        the correlation sums for each template for this day of data.
-    :rtype: list
+        2-D :class:`numpy.ndarray` (or :class:`numpy.memmap`) of shape
+        (len(templates), len(stream[0]) - len(templates[0][0]) + 1).  Each
+        row contains the correlation sum for a template for this day of data.
+    :rtype: numpy.ndarray
     :returns:
         list of ints as number of channels used for each cross-correlation.
     :rtype: list
@@ -415,122 +1298,170 @@ def _channel_loop(templates, stream, cores=1, debug=0):
     :rtype: list
 
     .. Note::
-        Each template must contain the same channels as every other template,
-        the stream must also contain the same channels (note that if there
-        are duplicate channels in the template you do not need duplicate
-        channels in the stream).
+        All templates must be the same length.  Templates do not need to
+        contain the same channels: each channel of data is only correlated
+        with the templates that contain that channel.  If there are duplicate
+        channels in the template you do not need duplicate channels in the
+        stream, but each channel must only occur once in the stream.
+
+    .. Note::
+        When running on more than one core a single pool of processes is
+        used for all channels.  The continuous data are written once to a
+        memory-mapped file in a temporary directory, which the processes read
+        without copying; only blocks of template data are sent to each
+        process.  Correlations are summed into the returned array as they
+        arrive, so peak memory use is close to the size of the returned array.
     """
+    if not isinstance(templates, TemplateBank):
+        templates = TemplateBank().construct(
+            templates=templates, names=[str(i) for i in range(len(templates))])
+    bank = templates
+    if profile is None:
+        profile = Profile(verbose=debug >= 1)
     num_cores = cores
-    if len(templates) < num_cores:
-        num_cores = len(templates)
-    # Initialize cccs_matrix, which will be two arrays of len(templates) arrays
-    # where the arrays cccs_matrix[0[:]] will be the cross channel sum for each
-    # template.
-
+    if len(bank) < num_cores:
+        num_cores = len(bank)
     # Note: This requires all templates to be the same length, and all channels
     # to be the same length
-    temp_len = len(templates[0][0].data)
-    cccs_matrix = np.array([np.array([np.array([0.0] * (len(stream[0].data) -
-                                     temp_len + 1))] *
-                            len(templates))] * 2, dtype=np.float32)
+    cccsum_shape = (len(bank), len(stream[0].data) - bank.npts + 1)
     # Initialize number of channels array
-    no_chans = np.array([0] * len(templates))
-    chans = [[] for _ in range(len(templates))]
-
-    # Match-filter enforces that each template is the same length...
-    for stream_ind in range(len(templates[0])):
-        station = templates[0][stream_ind].stats.station
-        channel = templates[0][stream_ind].stats.channel
-        tr = stream.select(station=station, channel=channel)[0]
-        if debug >= 1:
-            print("Starting parallel run for station " + station +
-                  " channel " + channel)
-        tic = time.clock()
-        with Timer() as t:
-            # Send off to sister function
+    no_chans = np.array([0] * len(bank))
+    chans = [[] for _ in range(len(bank))]
+    # Find the continuous data for each template channel, duplicate channels
+    # in the templates use the same data.
+    stream_traces = dict([(_stachan(tr), tr) for tr in stream])
+    data_rows = {}
+    data = []
+    for stachan in bank.stachans:
+        if stachan in stream_traces and stachan not in data_rows:
+            data_rows.update({stachan: len(data)})
+            data.append(stream_traces[stachan])
+    # Only correlate each channel with the templates that use it, split into
+    # blocks small enough that the correlations returned for a block are a
+    # fraction of the size of the cccsums.
+    block_size = max(1, int(np.ceil(len(bank) / (num_cores * 4))))
+    pads = bank.pads
+    tasks = []
+    for stream_ind, stachan in enumerate(bank.stachans):
+        if stachan not in data_rows:
+            continue
+        users = np.flatnonzero(bank.used[:, stream_ind])
+        for start in range(0, len(users), block_size):
+            block = users[start:start + block_size]
+            tasks.append((stream_ind, block, bank.data[block, stream_ind],
+                          pads[block, stream_ind]))
+    if debug >= 2:
+        print('Correlating %i template-channels of a possible %i' %
+              (sum([len(task[1]) for task in tasks]),
+               len(bank) * len(bank.stachans)))
+    correlation_bytes = sum([len(tasks) * data[0].data.nbytes] +
+                            [task[2].nbytes for task in tasks])
+    summation_bytes = 0
+    summation_wall, summation_cpu = 0.0, 0.0
+    if num_cores > 1:
+        with profile.stage('share_data') as stage:
+            shared_dir = tempfile.mkdtemp()
+            data_source = os.path.join(shared_dir, 'continuous_data.npy')
+            shared = np.lib.format.open_memmap(
+                data_source, mode='w+', dtype=np.float32,
+                shape=(len(data), len(data[0].data)))
+            for row, tr in enumerate(data):
+                shared[row] = tr.data
+            shared.flush()
+            stage.nbytes = shared.nbytes
+            del shared
             pool = Pool(processes=num_cores)
-            results = [pool.apply_async(_template_loop,
-                                        args=(templates[i], tr.data,
-                                              stream_ind, debug, i))
-                       for i in range(len(templates))]
-            pool.close()
-        if debug >= 1:
-            print("--------- TIMER:    Correlation loop took: %s s" % t.secs)
-            print(" I have " + str(len(results)) + " results")
-        with Timer() as t:
-            cccs_list = [p.get() for p in results]
-            pool.join()
-        if debug >= 1:
-            print("--------- TIMER:    Getting results took: %s s" % t.secs)
-        with Timer() as t:
-            # Sort by placeholder returned from _template_loop
-            cccs_list.sort(key=lambda tup: tup[0])
-        if debug >= 1:
-            print("--------- TIMER:    Sorting took: %s s" % t.secs)
-        with Timer() as t:
-            cccs_list = [ccc[1] for ccc in cccs_list]
-        if debug >= 1:
-            print("--------- TIMER:    Extracting arrays took: %s s" % t.secs)
-        if debug >= 3:
-            print('cccs_list is shaped: ' + str(np.shape(cccs_list)))
-        with Timer() as t:
-            cccs = np.concatenate(cccs_list, axis=0)
-        if debug >= 1:
-            print("--------- TIMER:    cccs_list conversion: %s s" % t.secs)
-        del cccs_list
-        if debug >= 2:
-            print('After looping through templates the cccs is shaped: ' +
-                  str(np.shape(cccs)))
-            print('cccs is using: ' + str(cccs.nbytes / 1000000) +
-                  ' MB of memory')
-        cccs_matrix[1] = np.reshape(cccs, (1, len(templates),
-                                    max(np.shape(cccs))))
-        del cccs
+    correlation_wall = time.time()
+    correlation_cpu = cpu_time(children=True)
+    cccsums, cccsum_dir = None, None
+    try:
+        # Correlations are summed in place into this single array as they
+        # are computed.
+        if memmap_dir is not None:
+            cccsum_dir = tempfile.mkdtemp(dir=memmap_dir)
+            cccsums = np.lib.format.open_memmap(
+                os.path.join(cccsum_dir, 'cccsums.npy'), mode='w+',
+                dtype=precision, shape=cccsum_shape)
+        else:
+            cccsums = np.zeros(cccsum_shape, dtype=precision)
         if debug >= 2:
-            print('cccs_matrix shaped: ' + str(np.shape(cccs_matrix)))
-            print('cccs_matrix is using ' + str(cccs_matrix.nbytes / 1000000) +
+            print('cccsums is shaped: ' + str(cccsum_shape))
+            print('cccsums is using: ' + str(cccsums.nbytes / 1000000) +
                   ' MB of memory')
-        # Now we have an array of arrays with the first dimensional index
-        # giving the channel, the second dimensional index giving the
-        # template and the third dimensional index giving the position
-        # in the ccc, e.g.:
-        # np.shape(cccsums)=(len(stream), len(templates), len(ccc))
-
-        if debug >= 2:
-            print('cccs_matrix as a np.array is shaped: ' +
-                  str(np.shape(cccs_matrix)))
-        # First work out how many channels were used
-        for i in range(0, len(templates)):
-            if not np.all(cccs_matrix[1][i] == 0):
-                # Check that there are some real numbers in the vector rather
-                # than being all 0, which is the default case for no match
-                # of image and template names
-                no_chans[i] += 1
-                chans[i].append((tr.stats.station, tr.stats.channel))
-        # Now sum along the channel axis for each template to give the
-        # cccsum values for each template for each day
-        with Timer() as t:
-            cccsums = cccs_matrix.sum(axis=0).astype(np.float32)
-        if debug >= 1:
-            print("--------- TIMER:    Summing took %s s" % t.secs)
-        if debug >= 2:
-            print('cccsums is shaped thus: ' + str(np.shape(cccsums)))
-        cccs_matrix[0] = cccsums
-        del cccsums
-        toc = time.clock()
-        if debug >= 1:
-            print("--------- TIMER:    Trace loop took " + str(toc - tic) +
-                  " s")
+        if num_cores > 1:
+            # Submit all channels at once so that processes do not wait
+            # for each channel to finish.
+            results = deque([pool.apply_async(
+                _multi_template_loop,
+                args=(task[2], data_source, task[3], xcorr_func,
+                      data_rows[bank.stachans[task[0]]], debug, i, None,
+                      precision))
+                for i, task in enumerate(tasks)])
+        for i, task in enumerate(tasks):
+            stream_ind, block = task[0], task[1]
+            station = bank.stachans[stream_ind][1]
+            channel = bank.stachans[stream_ind][3]
+            if debug >= 1 and (i == 0 or tasks[i - 1][0] != stream_ind):
+                print("Starting correlations for station " + station +
+                      " channel " + channel)
+            if num_cores > 1:
+                # Results are dropped once summed to keep memory down
+                cccs = results.popleft().get()[1]
+            else:
+                tr = data[data_rows[bank.stachans[stream_ind]]]
+                template_ffts = None
+                if xcorr_func == 'frequency_domain' and bank.cache_ffts:
+                    template_ffts = bank.template_ffts(
+                        next_fast_len(len(tr.data)), stream_ind)[block]
+                cccs = _multi_template_loop(
+                    templates=task[2], chan=tr.data.astype(np.float32),
+                    pads=task[3], xcorr_func=xcorr_func, debug=debug,
+                    i=i, template_ffts=template_ffts,
+                    precision=precision)[1]
+            summation_start = (time.time(), cpu_time())
+            for j, ccc in zip(block, cccs):
+                if not np.all(ccc == 0):
+                    # Check that there are some real numbers in the
+                    # vector rather than being all 0, which is the default
+                    # case for no match of image and template names
+                    no_chans[j] += 1
+                    chans[j].append((station, channel))
+                    cccsums[j] += ccc
+                    summation_bytes += ccc.nbytes + 2 * cccsums[j].nbytes
+            summation_wall += time.time() - summation_start[0]
+            summation_cpu += cpu_time() - summation_start[1]
+            del cccs
+    except BaseException:
+        # Release the memory-mapped file before removing it
+        cccsums = None
+        if cccsum_dir is not None:
+            shutil.rmtree(cccsum_dir)
+        raise
+    finally:
+        if num_cores > 1:
+            pool.close()
+            pool.join()
+            shutil.rmtree(shared_dir)
+    # Summation is interleaved with correlation, so is timed separately and
+    # removed from the correlation time.
+    profile.add('correlation',
+                wall=time.time() - correlation_wall - summation_wall,
+                cpu=(cpu_time(children=True) - correlation_cpu -
+                     summation_cpu), nbytes=correlation_bytes)
+    profile.add('summation', wall=summation_wall, cpu=summation_cpu,
+                nbytes=summation_bytes)
     if debug >= 2:
-        print('cccs_matrix is shaped: ' + str(np.shape(cccs_matrix)))
-    cccsums = cccs_matrix[0]
+        print('cccsums is shaped: ' + str(np.shape(cccsums)))
     return cccsums, no_chans, chans
 
 
 def match_filter(template_names, template_list, st, threshold,
                  threshold_type, trig_int, plotvar, plotdir='.', cores=1,
                  debug=0, plot_format='png', output_cat=False,
-                 extract_detections=False, arg_check=True):
+                 extract_detections=False, arg_check=True,
+                 xcorr_func='time_domain', memmap_dir=None,
+                 chunk_length=None, mad_bins=None, precision='float32',
+                 profile=None):
     """
     Main matched-filter detection function.
 
@@ -540,10 +1471,13 @@ def match_filter(template_names, template_list, st, threshold,
 
     :type template_names: list
     :param template_names: List of template names in the same order as \
-        template_list
+        template_list, ignored if template_list is a TemplateBank.
     :type template_list: list
     :param template_list: A list of templates of which each template is a \
-        Stream of obspy traces containing seismic data and header information.
+        Stream of obspy traces containing seismic data and header \
+        information, or a \
+        :class:`eqcorrscan.core.match_filter.TemplateBank`.  See note on \
+        template banks below.
     :type st: obspy.core.stream.Stream
     :param st: A Stream object containing all the data available and \
         required for the correlations with templates given.  For efficiency \
@@ -580,7 +1514,36 @@ def match_filter(template_names, template_list, st, threshold,
         streams, one stream per detection.
     :type arg_check: bool
     :param arg_check: Check arguments, defaults to True, but if running in \
-        bulk, and you are certain of your arguments, then set to False.\n
+        bulk, and you are certain of your arguments, then set to False.
+    :type xcorr_func: str
+    :param xcorr_func: Correlation engine to use, either 'time_domain' \
+        (default) to correlate each template separately with openCV, or \
+        'frequency_domain' to transform each channel of continuous data once \
+        and re-use it for all templates.  See note on correlation engines \
+        below.
+    :type memmap_dir: str
+    :param memmap_dir: Directory in which to hold the cross-channel \
+        correlation sums as an on-disk memory-mapped array, rather than in \
+        memory.  Defaults to None (in memory).  The temporary file is \
+        removed before returning.
+    :type chunk_length: float
+    :param chunk_length: Length in seconds of overlapping windows to split \
+        the continuous data into, see note on chunked detection below.  \
+        Defaults to None, in which case all the data are correlated at once.
+    :type mad_bins: int
+    :param mad_bins: If set, the median absolute cccsum used for MAD \
+        thresholds is approximated from a histogram with this many bins, \
+        rather than computed exactly by sorting.  See note on thresholding \
+        below.  Defaults to None (exact).
+    :type precision: str
+    :param precision: Precision of correlation sums, either 'float32' \
+        (default), or 'float16' to halve the memory used by correlations, \
+        see note on precision below.
+    :type profile: eqcorrscan.utils.profiling.Profile
+    :param profile: Profile to record the time, CPU time, peak memory and \
+        data volume of each stage of detection in, see note on profiling \
+        below.  Defaults to None, in which case stages are only printed \
+        when debug >= 1.\n
 
     .. rubric::
         If neither `output_cat` or `extract_detections` are set to `True`,
@@ -631,11 +1594,96 @@ def match_filter(template_names, template_list, st, threshold,
 
         .. math::
 
-            av\_chan\_corr\_thresh=threshold \\times (cccsum / len(template))
+            av\\_chan\\_corr\\_thresh=threshold \\times
+            (cccsum / len(template))
 
         where :math:`template` is a single template from the input and the
         length is the number of channels within this template.
 
+        MAD thresholds need the median of the absolute cccsum for every
+        template, which requires a (partial) sort of each cccsum.  For many
+        templates and long data this can be approximated by setting
+        `mad_bins`, in which case the median is taken from a histogram of
+        the absolute cccsum; the error in the median is at most
+        :math:`max(|cccsum|) / (2 \\times mad\\_bins)`.
+
+    .. note::
+        **Correlation engines:**
+
+        **time_domain** correlates every template with every channel
+        separately using :func:`eqcorrscan.core.match_filter.normxcorr2`
+        (openCV), and is efficient for small numbers of templates.
+
+        **frequency_domain** uses
+        :func:`eqcorrscan.core.match_filter.multi_normxcorr` to Fourier
+        transform each channel of continuous data once (per core) and re-use
+        that spectrum for every template, which is much faster for large
+        numbers of templates.  The two engines round differently, so cccsums
+        may differ very slightly between them.
+
+    .. note::
+        **Precision:**
+
+        With `precision='float16'` correlations and their sums are stored at
+        half precision, and the sums may be in error by up to
+        :math:`2^{-11}(n + n(n + 1) / 2)` for :math:`n` channels.  Any
+        window of a correlation sum within this error of the threshold is
+        re-computed at float32 precision before peaks are found, so
+        detections and their values are the same as for float32 (although
+        MAD thresholds are computed from the float16 sums).
+
+    .. note::
+        **Template banks:**
+
+        Templates are aligned to a common channel layout before correlation
+        using :class:`eqcorrscan.core.match_filter.TemplateBank`.  When
+        running the same templates over many days of data, build the bank
+        once and give it as template_list to avoid repeating this work:
+
+        >>> bank = TemplateBank().construct(
+        ...     templates=templates, names=template_names) # doctest: +SKIP
+        >>> bank.write('templates.h5') # doctest: +SKIP
+        >>> bank = read_template_bank('templates.h5') # doctest: +SKIP
+        >>> detections = match_filter(
+        ...     template_names=None, template_list=bank, st=st,
+        ...     threshold=8.0, threshold_type='MAD', trig_int=6.0,
+        ...     plotvar=False) # doctest: +SKIP
+
+    .. note::
+        **Chunked detection:**
+
+        If `chunk_length` is set the continuous data are processed in
+        windows of `chunk_length` seconds, each overlapping the next by the
+        longest template length, so that the correlation sums of consecutive
+        windows meet without gaps.  Only one window of correlation sums is
+        held in memory at a time, allowing long continuous datasets (such as
+        multiple days) to be processed without day-boundary gaps.
+        Detections made in both of two overlapping windows are removed using
+        `trig_int`, keeping the detection with the highest absolute
+        detection value.  Note that **MAD** thresholds are computed for each
+        window, so windows should be long (e.g. a day).
+
+    .. note::
+        **Profiling:**
+
+        Pass a :class:`eqcorrscan.utils.profiling.Profile` as `profile` to
+        record the stachan_reconciliation, padding, share_data (if running
+        in parallel), correlation, summation, thresholding, peak_finding and
+        event_construction stages of detection, along with counts of the
+        templates, seconds of data and template-days processed.  The profile
+        is filled in place, and stages can be forwarded as they complete
+        using its callback:
+
+        >>> from eqcorrscan.utils.profiling import Profile
+        >>> profile = Profile(callback=print) # doctest: +SKIP
+        >>> detections = match_filter(
+        ...     template_names=template_names, template_list=templates,
+        ...     st=st, threshold=8.0, threshold_type='MAD', trig_int=6.0,
+        ...     plotvar=False, profile=profile) # doctest: +SKIP
+        >>> profile.totals()['correlation']['wall'] # doctest: +SKIP
+
+        When chunk_length is set, stages are recorded for every chunk.
+
     .. note::
         The output_cat flag will create an :class:`obspy.core.eventCatalog`
         containing one event for each
@@ -657,17 +1705,19 @@ def match_filter(template_names, template_list, st, threshold,
     if arg_check:
         # Check the arguments to be nice - if arguments wrong type the parallel
         # output for the error won't be useful
-        if not type(template_names) == list:
-            raise MatchFilterError('template_names must be of type: list')
-        if not type(template_list) == list:
-            raise MatchFilterError('templates must be of type: list')
-        if not len(template_list) == len(template_names):
-            raise MatchFilterError('Not the same number of templates as names')
-        for template in template_list:
-            if not type(template) == Stream:
-                msg = 'template in template_list must be of type: ' +\
-                      'obspy.core.stream.Stream'
-                raise MatchFilterError(msg)
+        if not isinstance(template_list, TemplateBank):
+            if not type(template_names) == list:
+                raise MatchFilterError('template_names must be of type: list')
+            if not type(template_list) == list:
+                raise MatchFilterError('templates must be of type: list')
+            if not len(template_list) == len(template_names):
+                raise MatchFilterError('Not the same number of templates as '
+                                       'names')
+            for template in template_list:
+                if not type(template) == Stream:
+                    msg = 'template in template_list must be of type: ' +\
+                          'obspy.core.stream.Stream'
+                    raise MatchFilterError(msg)
         if not type(st) == Stream:
             msg = 'st must be of type: obspy.core.stream.Stream'
             raise MatchFilterError(msg)
@@ -675,26 +1725,41 @@ def match_filter(template_names, template_list, st, threshold,
                                        str('av_chan_corr')]:
             msg = 'threshold_type must be one of: MAD, absolute, av_chan_corr'
             raise MatchFilterError(msg)
+        if str(xcorr_func) not in [str('time_domain'),
+                                   str('frequency_domain')]:
+            msg = 'xcorr_func must be one of: time_domain, frequency_domain'
+            raise MatchFilterError(msg)
+        if str(precision) not in [str('float32'), str('float16')]:
+            msg = 'precision must be one of: float32, float16'
+            raise MatchFilterError(msg)
+    # Align the templates once, rather than for every chunk of data
+    if isinstance(template_list, TemplateBank):
+        bank = template_list
+    else:
+        bank = TemplateBank().construct(templates=template_list,
+                                        names=template_names)
+    if chunk_length is not None:
+        return _chunked_match_filter(
+            bank=bank, st=st, threshold=threshold,
+            threshold_type=threshold_type, trig_int=trig_int,
+            plotvar=plotvar, plotdir=plotdir, cores=cores, debug=debug,
+            plot_format=plot_format, output_cat=output_cat,
+            extract_detections=extract_detections, xcorr_func=xcorr_func,
+            memmap_dir=memmap_dir, chunk_length=chunk_length,
+            mad_bins=mad_bins, precision=precision, profile=profile)
+    if profile is None:
+        profile = Profile(verbose=debug >= 1)
 
     # Copy the stream here because we will muck about with it
     stream = st.copy()
-    templates = copy.deepcopy(template_list)
-    _template_names = copy.deepcopy(template_names)
     # Debug option to confirm that the channel names match those in the
     # templates
     if debug >= 2:
-        template_stachan = []
+        template_stachan = list(set([stachan[1] + '.' + stachan[3]
+                                     for stachan in bank.stachans]))
         data_stachan = []
-        for template in templates:
-            for tr in template:
-                if isinstance(tr.data, np.ma.core.MaskedArray):
-                    raise MatchFilterError('Template contains masked array,'
-                                           ' split first')
-                template_stachan.append(tr.stats.station + '.' +
-                                        tr.stats.channel)
         for tr in stream:
             data_stachan.append(tr.stats.station + '.' + tr.stats.channel)
-        template_stachan = list(set(template_stachan))
         data_stachan = list(set(data_stachan))
         if debug >= 3:
             print('I have template info for these stations:')
@@ -702,218 +1767,367 @@ def match_filter(template_names, template_list, st, threshold,
             print('I have daylong data for these stations:')
             print(data_stachan)
     # Perform a check that the continuous data are all the same length
-    min_start_time = min([tr.stats.starttime for tr in stream])
-    max_end_time = max([tr.stats.endtime for tr in stream])
-    longest_trace_length = stream[0].stats.sampling_rate * (max_end_time -
-                                                            min_start_time)
-    for tr in stream:
-        if not tr.stats.npts == longest_trace_length:
-            msg = 'Data are not equal length, padding short traces'
-            warnings.warn(msg)
-            start_pad = np.zeros(int(tr.stats.sampling_rate *
-                                     (tr.stats.starttime - min_start_time)))
-            end_pad = np.zeros(int(tr.stats.sampling_rate *
-                                   (max_end_time - tr.stats.endtime)))
-            tr.data = np.concatenate([start_pad, tr.data, end_pad])
-    # Perform check that all template lengths are internally consistent
-    for i, temp in enumerate(template_list):
-        if len(set([tr.stats.npts for tr in temp])) > 1:
-            msg = ('Template %s contains traces of differing length, this is '
-                   'not currently supported' % _template_names[i])
-            raise MatchFilterError(msg)
-    outtic = time.clock()
+    with profile.stage('padding') as stage:
+        min_start_time = min([tr.stats.starttime for tr in stream])
+        max_end_time = max([tr.stats.endtime for tr in stream])
+        longest_trace_length = stream[0].stats.sampling_rate * (
+            max_end_time - min_start_time)
+        for tr in stream:
+            if not tr.stats.npts == longest_trace_length:
+                msg = 'Data are not equal length, padding short traces'
+                warnings.warn(msg)
+                start_pad = np.zeros(int(tr.stats.sampling_rate *
+                                         (tr.stats.starttime -
+                                          min_start_time)))
+                end_pad = np.zeros(int(tr.stats.sampling_rate *
+                                       (max_end_time - tr.stats.endtime)))
+                tr.data = np.concatenate([start_pad, tr.data, end_pad])
+                stage.nbytes += 2 * tr.data.nbytes
     if debug >= 2:
         print('Ensuring all template channels have matches in long data')
-    template_stachan = {}
-    # Work out what station-channel pairs are in the templates, including
-    # duplicate station-channel pairs.  We will use this information to fill
-    # all templates with the same station-channel pairs as required by
-    # _template_loop.
-    for template in templates:
-        stachans_in_template = []
-        for tr in template:
-            stachans_in_template.append((tr.stats.network, tr.stats.station,
-                                         tr.stats.location, tr.stats.channel))
-        stachans_in_template = dict(Counter(stachans_in_template))
-        for stachan in stachans_in_template.keys():
-            if stachan not in template_stachan.keys():
-                template_stachan.update({stachan:
-                                         stachans_in_template[stachan]})
-            elif stachans_in_template[stachan] > template_stachan[stachan]:
-                template_stachan.update({stachan:
-                                         stachans_in_template[stachan]})
-    # Remove un-matched channels from templates.
-    _template_stachan = copy.deepcopy(template_stachan)
-    for stachan in template_stachan.keys():
-        if not stream.select(network=stachan[0], station=stachan[1],
-                             location=stachan[2], channel=stachan[3]):
-            # Remove stachan from list of dictionary of template_stachans
-            _template_stachan.pop(stachan)
-            # Remove template traces rather than adding NaN data
-            for template in templates:
-                if template.select(network=stachan[0], station=stachan[1],
-                                   location=stachan[2], channel=stachan[3]):
-                    for tr in template.select(network=stachan[0],
-                                              station=stachan[1],
-                                              location=stachan[2],
-                                              channel=stachan[3]):
-                        template.remove(tr)
-    template_stachan = _template_stachan
-    # Remove un-needed channels from continuous data.
-    for tr in stream:
-        if not (tr.stats.network, tr.stats.station,
-                tr.stats.location, tr.stats.channel) in \
-                template_stachan.keys():
-            stream.remove(tr)
-    # Check for duplicate channels
-    stachans = [(tr.stats.network, tr.stats.station,
-                 tr.stats.location, tr.stats.channel) for tr in stream]
-    c_stachans = Counter(stachans)
-    for key in c_stachans.keys():
-        if c_stachans[key] > 1:
-            msg = ('Multiple channels for %s.%s.%s.%s, likely a data issue'
-                   % (key[0], key[1], key[2], key[3]))
-            raise MatchFilterError(msg)
-    # Pad out templates to have all channels
-    for template, template_name in zip(templates, _template_names):
-        if len(template) == 0:
-            msg = ('No channels matching in continuous data for ' +
-                   'template' + template_name)
-            warnings.warn(msg)
-            templates.remove(template)
-            _template_names.remove(template_name)
-            continue
-        for stachan in template_stachan.keys():
-            number_of_channels = len(template.select(network=stachan[0],
-                                                     station=stachan[1],
-                                                     location=stachan[2],
-                                                     channel=stachan[3]))
-            if number_of_channels < template_stachan[stachan]:
-                missed_channels = template_stachan[stachan] -\
-                                  number_of_channels
-                nulltrace = Trace()
-                nulltrace.stats.update(
-                    {'network': stachan[0], 'station': stachan[1],
-                     'location': stachan[2], 'channel': stachan[3],
-                     'sampling_rate': template[0].stats.sampling_rate,
-                     'starttime': template[0].stats.starttime})
-                nulltrace.data = np.array([np.NaN] * len(template[0].data),
-                                          dtype=np.float32)
-                for dummy in range(missed_channels):
-                    template += nulltrace
-        template.sort()
-        # Quick check that this has all worked
-        if len(template) != max([len(t) for t in templates]):
-            raise MatchFilterError('Internal error forcing same template '
-                                   'lengths, report this error.')
+    with profile.stage('stachan_reconciliation'):
+        # Remove un-needed channels from continuous data.
+        template_stachan = set(bank.stachans)
+        for tr in stream:
+            if _stachan(tr) not in template_stachan:
+                stream.remove(tr)
+        # Check for duplicate channels
+        c_stachans = Counter([_stachan(tr) for tr in stream])
+        for key in c_stachans.keys():
+            if c_stachans[key] > 1:
+                msg = ('Multiple channels for %s.%s.%s.%s, likely a data '
+                       'issue' % (key[0], key[1], key[2], key[3]))
+                raise MatchFilterError(msg)
+        # Remove templates without any channels in the continuous data
+        in_stream = np.array([stachan in c_stachans
+                              for stachan in bank.stachans], dtype=bool)
+        matched = np.any(bank.used & in_stream, axis=1)
+        if not np.all(matched):
+            for template_name in np.array(bank.names)[~matched]:
+                msg = ('No channels matching in continuous data for ' +
+                       'template' + template_name)
+                warnings.warn(msg)
+            bank = bank[np.where(matched)[0]]
+    if len(bank) == 0:
+        raise MatchFilterError('No templates with channels in the data')
+    # Detection times and pick delays are referenced to the earliest channel
+    # of each template that is in the continuous data.
+    offsets = np.min(np.where(bank.used & in_stream, bank.delays, np.inf),
+                     axis=1)
+    if np.any(offsets > 0):
+        bank = bank._shift(offsets)
+    data_seconds = max_end_time - min_start_time
+    profile.count('templates', len(bank))
+    profile.count('data_seconds', data_seconds)
+    profile.count('template_days', len(bank) * data_seconds / 86400.0)
+    _template_names = bank.names
     if debug >= 2:
         print('Starting the correlation run for this day')
     if debug >= 4:
-        for template in templates:
-            print(template)
+        print(bank)
         print(stream)
-    [cccsums, no_chans, chans] = _channel_loop(templates=templates,
+    [cccsums, no_chans, chans] = _channel_loop(templates=bank,
                                                stream=stream,
                                                cores=cores,
-                                               debug=debug)
-    if len(cccsums[0]) == 0:
-        raise MatchFilterError('Correlation has not run, zero length cccsum')
-    outtoc = time.clock()
-    print(' '.join(['Looping over templates and streams took:',
-                    str(outtoc - outtic), 's']))
-    if debug >= 2:
-        print(' '.join(['The shape of the returned cccsums is:',
-                        str(np.shape(cccsums))]))
-        print(' '.join(['This is from', str(len(templates)), 'templates']))
-        print(' '.join(['Correlated with', str(len(stream)),
-                        'channels of data']))
-    detections = []
-    if output_cat:
-        det_cat = Catalog()
-    for i, cccsum in enumerate(cccsums):
-        template = templates[i]
-        if str(threshold_type) == str('MAD'):
-            rawthresh = threshold * np.median(np.abs(cccsum))
-        elif str(threshold_type) == str('absolute'):
-            rawthresh = threshold
-        elif str(threshold_type) == str('av_chan_corr'):
-            rawthresh = threshold * no_chans[i]
-        # Findpeaks returns a list of tuples in the form [(cccsum, sample)]
-        print(' '.join(['Threshold is set at:', str(rawthresh)]))
-        print(' '.join(['Max of data is:', str(max(cccsum))]))
-        print(' '.join(['Mean of data is:', str(np.mean(cccsum))]))
-        if np.abs(np.mean(cccsum)) > 0.05:
-            warnings.warn('Mean is not zero!  Check this!')
-        # Set up a trace object for the cccsum as this is easier to plot and
-        # maintains timing
-        if plotvar:
-            _match_filter_plot(stream=stream, cccsum=cccsum,
-                               template_names=_template_names,
-                               rawthresh=rawthresh, plotdir=plotdir,
-                               plot_format=plot_format, i=i)
-        if debug >= 4:
-            print(' '.join(['Saved the cccsum to:', _template_names[i],
-                            stream[0].stats.starttime.datetime.
-                           strftime('%Y%j')]))
-            np.save(_template_names[i] +
-                    stream[0].stats.starttime.datetime.strftime('%Y%j'),
-                    cccsum)
-        tic = time.clock()
-        if max(cccsum) > rawthresh:
-            peaks = findpeaks.find_peaks2_short(
-                arr=cccsum, thresh=rawthresh,
+                                               debug=debug,
+                                               xcorr_func=xcorr_func,
+                                               memmap_dir=memmap_dir,
+                                               precision=precision,
+                                               profile=profile)
+    cccsum, peak_arrays = None, None
+    try:
+        if len(cccsums[0]) == 0:
+            raise MatchFilterError(
+                'Correlation has not run, zero length cccsum')
+        if debug >= 2:
+            print(' '.join(['The shape of the returned cccsums is:',
+                            str(np.shape(cccsums))]))
+            print(' '.join(['This is from', str(len(bank)), 'templates']))
+            print(' '.join(['Correlated with', str(len(stream)),
+                            'channels of data']))
+        detections = []
+        with profile.stage('thresholding', nbytes=cccsums.nbytes):
+            med_abs, maxes, means = _cccsum_statistics(
+                cccsums, median=str(threshold_type) == str('MAD'),
+                bins=mad_bins)
+        rawthreshs = []
+        for i, cccsum in enumerate(cccsums):
+            if str(threshold_type) == str('MAD'):
+                rawthresh = threshold * med_abs[i]
+            elif str(threshold_type) == str('absolute'):
+                rawthresh = threshold
+            elif str(threshold_type) == str('av_chan_corr'):
+                rawthresh = threshold * no_chans[i]
+            rawthreshs.append(rawthresh)
+            if debug >= 2:
+                print(' '.join(['Threshold is set at:', str(rawthresh)]))
+                print(' '.join(['Max of data is:', str(maxes[i])]))
+                print(' '.join(['Mean of data is:', str(means[i])]))
+            if np.abs(means[i]) > 0.05:
+                warnings.warn('Mean is not zero!  Check this!')
+            # Set up a trace object for the cccsum as this is easier to plot
+            # and maintains timing
+            if plotvar:
+                _match_filter_plot(stream=stream, cccsum=cccsum,
+                                   template_names=_template_names,
+                                   rawthresh=rawthresh, plotdir=plotdir,
+                                   plot_format=plot_format, i=i)
+            if debug >= 4:
+                print(' '.join(['Saved the cccsum to:', _template_names[i],
+                                stream[0].stats.starttime.datetime.
+                               strftime('%Y%j')]))
+                np.save(_template_names[i] +
+                        stream[0].stats.starttime.datetime.strftime('%Y%j'),
+                        cccsum)
+        with profile.stage('peak_finding', nbytes=cccsums.nbytes):
+            peak_arrays = cccsums
+            if str(precision) == str('float16'):
+                peak_arrays = _recheck_cccsums(
+                    bank=bank, stream=stream, cccsums=cccsums,
+                    no_chans=no_chans, thresholds=rawthreshs,
+                    xcorr_func=xcorr_func, debug=debug)
+                maxes = [peak_array.max() if peak_array.dtype == np.float32
+                         else maxes[i]
+                         for i, peak_array in enumerate(peak_arrays)]
+            all_peaks = findpeaks.multi_find_peaks(
+                arr=peak_arrays, thresh=rawthreshs,
                 trig_int=trig_int * stream[0].stats.sampling_rate, debug=debug,
                 starttime=stream[0].stats.starttime,
                 samp_rate=stream[0].stats.sampling_rate)
-        else:
-            print('No peaks found above threshold')
-            peaks = False
-        toc = time.clock()
-        if debug >= 1:
-            print(' '.join(['Finding peaks took:', str(toc - tic), 's']))
-        if peaks:
-            for peak in peaks:
-                detecttime = stream[0].stats.starttime +\
-                    peak[1] / stream[0].stats.sampling_rate
-                # Detect time must be valid QuakeML uri within resource_id.
-                # This will write a formatted string which is still
-                # readable by UTCDateTime
-                rid = ResourceIdentifier(id=_template_names[i] + '_' +
-                                         str(detecttime.
-                                             strftime('%Y%m%dT%H%M%S.%f')),
-                                         prefix='smi:local')
-                ev = Event(resource_id=rid)
-                cr_i = CreationInfo(author='EQcorrscan',
-                                    creation_time=UTCDateTime())
-                ev.creation_info = cr_i
-                # All detection info in Comments for lack of a better idea
-                thresh_str = 'threshold=' + str(rawthresh)
-                ccc_str = 'detect_val=' + str(peak[0])
-                used_chans = 'channels used: ' +\
-                             ' '.join([str(pair) for pair in chans[i]])
-                ev.comments.append(Comment(text=thresh_str))
-                ev.comments.append(Comment(text=ccc_str))
-                ev.comments.append(Comment(text=used_chans))
-                min_template_tm = min([tr.stats.starttime for tr in template])
-                for tr in template:
-                    if (tr.stats.station, tr.stats.channel) not in chans[i]:
-                        continue
-                    else:
-                        pick_tm = detecttime + (tr.stats.starttime -
-                                                min_template_tm)
-                        wv_id = WaveformStreamID(network_code=tr.stats.network,
-                                                 station_code=tr.stats.station,
-                                                 channel_code=tr.stats.channel)
-                        ev.picks.append(Pick(time=pick_tm, waveform_id=wv_id))
-                detections.append(DETECTION(_template_names[i],
-                                            detecttime,
-                                            no_chans[i], peak[0], rawthresh,
-                                            'corr', chans[i], event=ev))
-                if output_cat:
-                    det_cat.append(ev)
+        event_start = (time.time(), cpu_time())
+        context = _DetectionContext(stachans=bank.stachans, delays=bank.delays)
+        for i, peaks in enumerate(all_peaks):
+            rawthresh = rawthreshs[i]
+            if not maxes[i] > rawthresh:
+                # Only positive correlations can trigger a detection
+                peaks = False
+            if not peaks and debug >= 1:
+                print('No peaks found above threshold')
+            if peaks:
+                # Channels used are the same for every detection of a template
+                chan_mask = np.array(
+                    [bool(bank.used[i, j]) and (stachan[1], stachan[3]) in
+                     chans[i] for j, stachan in enumerate(bank.stachans)],
+                    dtype=bool)
+                for peak in peaks:
+                    detecttime = stream[0].stats.starttime +\
+                        peak[1] / stream[0].stats.sampling_rate
+                    detection = DETECTION(
+                        _template_names[i], detecttime, no_chans[i], peak[0],
+                        rawthresh, 'corr', chans[i], template_index=i,
+                        sample_index=peak[1], chan_mask=chan_mask,
+                        context=context)
+                    detections.append(detection)
+        if output_cat:
+            det_cat = get_catalog(detections)
+        profile.add('event_construction', wall=time.time() - event_start[0],
+                    cpu=cpu_time() - event_start[1])
         if extract_detections:
             detection_streams = extract_from_stream(stream, detections)
-    del stream, templates
+    finally:
+        if memmap_dir is not None:
+            # Drop all references to the memory-mapped file so that it is
+            # closed before it is removed
+            cccsum_dir = os.path.dirname(cccsums.filename)
+            del cccsum, peak_arrays, cccsums
+            shutil.rmtree(cccsum_dir)
+    del stream, bank
+    if output_cat and not extract_detections:
+        return detections, det_cat
+    elif not extract_detections:
+        return detections
+    elif extract_detections and not output_cat:
+        return detections, detection_streams
+    else:
+        return detections, det_cat, detection_streams
+
+
+def _cccsum_statistics(cccsums, median=True, bins=None, block_size=None):
+    """
+    Compute the statistics used for thresholding for all cccsums at once.
+
+    :type cccsums: numpy.ndarray
+    :param cccsums: 2-D array of cross-channel correlation sums, one row \
+        per template.  Can be a memory-mapped array.
+    :type median: bool
+    :param median: Whether to compute the median of the absolute values, \
+        if False the returned medians are NaN.
+    :type bins: int
+    :param bins: If set, approximate the median of the absolute values \
+        from a histogram with this many bins between zero and the maximum \
+        absolute value of each row, with an error of at most half a bin \
+        width.  If None (default) the median is exact.
+    :type block_size: int
+    :param block_size: Number of rows to work on at a time, defaults to as \
+        many rows as fit in about 2**24 samples.
+
+    :returns: median of absolute values, maximum and mean of each row.
+    :rtype: tuple of numpy.ndarray
+
+    >>> import numpy as np
+    >>> cccsums = np.array([[1, -3, 2, 0, 4], [0.5, 0.5, -1, 1, 0]])
+    >>> med_abs, maxes, means = _cccsum_statistics(cccsums)
+    >>> print(med_abs.tolist())
+    [2.0, 0.5]
+    >>> print(maxes.tolist())
+    [4.0, 1.0]
+    >>> print(means.tolist())
+    [0.8, 0.2]
+    """
+    n_rows, n_samples = cccsums.shape
+    if block_size is None:
+        block_size = max(1, 2 ** 24 // max(n_samples, 1))
+    med_abs = np.empty(n_rows)
+    med_abs.fill(np.nan)
+    maxes = np.empty(n_rows)
+    means = np.empty(n_rows)
+    for start in range(0, n_rows, block_size):
+        block = np.array(cccsums[start:start + block_size])
+        if block.dtype == np.float16:
+            # Avoid overflow when scaling for the histogram
+            block = block.astype(np.float32)
+        rows = slice(start, start + len(block))
+        maxes[rows] = block.max(axis=1)
+        means[rows] = block.mean(axis=1, dtype=np.float64)
+        if not median:
+            continue
+        block = np.abs(block, out=block)
+        if bins is None:
+            # Partition in place rather than copying as np.median would.
+            middle = [(n_samples - 1) // 2, n_samples // 2]
+            block.partition(middle, axis=1)
+            med_abs[rows] = block[:, middle].mean(axis=1, dtype=np.float64)
+            continue
+        # Histogram every row at once by offsetting the bin index of each
+        # row, then find the bins holding the two middle order statistics.
+        widths = block.max(axis=1).astype(np.float64) / bins
+        widths[widths == 0] = 1.0
+        block *= (1.0 / widths)[:, np.newaxis].astype(block.dtype)
+        inds = np.minimum(block, bins - 1, out=block).astype(np.intp)
+        inds += (np.arange(len(block)) * bins)[:, np.newaxis]
+        counts = np.bincount(inds.ravel(), minlength=len(block) * bins)
+        counts = counts.reshape(len(block), bins).cumsum(axis=1)
+        lower = (counts <= (n_samples - 1) // 2).sum(axis=1)
+        upper = (counts <= n_samples // 2).sum(axis=1)
+        med_abs[rows] = (((lower + upper) / 2.0) + 0.5) * widths
+        med_abs[rows][counts[:, 0] == n_samples] = 0
+    return med_abs, maxes, means
+
+
+def _recheck_cccsums(bank, stream, cccsums, no_chans, thresholds,
+                     xcorr_func='time_domain', debug=0):
+    """
+    Re-compute windows of float16 correlation sums near the threshold.
+
+    Windows of the correlation sums that are within the float16 rounding
+    error of the threshold are re-computed at float32 precision.
+
+    :type bank: eqcorrscan.core.match_filter.TemplateBank
+    :param bank: Templates used to compute the correlation sums.
+    :type stream: obspy.core.stream.Stream
+    :param stream: Continuous data used to compute the correlation sums.
+    :type cccsums: numpy.ndarray
+    :param cccsums: 2-D float16 array of correlation sums.
+    :type no_chans: list
+    :param no_chans: Number of channels used for each correlation sum.
+    :type thresholds: list
+    :param thresholds: Threshold for each correlation sum.
+    :type xcorr_func: str
+    :param xcorr_func: Correlation engine, 'time_domain' or 'frequency_domain'
+    :type debug: int
+    :param debug: Debug level.
+
+    :returns:
+        List of correlation sums, as float32 copies of the rows of cccsums
+        with windows re-computed, or the float16 rows of cccsums if no part
+        of that row is close to the threshold.
+    :rtype: list
+    """
+    stream_traces = dict([(_stachan(tr), tr) for tr in stream])
+    pads = bank.pads
+    unit_roundoff = 2.0 ** -11
+    rows = []
+    n_windows = 0
+    for i, cccsum in enumerate(cccsums):
+        # Bound on the rounding error of each correlation and of each
+        # addition to the sum
+        tolerance = unit_roundoff * (no_chans[i] +
+                                     no_chans[i] * (no_chans[i] + 1) / 2.0)
+        candidates = np.flatnonzero(np.abs(cccsum) >=
+                                    thresholds[i] - tolerance)
+        if len(candidates) == 0:
+            rows.append(cccsum)
+            continue
+        row = cccsum.astype(np.float32)
+        # Merge candidates less than a template length apart into windows
+        breaks = np.flatnonzero(np.diff(candidates) > bank.npts)
+        starts = candidates[np.concatenate([[0], breaks + 1])]
+        ends = candidates[np.concatenate([breaks, [len(candidates) - 1]])]
+        n_windows += len(starts)
+        for start, end in zip(starts, ends):
+            window = np.zeros(end - start + 1, dtype=np.float32)
+            for j, stachan in enumerate(bank.stachans):
+                if not bank.used[i, j] or stachan not in stream_traces:
+                    continue
+                data = stream_traces[stachan].data
+                # Segment of data long enough for the delayed window
+                segment = data[start:end + pads[i, j] + bank.npts]
+                cccs = _multi_template_loop(
+                    templates=bank.data[[i], j], chan=segment.astype(
+                        np.float32), pads=[pads[i, j]],
+                    xcorr_func=xcorr_func, precision='float32')[1]
+                window[0:len(cccs[0])] += cccs[0][0:len(window)]
+            row[start:end + 1] = window
+        rows.append(row)
+    if debug >= 1:
+        print('Re-computed %i windows of correlation sums at float32' %
+              n_windows)
+    return rows
+
+
+def _chunked_match_filter(bank, st, threshold, threshold_type, trig_int,
+                          plotvar, plotdir, cores, debug, plot_format,
+                          output_cat, extract_detections, xcorr_func,
+                          memmap_dir, chunk_length, mad_bins, precision,
+                          profile=None):
+    """
+    Run match_filter over overlapping windows of continuous data.
+
+    Arguments are as for :func:`eqcorrscan.core.match_filter.match_filter`,
+    as are the returns, with the templates given as a
+    :class:`eqcorrscan.core.match_filter.TemplateBank`.
+    """
+    # Overlap windows by the longest template, plus a sample to be safe.
+    overlap = bank.length
+    if chunk_length <= overlap:
+        msg = ('chunk_length must be longer than the longest template (%s s)'
+               % overlap)
+        raise MatchFilterError(msg)
+    starttime = min([tr.stats.starttime for tr in st])
+    endtime = max([tr.stats.endtime for tr in st])
+    detections = []
+    chunk_start = starttime
+    while chunk_start + overlap < endtime:
+        chunk_end = chunk_start + chunk_length + overlap
+        chunk = st.slice(chunk_start, chunk_end)
+        if len(chunk) > 0:
+            if debug >= 1:
+                print('Running chunk from %s to %s' % (chunk_start,
+                                                       chunk_end))
+            detections += match_filter(
+                template_names=bank.names, template_list=bank,
+                st=chunk, threshold=threshold, threshold_type=threshold_type,
+                trig_int=trig_int, plotvar=plotvar, plotdir=plotdir,
+                cores=cores, debug=debug, plot_format=plot_format,
+                arg_check=False, xcorr_func=xcorr_func,
+                memmap_dir=memmap_dir, mad_bins=mad_bins,
+                precision=precision, profile=profile)
+        chunk_start += chunk_length
+    detections = _remove_duplicate_detections(detections, trig_int)
+    if output_cat:
+        det_cat = get_catalog(detections)
+    if extract_detections:
+        detection_streams = extract_from_stream(st, detections)
     if output_cat and not extract_detections:
         return detections, det_cat
     elif not extract_detections:
@@ -924,6 +2138,38 @@ def match_filter(template_names, template_list, st, threshold,
         return detections, det_cat, detection_streams
 
 
+def _remove_duplicate_detections(detections, trig_int):
+    """
+    Remove detections of the same template made within trig_int of each other.
+
+    The detection with the highest absolute detection value is kept.
+
+    :type detections: list
+    :param detections: list of :class:`eqcorrscan.core.match_filter.DETECTION`
+    :type trig_int: float
+    :param trig_int: Minimum gap between detections in seconds.
+
+    :returns:
+        list of :class:`eqcorrscan.core.match_filter.DETECTION` sorted by
+        detection time.
+    :rtype: list
+    """
+    kept_times = {}
+    unique = []
+    for detection in sorted(detections, key=lambda d: abs(d.detect_val),
+                            reverse=True):
+        # Sorted list of detection times already kept for this template
+        times = kept_times.setdefault(detection.template_name, [])
+        ind = bisect.bisect_left(times, detection.detect_time)
+        neighbours = times[max(ind - 1, 0): ind + 1]
+        if any([abs(detection.detect_time - t) < trig_int or
+                detection.detect_time == t for t in neighbours]):
+            continue
+        times.insert(ind, detection.detect_time)
+        unique.append(detection)
+    return sorted(unique, key=lambda d: d.detect_time)
+
+
 def _match_filter_plot(stream, cccsum, template_names, rawthresh, plotdir,
                        plot_format, i):
     """
@@ -455,7 +455,7 @@ class Detector(object):
 
 
 def _detect(detector, st, threshold, trig_int, moveout=0, min_trig=0,
-            process=True, extract_detections=False, debug=0):
+            process=True, extract_detections=False, debug=0, stats=None):
     """
     Detect within continuous data using the subspace method.
 
@@ -485,11 +485,14 @@ def _detect(detector, st, threshold, trig_int, moveout=0, min_trig=0,
         detection or not, if true will return detections and streams.
     :type debug: int
     :param debug: Debug output level from 0-5.
+    :type stats: np.ndarray
+    :param stats: Pre-computed detection statistics for each channel of \
+        the processed stream, as computed by :func:`_group_statistics`.  \
+        Only used if process=False.
 
     :return: list of detections
     :rtype: list of eqcorrscan.core.match_filter.DETECTION
     """
-    from eqcorrscan.core import subspace_statistic
     detections = []
     # First process the stream
     if process:
@@ -515,22 +518,17 @@ def _detect(detector, st, threshold, trig_int, moveout=0, min_trig=0,
         stream = [st]
         stachans = detector.stachans
     outtic = time.clock()
-    if debug > 0:
-        print('Computing detection statistics')
-    stats = np.zeros((len(stream[0]),
-                      len(stream[0][0]) - len(detector.data[0][0]) + 1),
-                     dtype=np.float32)
-    for det_channel, in_channel, i in zip(detector.data, stream[0],
-                                          np.arange(len(stream[0]))):
-        stats[i] = subspace_statistic.\
-            det_statistic(detector=det_channel.astype(np.float32),
-                          data=in_channel.data.astype(np.float32))
+    if stats is None or process:
+        if debug > 0:
+            print('Computing detection statistics')
+        stats = _group_statistics(detectors=[detector],
+                                  stream=stream[0])[0]
+    for i in range(len(stats)):
         if debug > 0:
             print(stats[i].shape)
         if debug > 3:
             plt.plot(stats[i])
             plt.show()
-        # Hard typing in Cython loop requires float32 type.
     # statistics
     if detector.multiplex:
         trig_int_samples = (len(detector.stachans) *
@@ -603,6 +601,82 @@ def _detect(detector, st, threshold, trig_int, moveout=0, min_trig=0,
     return detections
 
 
+def _channel_statistics(bases, data, i=0):
+    """
+    Compute the statistics of many detectors for one channel of data.
+
+    :type bases: list
+    :param bases: List of U matrices, one for each detector.
+    :type data: np.ndarray
+    :param data: Processed data for the channel.
+    :type i: int
+    :param i: Channel index, returned for ordering parallel results.
+
+    :return: Channel index and list of statistics, one for each detector.
+    :rtype: tuple
+    """
+    from eqcorrscan.core import subspace_statistic
+    # Hard typing in Cython loop requires float32 type.
+    return i, subspace_statistic.multi_det_statistic(
+        detectors=[basis.astype(np.float32) for basis in bases],
+        data=data.astype(np.float32))
+
+
+def _group_statistics(detectors, stream, parallel=False, num_cores=None):
+    """
+    Compute the detection statistics of detectors with the same channels.
+
+    Each channel of data is Fourier transformed once and projected onto the
+    bases of all the detectors, rather than once per detector.
+
+    :type detectors: list
+    :param detectors:
+        List of :class:`eqcorrscan.core.subspace.Detector` which share
+        processing parameters and channels.
+    :type stream: obspy.core.stream.Stream
+    :param stream:
+        Stream processed for the detectors, with channels in the order of
+        the detectors.
+    :type parallel: bool
+    :param parallel: Whether to compute channels in parallel.
+    :type num_cores: int
+    :param num_cores:
+        Number of processes to use if parallel, defaults to all available
+        cores.
+
+    :return:
+        List of arrays of statistics (channels by samples), one for each
+        detector.
+    :rtype: list
+    """
+    from multiprocessing import Pool, cpu_count
+    n_channels = len(stream)
+    if not parallel:
+        results = [_channel_statistics(
+            bases=[detector.data[i] for detector in detectors],
+            data=stream[i].data, i=i) for i in range(n_channels)]
+    else:
+        pool = Pool(processes=num_cores or cpu_count())
+        results = [pool.apply_async(_channel_statistics,
+                                    ([detector.data[i]
+                                      for detector in detectors],
+                                     stream[i].data, i))
+                   for i in range(n_channels)]
+        pool.close()
+        results = [p.get() for p in results]
+        pool.join()
+    results.sort(key=lambda tup: tup[0])
+    group_stats = []
+    for j, detector in enumerate(detectors):
+        stats = np.zeros((n_channels,
+                          len(stream[0]) - len(detector.data[0][0]) + 1),
+                         dtype=np.float32)
+        for i, channel_stats in results:
+            stats[i] = channel_stats[j]
+        group_stats.append(stats)
+    return group_stats
+
+
 def _subspace_process(streams, lowcut, highcut, filt_order, sampling_rate,
                       multiplex, align, shift_len, reject, no_missed=True,
                       stachans=None, parallel=False, plot=False):
@@ -934,7 +1008,7 @@ def subspace_detect(detectors, stream, threshold, trig_int, moveout=0,
         Minimum number of stations exceeding threshold for non-multiplexed,
         network detection. See note in :func:`Detector.detect`.
     :type parallel: bool
-    :param parallel: Whether to run detectors in parallel in groups.
+    :param parallel: Whether to compute channels in parallel.
     :type num_cores: int
     :param num_cores:
         How many cpu cores to use if parallel==True. If set to None (default),
@@ -945,11 +1019,11 @@ def subspace_detect(detectors, stream, threshold, trig_int, moveout=0,
         List of :class:`eqcorrscan.core.match_filter.DETECTION` detections.
 
     .. Note::
-        This will loop through your detectors using their detect method.
-        If the detectors are multiplexed it will run groups of detectors with
-        the same channels at the same time.
+        Detectors with the same processing parameters and channels are run
+        as a group: the data are processed once for the group, and each
+        channel is Fourier transformed once and projected onto the bases of
+        all the detectors in the group.
     """
-    from multiprocessing import Pool, cpu_count
     # First check that detector parameters are the same
     parameters = []
     detections = []
@@ -967,7 +1041,7 @@ def subspace_detect(detectors, stream, threshold, trig_int, moveout=0,
                        detector.stachans)
             if det_par == parameter_set:
                 parameter_detectors.append(detector)
-        stream, stachans = \
+        processed, stachans = \
             _subspace_process(streams=[stream.copy()],
                               lowcut=parameter_set[0],
                               highcut=parameter_set[1],
@@ -977,30 +1051,16 @@ def subspace_detect(detectors, stream, threshold, trig_int, moveout=0,
                               stachans=parameter_set[5],
                               parallel=True, align=False, shift_len=None,
                               reject=False)
-        if not parallel:
-            for detector in parameter_detectors:
-                detections += _detect(detector=detector, st=stream[0],
-                                      threshold=threshold, trig_int=trig_int,
-                                      moveout=moveout, min_trig=min_trig,
-                                      process=False, extract_detections=False,
-                                      debug=0)
-        else:
-            if num_cores:
-                ncores = num_cores
-            else:
-                ncores = cpu_count()
-            pool = Pool(processes=ncores)
-            results = [pool.apply_async(_detect,
-                                        args=(detector, stream[0], threshold,
-                                              trig_int, moveout, min_trig,
-                                              False, False, 0))
-                       for detector in parameter_detectors]
-            pool.close()
-            _detections = [p.get() for p in results]
-            pool.join()
-            for d in _detections:
-                if isinstance(d, list):
-                    detections += d
-                else:
-                    detections.append(d)
+        # Detectors in the group share channels, so compute all their
+        # statistics from one pass through the data
+        group_stats = _group_statistics(detectors=parameter_detectors,
+                                        stream=processed[0],
+                                        parallel=parallel,
+                                        num_cores=num_cores)
+        for detector, stats in zip(parameter_detectors, group_stats):
+            detections += _detect(detector=detector, st=processed[0],
+                                  threshold=threshold, trig_int=trig_int,
+                                  moveout=moveout, min_trig=min_trig,
+                                  process=False, extract_detections=False,
+                                  debug=0, stats=stats)
     return detections
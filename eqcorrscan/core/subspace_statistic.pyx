@@ -15,6 +15,7 @@ from __future__ import unicode_literals
 import numpy as np
 cimport numpy as np
 import cython
+from scipy.fftpack import next_fast_len
 
 DTYPE = np.float32
 ctypedef np.float32_t DTYPE_t
@@ -22,7 +23,8 @@ ctypedef np.float32_t DTYPE_t
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def det_statistic(np.ndarray[DTYPE_t, ndim=2] detector,
-                  np.ndarray[DTYPE_t, ndim=1] data):
+                  np.ndarray[DTYPE_t, ndim=1] data, normalise=False,
+                  int block_size=65536):
     """
     Base function to calculate the subspace detection statistic.
 
@@ -33,32 +35,113 @@ def det_statistic(np.ndarray[DTYPE_t, ndim=2] detector,
     the data stream, U is the subspace detector and :math:'\\gamma' is the \
     detection statistic from 0 to 1.
 
+    The projection is computed as :math:'||U^Ty||^2', by correlating the
+    data with each basis vector of the detector in the frequency domain,
+    in blocks of data to bound memory use.  Windows running off the end of
+    the data are zero-padded.
+
     :type detector: np.ndarray
     :param detector: U matrix from singular value decomposition
     :type data: np.ndarry
     :param data: Data to detect within
+    :type normalise: bool
+    :param normalise:
+        Whether to divide the statistic by the energy of the data in each
+        window (computed by running sums), giving :math:'y^TUU^Ty / y^Ty'.
+        Defaults to False, in which case the data should be normalised
+        before calling (as done by
+        :func:`eqcorrscan.core.subspace._subspace_process`).
+    :type block_size: int
+    :param block_size: Number of statistic samples to compute at a time.
 
     :returns: Detection statistic from 0-1
     :rtype: np.ndarray
     """
-    cdef int i
-    cdef int datamax = data.shape[0]
-    cdef int ulen = detector.shape[1]
-    cdef int umax = detector.shape[0]
-    cdef int imax = datamax - ulen + 1
-    cdef np.ndarray[DTYPE_t, ndim=1] stats = np.zeros(imax, dtype=DTYPE)
-    # Check that there will not be an empty window
-    cdef np.ndarray[DTYPE_t, ndim=1] _data = \
-        np.concatenate([data, np.zeros((umax * imax) -
-                                       datamax, dtype=DTYPE)])
-    cdef np.ndarray[DTYPE_t, ndim=2] uut = np.dot(detector, detector.T)
-    # Actual loop after static typing
-    for i in range(imax):
-        stats[i] = np.dot(_data[i:i + umax],
-                          np.dot(uut, _data[i:i + umax].T))
-    # Cope with case of errored internal loop
-    if np.all(np.isnan(stats)):
-        return np.zeros(imax, dtype=DTYPE)
-    else:
-        return stats
+    return multi_det_statistic(detectors=[detector], data=data,
+                               normalise=normalise,
+                               block_size=block_size)[0]
+
+
+def multi_det_statistic(detectors, np.ndarray[DTYPE_t, ndim=1] data,
+                        normalise=False, int block_size=65536):
+    """
+    Calculate the subspace detection statistics of many detectors at once.
+
+    The data are Fourier transformed once per block and projected onto the
+    bases of all the detectors, see
+    :func:`eqcorrscan.core.subspace_statistic.det_statistic`.
 
+    :type detectors: list
+    :param detectors:
+        List of float32 U matrices (one channel of each detector), which may
+        have different lengths and dimensions.
+    :type data: np.ndarry
+    :param data: Data to detect within
+    :type normalise: bool
+    :param normalise:
+        Whether to divide the statistics by the energy of the data in each
+        window.
+    :type block_size: int
+    :param block_size:
+        Maximum number of statistic samples to compute at a time, reduced
+        for detectors with many basis vectors in total.
+
+    :returns: List of detection statistics, one per detector.
+    :rtype: list
+    """
+    cdef int datamax = data.shape[0]
+    cdef int start, end, k
+    umaxes = [detector.shape[0] for detector in detectors]
+    # Length of the statistic for each detector, as for the original
+    # per-sample loop
+    imaxes = [datamax - detector.shape[1] + 1 for detector in detectors]
+    all_stats = [np.zeros(max(length, 0), dtype=np.float64)
+                 for length in imaxes]
+    usable = [length > 0 and not np.any(np.isnan(detector))
+              for length, detector in zip(imaxes, detectors)]
+    if not any(usable):
+        return [stats.astype(DTYPE) for stats in all_stats]
+    indices = [i for i, use in enumerate(usable) if use]
+    imax = max([imaxes[i] for i in indices])
+    umax = max([umaxes[i] for i in indices])
+    # Zero-pad so that every window is full
+    _data = np.zeros(imax + umax - 1, dtype=np.float64)
+    _data[0:min(datamax, len(_data))] = data[0:min(datamax, len(_data))]
+    if np.any(np.isnan(_data)):
+        # Cope with case of errored internal loop
+        return [np.zeros(len(stats), dtype=DTYPE) for stats in all_stats]
+    # Correlation with each basis vector is convolution with its reverse,
+    # the bases of all detectors are stacked to share each data transform
+    bases = [detectors[i].T[:, ::-1].astype(np.float64) for i in indices]
+    rows = np.cumsum([0] + [len(basis) for basis in bases])
+    # Keep the projections of a block to around 2 ** 24 values
+    block_size = max(min(block_size, imax, 2 ** 24 // int(rows[-1])), 1)
+    fft_len = next_fast_len(block_size + umax - 1)
+    basis_fft = np.fft.rfft(np.concatenate(
+        [np.pad(basis, ((0, 0), (0, umax - basis.shape[1])), 'constant')
+         for basis in bases]), n=fft_len, axis=1)
+    for start in range(0, imax, block_size):
+        end = min(start + block_size, imax)
+        segment_fft = np.fft.rfft(_data[start:end + umax - 1], n=fft_len)
+        projections = np.fft.irfft(basis_fft * segment_fft, n=fft_len,
+                                   axis=1) ** 2
+        for k, i in enumerate(indices):
+            if start >= imaxes[i]:
+                continue
+            stop = min(end, imaxes[i])
+            # Reversed bases are zero-padded at the end, so windows start
+            # umaxes[i] - 1 samples into the convolution
+            first = umaxes[i] - 1
+            all_stats[i][start:stop] = np.sum(
+                projections[rows[k]:rows[k + 1],
+                            first:first + stop - start], axis=0)
+    if normalise:
+        cumsum_sq = np.concatenate([[0.0], np.cumsum(_data ** 2)])
+        for i in indices:
+            energy = (cumsum_sq[umaxes[i]:umaxes[i] + imaxes[i]] -
+                      cumsum_sq[0:imaxes[i]])
+            # Energies at the level of rounding error are empty windows
+            valid = energy > 10 * np.finfo(np.float64).eps * cumsum_sq[-1]
+            all_stats[i] = np.where(
+                valid, all_stats[i] / np.where(valid, energy, 1.0), 0.0)
+    return [stats.astype(DTYPE) for stats in all_stats]
@@ -0,0 +1,444 @@
+"""
+Benchmarks for the correlation and detection routines in EQcorrscan.
+
+Runs offline using synthetic data from
+:func:`eqcorrscan.utils.synth_seis.generate_synth_data` and writes the timings
+to a JSON file, so that results can be compared between releases and between
+machines.  Each benchmark is run for every combination of the template count,
+channel (station) count, data length and number of cores that it uses.
+
+Run the quick set of benchmarks with::
+
+    python benchmarks.py --quick --outfile benchmarks.json
+
+or see::
+
+    python benchmarks.py --help
+
+:copyright:
+    EQcorrscan developers.
+
+:license:
+    GNU Lesser General Public License, Version 3
+    (https://www.gnu.org/copyleft/lesser.html)
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import warnings
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+
+import numpy as np
+from obspy import UTCDateTime
+
+# Parameters each benchmark is run over, in the order they are varied
+BENCHMARK_PARAMETERS = {
+    'normxcorr2': ['data_length'],
+    'multi_normxcorr': ['n_templates', 'data_length'],
+    '_channel_loop': ['n_templates', 'n_stations', 'data_length', 'cores',
+                      'xcorr_func'],
+    'match_filter': ['n_templates', 'n_stations', 'data_length', 'cores',
+                     'xcorr_func'],
+    'find_peaks2_short': ['data_length'],
+    'lag_calc': ['n_templates', 'n_stations', 'cores'],
+    'subspace_detect': ['n_templates', 'n_stations', 'data_length', 'cores'],
+    'brightness': ['n_stations', 'data_length', 'cores'],
+}
+
+DEFAULT_GRID = {
+    'n_templates': [1, 10, 50],
+    'n_stations': [3, 10],
+    'data_length': [3600.0, 86400.0],
+    'cores': sorted(set([1, cpu_count()])),
+    'xcorr_func': ['time_domain', 'frequency_domain'],
+}
+
+QUICK_GRID = {
+    'n_templates': [1, 5],
+    'n_stations': [3],
+    'data_length': [600.0],
+    'cores': [1],
+    'xcorr_func': ['time_domain', 'frequency_domain'],
+}
+
+
+@contextmanager
+def _quiet():
+    """Suppress printed output and warnings from the routines timed."""
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                yield
+        finally:
+            sys.stdout = stdout
+
+
+class _SyntheticData(object):
+    """
+    Synthetic templates and continuous data, generated once and sub-set.
+
+    :type n_templates: int
+    :param n_templates: Maximum number of templates needed.
+    :type n_stations: int
+    :param n_stations: Maximum number of stations needed, must be < 15.
+    :type samp_rate: float
+    :param samp_rate: Sampling rate in Hz.
+    :type seed: int
+    :param seed: Seed for the random number generator.
+    """
+    def __init__(self, n_templates, n_stations, samp_rate=20.0, seed=42):
+        from eqcorrscan.utils.synth_seis import generate_synth_data
+
+        np.random.seed(seed)
+        with _quiet():
+            self.templates, self.st, self.seeds = generate_synth_data(
+                nsta=n_stations, ntemplates=n_templates, nseeds=20,
+                samp_rate=samp_rate, t_length=6.0, max_amp=10.0,
+                max_lag=10.0)
+        for template in self.templates:
+            for tr in template:
+                tr.data = tr.data.astype(np.float32)
+        for tr in self.st:
+            tr.data = tr.data.astype(np.float32)
+        self.samp_rate = samp_rate
+
+    def get(self, n_templates, n_stations, data_length):
+        """
+        Get a sub-set of the templates and data.
+
+        :type n_templates: int
+        :param n_templates: Number of templates.
+        :type n_stations: int
+        :param n_stations: Number of stations.
+        :type data_length: float
+        :param data_length: Length of continuous data in seconds.
+
+        :returns: List of templates, names and continuous data.
+        :rtype: tuple
+        """
+        stations = sorted(set([tr.stats.station for tr in self.st]))
+        stations = stations[0:n_stations]
+        templates = []
+        for template in self.templates[0:n_templates]:
+            templates.append(template.copy())
+            for tr in templates[-1]:
+                if tr.stats.station not in stations:
+                    templates[-1].remove(tr)
+        st = self.st.copy()
+        for tr in st:
+            if tr.stats.station not in stations:
+                st.remove(tr)
+        st.trim(UTCDateTime(0), UTCDateTime(0) + data_length -
+                (1.0 / self.samp_rate))
+        names = ['template_%i' % i for i in range(len(templates))]
+        return templates, names, st
+
+
+def _bench_normxcorr2(data, parameters):
+    from eqcorrscan.core.match_filter import normxcorr2
+
+    templates, names, st = data.get(1, 1, parameters['data_length'])
+    template = templates[0][0].data
+    image = st[0].data
+    return lambda: normxcorr2(template, image)
+
+
+def _bench_multi_normxcorr(data, parameters):
+    from eqcorrscan.core.match_filter import multi_normxcorr
+
+    templates, names, st = data.get(parameters['n_templates'], 1,
+                                    parameters['data_length'])
+    template_array = np.array([template[0].data for template in templates])
+    image = st[0].data
+    return lambda: multi_normxcorr(template_array, image)
+
+
+def _bench_channel_loop(data, parameters):
+    from eqcorrscan.core.match_filter import _channel_loop
+
+    templates, names, st = data.get(parameters['n_templates'],
+                                    parameters['n_stations'],
+                                    parameters['data_length'])
+    return lambda: _channel_loop(templates=templates, stream=st,
+                                 cores=parameters['cores'],
+                                 xcorr_func=parameters['xcorr_func'])
+
+
+def _bench_match_filter(data, parameters):
+    from eqcorrscan.core.match_filter import match_filter
+
+    templates, names, st = data.get(parameters['n_templates'],
+                                    parameters['n_stations'],
+                                    parameters['data_length'])
+    return lambda: match_filter(
+        template_names=names, template_list=templates, st=st, threshold=8.0,
+        threshold_type='MAD', trig_int=6.0, plotvar=False,
+        cores=parameters['cores'], xcorr_func=parameters['xcorr_func'])
+
+
+def _bench_find_peaks2_short(data, parameters):
+    from eqcorrscan.utils.findpeaks import find_peaks2_short
+
+    arr = np.random.randn(int(parameters['data_length'] * data.samp_rate))
+    threshold = 8 * np.median(np.abs(arr))
+    arr[np.random.randint(len(arr), size=100)] *= 20
+    return lambda: find_peaks2_short(arr=arr, thresh=threshold,
+                                     trig_int=6 * data.samp_rate)
+
+
+def _bench_lag_calc(data, parameters):
+    from eqcorrscan.core.match_filter import match_filter
+    from eqcorrscan.core.lag_calc import lag_calc
+
+    templates, names, st = data.get(parameters['n_templates'],
+                                    parameters['n_stations'], 86400)
+    with _quiet():
+        detections = match_filter(
+            template_names=names, template_list=templates, st=st,
+            threshold=8.0, threshold_type='MAD', trig_int=6.0, plotvar=False,
+            xcorr_func='frequency_domain')
+    parameters['n_detections'] = len(detections)
+    return lambda: lag_calc(
+        detections=detections, detect_data=st, template_names=names,
+        templates=templates, shift_len=0.2, min_cc=0.4,
+        cores=parameters['cores'], parallel=parameters['cores'] > 1)
+
+
+def _bench_subspace_detect(data, parameters):
+    from eqcorrscan.core import subspace
+
+    # Aligning and partitioning a subspace needs at least two templates
+    n_templates = max(parameters['n_templates'], 2)
+    parameters['n_subspace_templates'] = n_templates
+    templates, names, st = data.get(n_templates, parameters['n_stations'],
+                                    parameters['data_length'])
+    with _quiet():
+        detector = subspace.Detector().construct(
+            streams=templates, lowcut=2.0, highcut=9.0, filt_order=4,
+            sampling_rate=data.samp_rate, multiplex=False, name='benchmark',
+            align=True, shift_len=0.5, reject=0.0)
+        detector.partition(min(len(templates), 3))
+    return lambda: subspace.subspace_detect(
+        detectors=[detector], stream=st, threshold=0.5, trig_int=6.0,
+        parallel=parameters['cores'] > 1, num_cores=parameters['cores'])
+
+
+def _bench_brightness(data, parameters):
+    from eqcorrscan.core.bright_lights import brightness
+
+    templates, names, st = data.get(1, parameters['n_stations'],
+                                    parameters['data_length'])
+    stations = [tr.stats.station for tr in st]
+    n_nodes = 50
+    nodes = [(float(lat), float(lon), float(depth)) for lat, lon, depth in
+             np.random.random((n_nodes, 3)) * [1.0, 1.0, 20.0]]
+    lags = np.random.random((len(stations), n_nodes)) * 10.0
+    parameters['n_nodes'] = n_nodes
+
+    def _run():
+        template_saveloc = tempfile.mkdtemp()
+        try:
+            brightness(stations=stations, nodes=nodes, lags=lags, stream=st,
+                       threshold=10.0, thresh_type='MAD', template_length=6.0,
+                       template_saveloc=template_saveloc,
+                       coherence_thresh=(0.5, 10), cores=parameters['cores'])
+        finally:
+            shutil.rmtree(template_saveloc)
+    return _run
+
+
+BENCHMARKS = {
+    'normxcorr2': _bench_normxcorr2,
+    'multi_normxcorr': _bench_multi_normxcorr,
+    '_channel_loop': _bench_channel_loop,
+    'match_filter': _bench_match_filter,
+    'find_peaks2_short': _bench_find_peaks2_short,
+    'lag_calc': _bench_lag_calc,
+    'subspace_detect': _bench_subspace_detect,
+    'brightness': _bench_brightness,
+}
+
+
+def _time(func, repeats):
+    """Time repeated calls of func, returning a list of times in seconds."""
+    from eqcorrscan.utils.timer import Timer
+
+    times = []
+    for _ in range(repeats):
+        with _quiet():
+            with Timer() as t:
+                func()
+        times.append(t.secs)
+    return times
+
+
+def run_benchmarks(benchmarks=None, grid=None, repeats=3, samp_rate=20.0,
+                   seed=42, outfile=None, verbose=True):
+    """
+    Run benchmarks over a grid of parameters.
+
+    :type benchmarks: list
+    :param benchmarks:
+        Names of benchmarks to run, see BENCHMARKS, defaults to all.
+    :type grid: dict
+    :param grid:
+        Dictionary of lists of values of n_templates, n_stations (channels),
+        data_length (in seconds, up to 86400), cores and xcorr_func to run
+        over, defaults to DEFAULT_GRID.  Keys not given are taken from
+        DEFAULT_GRID.
+    :type repeats: int
+    :param repeats: Number of times to time each benchmark.
+    :type samp_rate: float
+    :param samp_rate: Sampling rate of synthetic data in Hz.
+    :type seed: int
+    :param seed: Seed for generating synthetic data.
+    :type outfile: str
+    :param outfile: File to write results to as JSON, if None, not written.
+    :type verbose: bool
+    :param verbose: Print a line for each result.
+
+    :returns:
+        Dictionary of information about the run and a list of results, one
+        per benchmark and set of parameters, with the times in seconds of
+        each repeat, or the error raised.
+    :rtype: dict
+    """
+    import eqcorrscan
+    import scipy
+
+    benchmarks = benchmarks or sorted(BENCHMARKS.keys())
+    for benchmark in benchmarks:
+        if benchmark not in BENCHMARKS:
+            raise ValueError('Unknown benchmark: %s, should be one of %s' %
+                             (benchmark, sorted(BENCHMARKS.keys())))
+    _grid = dict(DEFAULT_GRID)
+    _grid.update(grid or {})
+    data = _SyntheticData(n_templates=max(max(_grid['n_templates']), 2),
+                          n_stations=max(_grid['n_stations']),
+                          samp_rate=samp_rate, seed=seed)
+    output = {
+        'eqcorrscan_version': str(eqcorrscan.__version__),
+        'numpy_version': np.__version__,
+        'scipy_version': scipy.__version__,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': cpu_count(),
+        'date': str(UTCDateTime()),
+        'samp_rate': samp_rate,
+        'repeats': repeats,
+        'results': []}
+    for benchmark in benchmarks:
+        names = BENCHMARK_PARAMETERS[benchmark]
+        for values in itertools.product(*[_grid[name] for name in names]):
+            parameters = dict(zip(names, values))
+            result = {'benchmark': benchmark, 'parameters': parameters}
+            np.random.seed(seed)
+            try:
+                result['times'] = _time(
+                    BENCHMARKS[benchmark](data, parameters), repeats)
+                result['best'] = min(result['times'])
+                result['mean'] = float(np.mean(result['times']))
+            except Exception as e:
+                result['error'] = repr(e)
+            output['results'].append(result)
+            if verbose:
+                print('%s %s: %s' % (
+                    benchmark, parameters,
+                    '%.4f s' % result['best'] if 'best' in result
+                    else result['error']))
+    if outfile:
+        with open(outfile, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    return output
+
+
+def compare_benchmarks(reference, results, tolerance=1.2):
+    """
+    Find benchmarks that have slowed down relative to a reference run.
+
+    :type reference: dict
+    :param reference:
+        Output of :func:`run_benchmarks`, or the name of a JSON file of it.
+    :type results: dict
+    :param results:
+        Output of :func:`run_benchmarks`, or the name of a JSON file of it.
+    :type tolerance: float
+    :param tolerance:
+        Ratio of best times above which a benchmark is considered slower.
+
+    :returns:
+        List of tuples of (benchmark, parameters, reference time, time) for
+        benchmarks slower than the reference.
+    :rtype: list
+    """
+    if not isinstance(reference, dict):
+        with open(reference, 'r') as f:
+            reference = json.load(f)
+    if not isinstance(results, dict):
+        with open(results, 'r') as f:
+            results = json.load(f)
+    reference_times = dict([
+        ((result['benchmark'], json.dumps(result['parameters'],
+                                          sort_keys=True)), result['best'])
+        for result in reference['results'] if 'best' in result])
+    slower = []
+    for result in results['results']:
+        key = (result['benchmark'], json.dumps(result['parameters'],
+                                               sort_keys=True))
+        if key not in reference_times or 'best' not in result:
+            continue
+        if result['best'] > tolerance * reference_times[key]:
+            slower.append((result['benchmark'], result['parameters'],
+                           reference_times[key], result['best']))
+    return slower
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark EQcorrscan using synthetic data.')
+    parser.add_argument('-o', '--outfile',
+                        default='eqcorrscan_benchmarks.json',
+                        help='JSON file to write results to.')
+    parser.add_argument('-b', '--benchmarks', nargs='+',
+                        choices=sorted(BENCHMARKS.keys()),
+                        help='Benchmarks to run, defaults to all.')
+    parser.add_argument('-q', '--quick', action='store_true',
+                        help='Run a small grid of parameters.')
+    parser.add_argument('-r', '--repeats', type=int, default=3,
+                        help='Number of times to run each benchmark.')
+    parser.add_argument('-c', '--compare',
+                        help='JSON file of a previous run to compare to.')
+    for name, kind in [('n_templates', int), ('n_stations', int),
+                       ('data_length', float), ('cores', int),
+                       ('xcorr_func', str)]:
+        parser.add_argument('--' + name, nargs='+', type=kind,
+                            help='Values of %s to run over.' % name)
+    args = parser.parse_args()
+    grid = dict(QUICK_GRID) if args.quick else dict(DEFAULT_GRID)
+    for name in DEFAULT_GRID.keys():
+        if getattr(args, name) is not None:
+            grid[name] = getattr(args, name)
+    output = run_benchmarks(benchmarks=args.benchmarks, grid=grid,
+                            repeats=args.repeats, outfile=args.outfile)
+    if args.compare:
+        for benchmark, parameters, reference_time, time in \
+                compare_benchmarks(args.compare, output):
+            print('SLOWER: %s %s: %.4f s, was %.4f s' % (
+                benchmark, parameters, time, reference_time))
@@ -11,14 +11,13 @@ def run():
     python session for debugging."""
     from eqcorrscan.utils import pre_processing
     from eqcorrscan.utils.archive_read import read_data
-    from eqcorrscan.core.match_filter import match_filter
+    from eqcorrscan.core.match_filter import match_filter, TemplateBank
     from obspy import UTCDateTime, Stream
     from eqcorrscan.utils.parameters import read_parameters
     import warnings
     import os
     import datetime as dt
     from obspy import read
-    import copy
 
     # Read parameter files
     par = read_parameters('../parameters/VSP_parameters.txt')
@@ -54,6 +53,9 @@ def run():
                 for st in templates
                 for tr in st]
     stachans = list(set(stachans))
+    # Align the templates once for all days
+    bank = TemplateBank().construct(templates=templates,
+                                    names=template_names_short)
     # Loop through days
     for date in dates:
         # Read in the data
@@ -64,13 +66,10 @@ def run():
                                     filt_order=par.filt_order,
                                     samp_rate=par.samp_rate, debug=par.debug,
                                     starttime=UTCDateTime(date.date))
-        # Will remove templates if they are deemed useless
-        # (eg no matching channels)
-        template_names_short_copy = copy.deepcopy(template_names_short)
-        templates_copy = copy.deepcopy(templates)
-        # Now conduct matched-filter
-        detections = match_filter(template_names=template_names_short_copy,
-                                  template_list=templates_copy,
+        # Now conduct matched-filter, templates without matching channels
+        # are skipped for this day.
+        detections = match_filter(template_names=bank.names,
+                                  template_list=bank,
                                   st=st, threshold=par.threshold,
                                   threshold_type=par.threshold_type,
                                   trig_int=par.trigger_interval,
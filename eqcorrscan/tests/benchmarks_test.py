@@ -0,0 +1,51 @@
+"""
+Functions for testing the benchmarks script
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def _load_benchmarks():
+    """Load the benchmarks script, which is not part of the package."""
+    path = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'scripts', 'benchmarks.py')
+    namespace = {'__name__': 'benchmarks', '__file__': path}
+    with open(path) as f:
+        exec(compile(f.read(), path, 'exec'), namespace)
+    return namespace
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_quick_grid(self):
+        """Check that every benchmark of the quick grid runs."""
+        benchmarks = _load_benchmarks()
+        tempdir = tempfile.mkdtemp()
+        try:
+            outfile = os.path.join(tempdir, 'benchmarks.json')
+            output = benchmarks['run_benchmarks'](
+                grid=benchmarks['QUICK_GRID'], repeats=1, outfile=outfile,
+                verbose=False)
+            self.assertTrue(os.path.isfile(outfile))
+        finally:
+            shutil.rmtree(tempdir)
+        errors = [(result['benchmark'], result['parameters'],
+                   result['error']) for result in output['results']
+                  if 'error' in result]
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            sorted(set([result['benchmark']
+                        for result in output['results']])),
+            sorted(benchmarks['BENCHMARKS'].keys()))
+        self.assertEqual(
+            benchmarks['compare_benchmarks'](output, output), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
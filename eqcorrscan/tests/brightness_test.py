@@ -92,6 +92,61 @@ class BrightnessTestMethods(unittest.TestCase):
                 other_lags = np.array([l for l in lag if not l == _lag])
                 self.assertTrue(np.all(np.abs(other_lags - _lag) > threshold))
 
+    def test_rm_similarlags_network(self):
+        from eqcorrscan.core.bright_lights import _rm_similarlags
+        import numpy as np
+
+        threshold = 1.5
+        lags = np.random.uniform(0, 10, (3, 500))
+        nodes = [(i, i, i) for i in range(500)]
+        stations, nodes_out, lags_out = _rm_similarlags(
+            stations=['A', 'B', 'C'], nodes=nodes, lags=lags,
+            threshold=threshold)
+        # Compare with checking every kept node in turn
+        node_indeces = [0]
+        for i in range(1, 500):
+            if np.all(np.abs((lags.T[node_indeces] - lags.T[i]).sum(axis=1))
+                      > threshold):
+                node_indeces.append(i)
+        self.assertEqual(nodes_out, [nodes[i] for i in node_indeces])
+        self.assertEqual(lags_out.shape, (3, len(node_indeces)))
+
+    def test_prepare_grid(self):
+        from eqcorrscan.core.bright_lights import prepare_grid, _read_tt
+        from eqcorrscan.core.bright_lights import _rm_similarlags
+        import os
+        import shutil
+        import tempfile
+        import numpy as np
+
+        testing_path = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                                    'test_data') + os.sep
+        stations, nodes, lags = _rm_similarlags(
+            *_read_tt(path=testing_path, stations=['COSA', 'LABE'],
+                      phase='S', phaseout='S'), threshold=2)
+        cache_dir = tempfile.mkdtemp()
+        try:
+            for i in range(2):
+                _stations, _nodes, _lags = prepare_grid(
+                    path=testing_path, stations=['COSA', 'LABE'], phase='S',
+                    phaseout='S', threshold=2, cache_dir=cache_dir)
+                self.assertEqual(_stations, stations)
+                self.assertEqual(_nodes, nodes)
+                self.assertTrue(np.allclose(_lags, lags))
+            # The second call should read from the cache
+            self.assertTrue(isinstance(_lags, np.memmap))
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+            # Changing a parameter should not use the cache
+            _stations, _nodes, _lags = prepare_grid(
+                path=testing_path, stations=['COSA', 'LABE'], phase='S',
+                phaseout='S', threshold=None, cache_dir=cache_dir)
+            all_nodes = _read_tt(path=testing_path, stations=['COSA', 'LABE'],
+                                 phase='S', phaseout='S')[1]
+            self.assertEqual(len(_nodes), len(all_nodes))
+            self.assertEqual(len(os.listdir(cache_dir)), 6)
+        finally:
+            shutil.rmtree(cache_dir)
+
     def test_rms(self):
         from eqcorrscan.core.bright_lights import _rms
         import numpy as np
@@ -101,59 +156,60 @@ class BrightnessTestMethods(unittest.TestCase):
         rms = _rms(np.random.randn(10000))
         self.assertEqual(round(rms), 1)
 
-    def test_node_loop(self):
-        from eqcorrscan.core.bright_lights import _node_loop, _read_tt
-        import os
+    def test_station_energy(self):
+        from eqcorrscan.core.bright_lights import _station_energy
         from obspy import Stream, Trace
         import numpy as np
 
-        testing_path = os.path.join(os.path.abspath(os.path.dirname(__file__)),
-                                    'test_data') + os.sep
-        stations, nodes, lags = _read_tt(path=testing_path,
-                                         stations=['COSA', 'LABE'],
-                                         phase='S', phaseout='S')
-        st = Stream(Trace())
-        st[0].stats.station = stations[0]
-        st[0].data = np.random.randn(86400) * 3000
-        st[0].data = st[0].data.astype(np.int16)
-        st += Trace(np.random.randn(86400) * 3000)
-        st[1].stats.station = 'LABE'
-        index, energy = _node_loop(stations=stations, lags=lags[:, 1],
-                                   stream=st, clip_level=4)
-        self.assertEqual(index, 0)
-        self.assertEqual(np.shape(energy), (1, 86400))
+        st = Stream(Trace(np.random.randn(1000) * 3000))
+        st[0].stats.station = 'COSA'
+        st += Trace(np.random.randn(1000) * 3000)
+        st[1].stats.station = 'WVZ'
+        st += Trace(np.random.randn(1000) * 3000)
+        st[2].stats.station = 'LABE'
+        energy, station_indices = _station_energy(stations=['LABE', 'COSA'],
+                                                  stream=st, clip_level=4)
+        self.assertEqual(energy.shape, (2, 1000))
+        self.assertEqual(station_indices, [1, 0])
+        self.assertEqual(energy.max(), 500)
+        self.assertTrue(np.all(energy >= 0))
+
+    def test_node_loop(self):
+        from eqcorrscan.core.bright_lights import _node_loop
+        import numpy as np
+
+        energy = np.random.randint(0, 500, (2, 1000)).astype(np.uint16)
+        index, response = _node_loop(energy=energy, lags=[0, 10], i=3)
+        self.assertEqual(index, 3)
+        self.assertEqual(np.shape(response), (1, 1000))
+        expected = energy[0].astype(np.int64)
+        expected[0:990] += energy[1][10:]
+        self.assertTrue(np.all(response[0] == expected))
+        # Lags beyond the end of the data do not contribute
+        index, response = _node_loop(energy=energy, lags=[0, 2000])
+        self.assertTrue(np.all(response[0] == energy[0]))
 
     def test_cum_net_resp(self):
-        from eqcorrscan.core.bright_lights import _cum_net_resp
-        from eqcorrscan.core.bright_lights import _node_loop, _read_tt
-        import os
-        from obspy import Stream, Trace
+        from eqcorrscan.core.bright_lights import _cum_net_resp, _node_loop
         import numpy as np
 
-        testing_path = os.path.join(os.path.abspath(os.path.dirname(__file__)),
-                                    'test_data') + os.sep
-        stations, nodes, lags = _read_tt(path=testing_path,
-                                         stations=['COSA', 'LABE'],
-                                         phase='S', phaseout='S')
-        st = Stream(Trace())
-        st[0].stats.station = stations[0]
-        st[0].data = np.random.randn(86400) * 3000
-        st[0].data = st[0].data.astype(np.int16)
-        st += Trace(np.random.randn(86400) * 3000)
-        st[1].stats.station = stations[1]
-        index, energy_file = _node_loop(stations=stations, lags=lags[:, 1],
-                                        stream=st, clip_level=4,
-                                        mem_issue=True)
-        self.assertEqual(index, 0)
-        self.assertTrue(type(energy_file) == str)
-        cum_net_resp, indeces = _cum_net_resp(node_lis=[0])
-        self.assertEqual(len(cum_net_resp), 86400)
-        self.assertEqual(len(indeces), 86400)
+        energy = np.random.randint(0, 500, (3, 1000)).astype(np.uint16)
+        lags = np.random.randint(0, 50, (3, 20))
+        node_lis = np.arange(5, 25)
+        cum_net_resp, indeces = _cum_net_resp(energy=energy, lags=lags,
+                                              node_lis=node_lis)
+        self.assertEqual(len(cum_net_resp), 1000)
+        self.assertEqual(len(indeces), 1000)
+        responses = np.concatenate([_node_loop(energy, lags[:, i])[1]
+                                    for i in range(20)])
+        self.assertTrue(np.all(cum_net_resp == responses.max(axis=0)))
+        self.assertTrue(np.all(indeces ==
+                               node_lis[np.argmax(responses, axis=0)]))
 
     def test_find_detections(self):
         from eqcorrscan.core.bright_lights import _find_detections
         from eqcorrscan.core.bright_lights import _cum_net_resp
-        from eqcorrscan.core.bright_lights import _node_loop, _read_tt
+        from eqcorrscan.core.bright_lights import _station_energy, _read_tt
         import os
         from obspy import Stream, Trace
         import numpy as np
@@ -169,11 +225,12 @@ class BrightnessTestMethods(unittest.TestCase):
         st[0].data = st[0].data.astype(np.int16)
         st += Trace(np.random.randn(86400) * 3000)
         st[1].stats.station = stations[1]
-        index, energy_file = _node_loop(stations=stations, lags=lags[:, 1],
-                                        stream=st, clip_level=4,
-                                        mem_issue=True)
-        cum_net_resp, indeces = _cum_net_resp(node_lis=[0])
-        all_nodes = [nodes[1] for i in range(len(cum_net_resp))]
+        energy, station_indices = _station_energy(stations=stations,
+                                                  stream=st, clip_level=4)
+        lag_samples = np.round(lags[station_indices][:, [1]]).astype(int)
+        cum_net_resp, indeces = _cum_net_resp(energy=energy,
+                                              lags=lag_samples, node_lis=[1])
+        all_nodes = [nodes[i] for i in indeces]
         detections = _find_detections(cum_net_resp=cum_net_resp,
                                       nodes=all_nodes, threshold=10,
                                       thresh_type='MAD', samp_rate=1,
@@ -208,7 +265,9 @@ class BrightnessTestMethods(unittest.TestCase):
 
     def test_brightness(self):
         from eqcorrscan.core.bright_lights import brightness, _read_tt
+        from eqcorrscan import EQcorrscanDeprecationWarning
         import os
+        import warnings
         from obspy import Stream, Trace
         import numpy as np
 
@@ -226,13 +285,15 @@ class BrightnessTestMethods(unittest.TestCase):
         st[1].stats.station = stations[1]
         st[1].stats.channel = 'HHZ'
         st[0].stats.channel = 'HHZ'
-        detections, nodes_out = brightness(stations=stations, nodes=nodes,
-                                           lags=lags, stream=st,
-                                           threshold=1.885,
-                                           thresh_type='MAD',
-                                           template_length=1,
-                                           template_saveloc='.',
-                                           coherence_thresh=(10, 1))
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            detections, nodes_out = brightness(
+                stations=stations, nodes=nodes, lags=lags, stream=st,
+                threshold=1.885, thresh_type='MAD', template_length=1,
+                template_saveloc='.', coherence_thresh=(10, 1), instance=1)
+        self.assertTrue(any([issubclass(_w.category,
+                                        EQcorrscanDeprecationWarning)
+                             for _w in w]))
         self.assertEqual(len(detections), 0)
         self.assertEqual(len(detections), len(nodes_out))
 
@@ -45,5 +45,56 @@ class CatalogUtilsTests(unittest.TestCase):
                 filtered_stations.append(pick.waveform_id.station_code)
         self.assertEqual(len(list(set(filtered_stations))), top_n_picks)
 
+    def test_spatial_index(self):
+        """Check pairs from the index against every pair."""
+        import numpy as np
+        from eqcorrscan.utils.catalog_utils import SpatialIndex
+        from eqcorrscan.utils.mag_calc import dist_calc
+        np.random.seed(0)
+        for latitude in [-43, 75]:
+            locations = np.column_stack([
+                latitude + np.random.randn(300) * 0.2,
+                170 + np.random.randn(300) * 0.4,
+                np.random.uniform(0, 30, 300)])
+            times = np.random.uniform(0, 10 * 86400, 300)
+            index = SpatialIndex(locations, times=times)
+            for max_time in [None, 86400]:
+                rows, columns, distances = index.query_pairs(
+                    max_distance=10, max_time=max_time)
+                expected = []
+                for i in range(300):
+                    for j in range(i + 1, 300):
+                        if max_time and abs(times[i] - times[j]) > max_time:
+                            continue
+                        if dist_calc(locations[i], locations[j]) <= 10:
+                            expected.append((i, j))
+                self.assertTrue(len(expected) > 0)
+                self.assertEqual(list(zip(rows.tolist(), columns.tolist())),
+                                 expected)
+                self.assertTrue(np.all(distances <= 10))
+        index = SpatialIndex(np.zeros((1, 3)))
+        self.assertEqual(len(index.query_pairs(max_distance=10)[0]), 0)
+
+    def test_spatial_index_from_catalog(self):
+        """Check building the index from a catalog."""
+        from obspy import UTCDateTime
+        from obspy.core.event import Catalog, Event, Origin
+        from eqcorrscan.utils.catalog_utils import SpatialIndex
+        catalog = Catalog()
+        for i, (latitude, depth) in enumerate([(-43.0, 5000), (-43.01, 6000),
+                                               (-44.0, 5000)]):
+            catalog.append(Event(origins=[Origin(
+                latitude=latitude, longitude=170.0, depth=depth,
+                time=UTCDateTime(2016, 1, 1) + i * 3600)]))
+        index = SpatialIndex.from_catalog(catalog)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.locations[1, 2], 6.0)
+        rows, columns, distances = index.query_pairs(max_distance=5)
+        self.assertEqual((rows.tolist(), columns.tolist()), ([0], [1]))
+        rows, columns, distances = index.query_pairs(max_distance=5,
+                                                     max_time=1800)
+        self.assertEqual(len(rows), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -61,6 +61,81 @@ class ClusteringTestMethods(unittest.TestCase):
         self.assertEqual(dist_mat.shape[0], len(stream_list))
         self.assertEqual(dist_mat.shape[1], len(stream_list))
 
+    def test_distance_matrix_pairs(self):
+        """Check the distance matrix against pairwise coherences."""
+        from obspy import read
+        import numpy as np
+        from eqcorrscan.utils.clustering import distance_matrix
+        from eqcorrscan.utils.clustering import cross_chan_coherence
+        np.random.seed(42)
+        stream_list = []
+        for i in range(6):
+            st = read()
+            for tr in st:
+                tr.data = tr.data + np.random.randn(len(tr.data)) * 200
+            stream_list.append(st)
+        # Missing and shorter channels
+        stream_list[2].remove(stream_list[2][0])
+        stream_list[4][1].data = stream_list[4][1].data[0:2000]
+        for allow_shift in [False, True]:
+            dist_mat = distance_matrix(stream_list=stream_list,
+                                       allow_shift=allow_shift,
+                                       shift_len=2, cores=2)
+            for i in range(6):
+                self.assertEqual(dist_mat[i, i], 0)
+                for j in range(i + 1, 6):
+                    cccoh = cross_chan_coherence(
+                        st1=stream_list[i], st2=stream_list[j],
+                        allow_shift=allow_shift, shift_len=2)[0]
+                    self.assertAlmostEqual(dist_mat[i, j], 1 - cccoh,
+                                           places=4)
+                    self.assertEqual(dist_mat[i, j], dist_mat[j, i])
+
+    def test_sparse_distance_matrix(self):
+        """Check blocked distance matrices against the dense matrix."""
+        from obspy import read
+        import os
+        import shutil
+        import tempfile
+        import numpy as np
+        from scipy.spatial.distance import squareform
+        from eqcorrscan.utils.clustering import distance_matrix
+        from eqcorrscan.utils.clustering import condensed_distance_matrix
+        from eqcorrscan.utils.clustering import sparse_distance_matrix
+        np.random.seed(42)
+        stream_list = []
+        for i in range(7):
+            st = read()
+            for tr in st:
+                tr.data = tr.data + np.random.randn(len(tr.data)) * 1000 * i
+            stream_list.append(st)
+        stream_list[3][2].data = stream_list[3][2].data[0:2500]
+        for allow_shift in [False, True]:
+            dist_mat = distance_matrix(stream_list=stream_list,
+                                       allow_shift=allow_shift,
+                                       shift_len=2, cores=2)
+            tempdir = tempfile.mkdtemp()
+            try:
+                dist_vec = condensed_distance_matrix(
+                    stream_list=stream_list, allow_shift=allow_shift,
+                    shift_len=2, cores=2,
+                    filename=os.path.join(tempdir, 'dist_vec.npy'),
+                    block_size=2)
+                self.assertTrue(np.allclose(dist_vec,
+                                            squareform(dist_mat)))
+                del dist_vec
+            finally:
+                shutil.rmtree(tempdir)
+            sparse = sparse_distance_matrix(
+                stream_list=stream_list, max_distance=0.5,
+                allow_shift=allow_shift, shift_len=2, cores=2,
+                block_size=3).tocoo()
+            close = [(i, j) for i in range(7) for j in range(i + 1, 7)
+                     if dist_mat[i, j] <= 0.5]
+            self.assertEqual(sorted(zip(sparse.row, sparse.col)), close)
+            self.assertTrue(np.allclose(sparse.data,
+                                        dist_mat[sparse.row, sparse.col]))
+
     def test_unclustered(self):
         """Test clustering on unclustered data..."""
         from obspy import read
@@ -273,6 +348,112 @@ class ClusteringTestMethods(unittest.TestCase):
         self.assertEqual(len([ev for group in groups for ev in group]),
                          len(cat))
 
+    def test_space_cluster_groups(self):
+        """Check space_cluster against average linkage of all pairs."""
+        import numpy as np
+        from obspy.core.event import Catalog, Event, Origin
+        from scipy.cluster.hierarchy import linkage, fcluster
+        from scipy.spatial.distance import squareform
+        from eqcorrscan.utils.clustering import space_cluster, dist_mat_km
+        np.random.seed(0)
+        catalog = Catalog()
+        for centre in [(-43.0, 170.0), (-43.5, 170.5), (-44.0, 172.0)]:
+            for i in range(20):
+                catalog.append(Event(origins=[Origin(
+                    latitude=centre[0] + np.random.randn() * 0.05,
+                    longitude=centre[1] + np.random.randn() * 0.05,
+                    depth=np.random.uniform(0, 20000))]))
+        d_thresh = 15
+        groups = space_cluster(catalog=catalog, d_thresh=d_thresh,
+                               show=False)
+        indices = fcluster(linkage(squareform(dist_mat_km(catalog)),
+                                   method='average'),
+                           t=d_thresh, criterion='distance')
+        expected = set(
+            frozenset(str(catalog[i].resource_id)
+                      for i in np.where(indices == group_id)[0])
+            for group_id in set(indices))
+        self.assertEqual(set(frozenset(str(ev.resource_id) for ev in group)
+                             for group in groups), expected)
+
+    def test_space_time_cluster_bursts(self):
+        """Check that later bursts at the same place are split off."""
+        import numpy as np
+        from obspy import UTCDateTime
+        from obspy.core.event import Catalog, Event, Origin
+        from eqcorrscan.utils.clustering import space_time_cluster
+        np.random.seed(0)
+        catalog = Catalog()
+        for start in [UTCDateTime(2016, 6, 1), UTCDateTime(2016, 1, 1)]:
+            for i in range(10):
+                catalog.append(Event(origins=[Origin(
+                    latitude=-43.0 + np.random.randn() * 0.01,
+                    longitude=170.0 + np.random.randn() * 0.01,
+                    depth=5000, time=start + i * 600)]))
+        # One event far away
+        catalog.append(Event(origins=[Origin(
+            latitude=-40.0, longitude=175.0, depth=5000,
+            time=UTCDateTime(2016, 1, 1))]))
+        groups = space_time_cluster(catalog=catalog, t_thresh=6000,
+                                    d_thresh=10)
+        self.assertEqual(sorted(len(group) for group in groups),
+                         [1] * 11 + [10])
+        self.assertEqual(groups[0][0].origins[0].time,
+                         UTCDateTime(2016, 1, 1))
+        # Events within t_thresh of each other are not chained together
+        groups = space_time_cluster(catalog=catalog, t_thresh=3000,
+                                    d_thresh=10)
+        self.assertEqual(sorted(len(group) for group in groups),
+                         [1] * 15 + [6])
+
+    def test_space_time_cluster_order(self):
+        """Check space_time_cluster against removing events in time order."""
+        import copy
+        import numpy as np
+        from obspy import UTCDateTime
+        from obspy.core.event import Catalog, Event, Origin
+        from eqcorrscan.utils.clustering import space_time_cluster
+        from eqcorrscan.utils.clustering import space_cluster
+        np.random.seed(1)
+        catalog = Catalog()
+        for centre in [(-43.0, 170.0), (-43.5, 170.5), (-44.0, 172.0)]:
+            for i in range(20):
+                catalog.append(Event(origins=[Origin(
+                    latitude=centre[0] + np.random.randn() * 0.05,
+                    longitude=centre[1] + np.random.randn() * 0.05,
+                    depth=np.random.uniform(0, 20000),
+                    time=UTCDateTime(2016, 1, 1) +
+                    np.random.uniform(0, 86400 * 5))]))
+        t_thresh, d_thresh = 86400, 15
+        # Clustering rule of previous versions, iterating over copies of
+        # the groups so that no event is skipped.
+        sorted_catalog = Catalog(sorted(
+            catalog, key=lambda event: event.origins[0].time))
+        expected = []
+        for group in space_cluster(catalog=sorted_catalog,
+                                   d_thresh=d_thresh, show=False):
+            group = list(group)
+            for master in copy.copy(group):
+                if master not in group:
+                    continue
+                for event in copy.copy(group):
+                    if abs(event.origins[0].time -
+                           master.origins[0].time) > t_thresh:
+                        expected.append([event])
+                        group.remove(event)
+            expected.append(group)
+        expected = set(frozenset(str(event.resource_id) for event in group)
+                       for group in expected)
+        self.assertTrue(len(expected) > 3)
+        for order in [np.arange(len(catalog)),
+                      np.random.permutation(len(catalog))]:
+            groups = space_time_cluster(
+                catalog=Catalog([catalog[i] for i in order]),
+                t_thresh=t_thresh, d_thresh=d_thresh)
+            self.assertEqual(
+                set(frozenset(str(event.resource_id) for event in group)
+                    for group in groups), expected)
+
 
 if __name__ == '__main__':
     """
@@ -26,6 +26,26 @@ class TestPeakFinding(unittest.TestCase):
                          'updated?')
         self.assertTrue((np.array(peaks) == expected_peaks).all())
 
+    def test_multi_find_peaks(self):
+        """Test multi_find_peaks matches find_peaks2_short for each row."""
+        from eqcorrscan.utils.findpeaks import (find_peaks2_short,
+                                                multi_find_peaks)
+        import numpy as np
+        np.random.seed(42)
+        arr = np.random.randn(3, 2000)
+        threshs = [1.5, 2.0, 2.5]
+        peaks = multi_find_peaks(arr=arr, thresh=threshs, trig_int=10)
+        self.assertEqual(len(peaks), 3)
+        for row, thresh, row_peaks in zip(arr, threshs, peaks):
+            self.assertEqual(row_peaks, find_peaks2_short(
+                arr=row, thresh=thresh, trig_int=10))
+        # A single threshold is applied to all rows
+        peaks = multi_find_peaks(arr=arr, thresh=2.0, trig_int=10)
+        self.assertEqual(peaks[1], find_peaks2_short(
+            arr=arr[1], thresh=2.0, trig_int=10))
+        with self.assertRaises(IndexError):
+            multi_find_peaks(arr=arr, thresh=[1.0, 2.0], trig_int=10)
+
     def test_coincidence(self):
         """Test the coincidence trigger."""
         from eqcorrscan.utils.findpeaks import coin_trig
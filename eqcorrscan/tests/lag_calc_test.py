@@ -70,6 +70,128 @@ class TestMethods(unittest.TestCase):
         for picked_stachan in picked_stachans:
             self.assertTrue(picked_stachan in matched_traces)
 
+    def test_batch_loop(self):
+        """Check batched correlation gives the same picks as channel loop.
+        """
+        from eqcorrscan.core.match_filter import DETECTION
+        from obspy import UTCDateTime
+        detection = DETECTION('test', UTCDateTime(0), len(self.template),
+                              0.0, 0.0, 'corr', id='Tester_01')
+        for interpolate in [False, True]:
+            i, event = lag_calc._channel_loop(
+                detection=self.detection, template=self.template,
+                min_cc=0.4, i=0, detection_id='Tester_01',
+                interpolate=interpolate)
+            batched = lag_calc._batch_loop(
+                detection_streams=[self.detection, self.detection.copy()],
+                template=self.template, min_cc=0.4,
+                detections=[detection, detection], interpolate=interpolate)
+            self.assertEqual(len(batched), 2)
+            for batch_event in batched:
+                self.assertEqual(len(batch_event.picks), len(event.picks))
+                for pick, batch_pick in zip(event.picks, batch_event.picks):
+                    self.assertEqual(pick.waveform_id, batch_pick.waveform_id)
+                    self.assertTrue(abs(pick.time - batch_pick.time) < 0.001)
+
+    def test_parallel_batch_loop(self):
+        """Check sharing windows with a pool gives the same picks."""
+        import shutil
+        import tempfile
+        from multiprocessing import Pool
+        from eqcorrscan.core.match_filter import DETECTION
+        from obspy import UTCDateTime
+        detection = DETECTION('test', UTCDateTime(0), len(self.template),
+                              0.0, 0.0, 'corr', id='Tester_01')
+        kwargs = dict(detection_streams=[self.detection,
+                                         self.detection.copy()],
+                      template=self.template, min_cc=0.4,
+                      detections=[detection, detection], interpolate=True)
+        serial = lag_calc._batch_loop(**kwargs)
+        pool = Pool(processes=2)
+        shared_dir = tempfile.mkdtemp()
+        try:
+            parallel = lag_calc._batch_loop(pool=pool, shared_dir=shared_dir,
+                                            **kwargs)
+        finally:
+            pool.close()
+            pool.join()
+            shutil.rmtree(shared_dir)
+        for event, parallel_event in zip(serial, parallel):
+            self.assertEqual(
+                [(pick.waveform_id, pick.time) for pick in event.picks],
+                [(pick.waveform_id, pick.time)
+                 for pick in parallel_event.picks])
+
+    def test_stacked_normxcorr(self):
+        """Check stacked correlations match normxcorr2."""
+        np.random.seed(0)
+        template = np.random.randn(50)
+        images = np.random.randn(3, 400)
+        images[1, 100:150] += template
+        images[2, 0:200] = 0
+        cccs = lag_calc._stacked_normxcorr(template, images)
+        self.assertEqual(cccs.shape, (3, 351))
+        for image, ccc in zip(images[0:2], cccs):
+            self.assertTrue(np.allclose(
+                normxcorr2(template, image)[0], ccc, atol=0.0001))
+        self.assertEqual(cccs[1].argmax(), 100)
+        self.assertTrue(np.all(cccs[2][0:150] == 0))
+
+    def test_slice_trace(self):
+        """Check slicing matches trimming a copy of the trace."""
+        from obspy import Trace, UTCDateTime
+        tr = Trace(data=np.arange(1000, dtype=np.float64),
+                   header={'sampling_rate': 40.0,
+                           'starttime': UTCDateTime(0)})
+        for start, end in [(1.01, 2.5), (-1, 3.33), (20, 30), (24, 40),
+                           (10.0125, 10.0126), (-5, -1)]:
+            window = lag_calc._slice_trace(tr, starttime=UTCDateTime(start),
+                                           endtime=UTCDateTime(end))
+            trimmed = tr.copy().trim(starttime=UTCDateTime(start),
+                                     endtime=UTCDateTime(end))
+            self.assertEqual(window.stats.npts, trimmed.stats.npts)
+            self.assertTrue(np.array_equal(window.data, trimmed.data))
+            if trimmed.stats.npts > 0:
+                self.assertEqual(window.stats.starttime,
+                                 trimmed.stats.starttime)
+                self.assertEqual(window.stats.endtime,
+                                 trimmed.stats.endtime)
+                self.assertTrue(np.shares_memory(window.data, tr.data))
+        self.assertEqual(tr.stats.npts, 1000)
+
+    def test_prepare_data(self):
+        """Check windows are cut for each channel using its delay."""
+        from obspy import Stream, Trace, UTCDateTime
+        from eqcorrscan.core.match_filter import DETECTION
+        detect_data = Stream([Trace(
+            data=np.random.randn(4000), header={
+                'station': sta, 'channel': 'SZ', 'sampling_rate': 40.0,
+                'starttime': UTCDateTime(0)}) for sta in ['A', 'B', 'C']])
+        template = Stream([Trace(
+            data=np.random.randn(40), header={
+                'station': sta, 'channel': 'SZ', 'sampling_rate': 40.0,
+                'starttime': UTCDateTime(0) + i}) for i, sta in
+            enumerate(['A', 'B'])])
+        delays = [('a', [('A', 'SZ', 0.0), ('B', 'SZ', 1.0)])]
+        detections = [DETECTION('a', UTCDateTime(10), 2, 1.0, 0.5, 'corr'),
+                      DETECTION('a', UTCDateTime(98.5), 2, 1.0, 0.5, 'corr')]
+        detect_streams = lag_calc._prepare_data(
+            detect_data=detect_data, detections=detections,
+            zipped_templates=[('a', template)], delays=delays,
+            shift_len=0.2, plot=False)
+        self.assertEqual(len(detect_streams), 2)
+        detect_stream = detect_streams[0][1]
+        self.assertEqual([tr.stats.station for tr in detect_stream],
+                         ['A', 'B'])
+        self.assertEqual(detect_stream[0].stats.starttime,
+                         UTCDateTime(9.8))
+        self.assertEqual(detect_stream[1].stats.starttime,
+                         UTCDateTime(10.8))
+        self.assertEqual(detect_stream[0].stats.npts, 57)
+        # Channel B runs off the end of the data for the second detection
+        self.assertEqual([tr.stats.station for tr in detect_streams[1][1]],
+                         ['A'])
+
     def test_interp_normal(self):
         synth_template = np.sin(np.arange(0, 2, 0.001))
         synth_detection = synth_template[100:]
@@ -96,6 +218,29 @@ class TestMethods(unittest.TestCase):
         with self.assertRaises(IndexError):
             lag_calc._xcorr_interp(ccc, 0.01)
 
+    def test_multi_interp(self):
+        """Check batched interpolation of many correlations at once."""
+        t = np.arange(21) * 0.01
+        peaks = [0.043, 0.1, 0.155]
+        cccs = [1 - 50 * (t - peak) ** 2 for peak in peaks]
+        # Too few samples around the peak to fit
+        cccs.append(np.where(np.arange(21) == 10, 1.0, 0.0))
+        cccs = np.array(cccs)
+        shifts, coeffs, num_samples = lag_calc._multi_xcorr_interp(
+            cccs, 0.01)
+        self.assertEqual(num_samples.tolist(), [21, 21, 21, 1])
+        for i, peak in enumerate(peaks):
+            self.assertAlmostEqual(shifts[i], peak)
+            self.assertAlmostEqual(coeffs[i], 1.0)
+            shift, coeff = lag_calc._xcorr_interp(cccs[i], 0.01)
+            self.assertAlmostEqual(shift, shifts[i])
+            self.assertAlmostEqual(coeff, coeffs[i])
+        # Fall back to the sampled maximum when not fitted
+        self.assertAlmostEqual(shifts[3], 0.1)
+        self.assertAlmostEqual(coeffs[3], 1.0)
+        with self.assertRaises(IndexError):
+            lag_calc._xcorr_interp(cccs[3], 0.01)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -11,6 +11,9 @@ import unittest
 import os
 import warnings
 import copy
+import pickle
+import shutil
+import tempfile
 
 from obspy import read, Stream, Trace, UTCDateTime
 from obspy.clients.fdsn import Client
@@ -19,8 +22,15 @@ from obspy.core.event import Pick
 from eqcorrscan.core import template_gen
 from eqcorrscan.utils import pre_processing, catalog_utils
 from eqcorrscan.core.match_filter import match_filter, normxcorr2
+from eqcorrscan.core.match_filter import multi_normxcorr, _channel_loop
+from eqcorrscan.core.match_filter import DETECTION, DetectionStore
+from eqcorrscan.core.match_filter import get_catalog
+from eqcorrscan.core.match_filter import _remove_duplicate_detections
+from eqcorrscan.core.match_filter import _cccsum_statistics
+from eqcorrscan.core.match_filter import TemplateBank, read_template_bank
 from eqcorrscan.core.match_filter import _template_loop, MatchFilterError
 from eqcorrscan.tutorials.get_geonet_events import get_geonet_events
+from eqcorrscan.utils.profiling import Profile
 
 
 class TestCoreMethods(unittest.TestCase):
@@ -114,6 +124,301 @@ class TestCoreMethods(unittest.TestCase):
         i, ccc = _template_loop(template=template, chan=chan, stream_ind=0)
         self.assertNotEqual(ccc.max(), 1.0)
 
+    def test_multi_normxcorr(self):
+        """Check that frequency-domain correlations match normxcorr2.
+        """
+        templates = np.random.randn(3, 100)
+        image = np.random.randn(5000)
+        image[1000:1100] += templates[1] * 5.0
+        ccc = multi_normxcorr(templates, image)
+        self.assertEqual(ccc.shape, (3, 4901))
+        for template, _ccc in zip(templates, ccc):
+            self.assertTrue(np.allclose(normxcorr2(template, image)[0],
+                                        _ccc, atol=0.0001))
+        self.assertEqual(ccc[1].argmax(), 1000)
+
+    def test_multi_normxcorr_pads(self):
+        """Check that delays shift the correlations."""
+        templates = np.random.randn(2, 100)
+        image = np.random.randn(5000)
+        ccc = multi_normxcorr(templates, image)
+        padded = multi_normxcorr(templates, image, pads=[0, 20])
+        self.assertTrue(np.all(ccc[0] == padded[0]))
+        self.assertTrue(np.all(ccc[1][20:] == padded[1][0:-20]))
+        self.assertTrue(np.all(padded[1][-20:] == 0))
+
+    def test_multi_normxcorr_nan(self):
+        """Ensure NaN templates and zeroed data give zero correlations."""
+        templates = np.random.randn(2, 100)
+        templates[0] = np.nan
+        image = np.random.randn(5000)
+        image[0:1000] = 0.0
+        ccc = multi_normxcorr(templates, image)
+        self.assertTrue(np.all(ccc[0] == 0))
+        self.assertTrue(np.all(ccc[1][0:900] == 0))
+        self.assertFalse(np.all(ccc[1][1000:] == 0))
+
+    def test_frequency_domain_channel_loop(self):
+        """Check that both correlation engines give the same cccsums."""
+        stream = Stream()
+        for station in ['A', 'B']:
+            stream += Trace(data=np.random.randn(5000).astype(np.float32),
+                            header={'station': station, 'channel': 'SZ',
+                                    'sampling_rate': 10.0})
+        templates = []
+        for start in [1000, 2500]:
+            template = stream.copy()
+            for j, tr in enumerate(template):
+                tr.data = tr.data[start + (j * 10): start + (j * 10) + 100]
+                tr.stats.starttime += (j * 10) / 10.0
+            templates.append(template)
+        time_domain = _channel_loop(templates=templates, stream=stream)
+        frequency_domain = _channel_loop(templates=templates, stream=stream,
+                                         xcorr_func='frequency_domain')
+        # The end of the cccsums will differ due to the padding of delays
+        self.assertTrue(np.allclose(time_domain[0][:, 0:-10],
+                                    frequency_domain[0][:, 0:-10],
+                                    atol=0.005))
+        self.assertTrue(np.all(time_domain[1] == frequency_domain[1]))
+        self.assertEqual(time_domain[2], frequency_domain[2])
+        self.assertEqual(frequency_domain[0][1].argmax(), 2500)
+
+    def test_parallel_channel_loop(self):
+        """Check that shared-memory parallel runs match serial runs."""
+        stream = Stream()
+        for station in ['A', 'B', 'C']:
+            stream += Trace(data=np.random.randn(5000),
+                            header={'station': station, 'channel': 'SZ',
+                                    'sampling_rate': 10.0})
+        templates = []
+        for start in [500, 1000, 2500]:
+            template = stream.copy()
+            for tr in template:
+                tr.data = tr.data[start: start + 100]
+            templates.append(template)
+        for xcorr_func in ['time_domain', 'frequency_domain']:
+            serial = _channel_loop(templates=templates, stream=stream,
+                                   cores=1, xcorr_func=xcorr_func)
+            parallel = _channel_loop(templates=templates, stream=stream,
+                                     cores=2, xcorr_func=xcorr_func)
+            self.assertTrue(np.allclose(serial[0], parallel[0]))
+            self.assertTrue(np.all(serial[1] == parallel[1]))
+            self.assertEqual(serial[2], parallel[2])
+
+    def test_memmap_channel_loop(self):
+        """Check that cccsums held on disk match those held in memory."""
+        stream = Stream()
+        for station in ['A', 'B']:
+            stream += Trace(data=np.random.randn(5000),
+                            header={'station': station, 'channel': 'SZ',
+                                    'sampling_rate': 10.0})
+        templates = [stream.copy().trim(stream[0].stats.starttime + start,
+                                        stream[0].stats.starttime + start +
+                                        9.9)
+                     for start in [50, 100, 250]]
+        in_memory = _channel_loop(templates=templates, stream=stream)
+        memmap_dir = tempfile.mkdtemp()
+        try:
+            on_disk = _channel_loop(templates=templates, stream=stream,
+                                    memmap_dir=memmap_dir)
+            self.assertTrue(isinstance(on_disk[0], np.memmap))
+            self.assertEqual(in_memory[0].shape, (3, 4901))
+            self.assertTrue(np.all(in_memory[0] == on_disk[0]))
+            self.assertTrue(np.all(in_memory[1] == 2))
+            del on_disk
+        finally:
+            shutil.rmtree(memmap_dir)
+
+    def test_memmap_cleanup(self):
+        """Check that cccsums on disk are removed when detection fails."""
+        stream = Stream()
+        for station in ['A', 'B']:
+            stream += Trace(data=np.random.randn(5000),
+                            header={'station': station, 'channel': 'SZ',
+                                    'sampling_rate': 10.0})
+        templates = [stream.copy().trim(stream[0].stats.starttime + start,
+                                        stream[0].stats.starttime + start +
+                                        9.9)
+                     for start in [50, 100]]
+
+        def _fail(stage):
+            if stage.name == 'peak_finding':
+                raise MatchFilterError('Failed')
+
+        memmap_dir = tempfile.mkdtemp()
+        try:
+            with self.assertRaises(MatchFilterError):
+                match_filter(template_names=['a', 'b'],
+                             template_list=templates, st=stream,
+                             threshold=8.0, threshold_type='MAD',
+                             trig_int=2.0, plotvar=False,
+                             memmap_dir=memmap_dir,
+                             profile=Profile(callback=_fail))
+            self.assertEqual(os.listdir(memmap_dir), [])
+            # Correlations of data of differing length cannot be summed
+            short = stream.copy()
+            short[1].data = short[1].data[0:4000]
+            with self.assertRaises(ValueError):
+                _channel_loop(templates=templates, stream=short,
+                              memmap_dir=memmap_dir)
+            self.assertEqual(os.listdir(memmap_dir), [])
+        finally:
+            shutil.rmtree(memmap_dir)
+
+    def test_cccsum_statistics(self):
+        """Check batched statistics against per-template numpy."""
+        cccsums = np.random.randn(5, 1001).astype(np.float32)
+        cccsums *= np.arange(1, 6)[:, np.newaxis]
+        cccsums[2] = 0
+        med_abs, maxes, means = _cccsum_statistics(cccsums, block_size=2)
+        for i, cccsum in enumerate(cccsums):
+            self.assertAlmostEqual(med_abs[i], np.median(np.abs(cccsum)),
+                                   places=5)
+            self.assertEqual(maxes[i], cccsum.max())
+            self.assertAlmostEqual(means[i], cccsum.mean(), places=5)
+        approx = _cccsum_statistics(cccsums, bins=100)[0]
+        bound = np.abs(cccsums).max(axis=1) / 200
+        self.assertTrue(np.all(np.abs(approx - med_abs) <= bound * 1.0001))
+        self.assertEqual(approx[2], 0)
+        self.assertTrue(np.all(np.isnan(
+            _cccsum_statistics(cccsums, median=False)[0])))
+
+
+class TestTemplateBank(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        np.random.seed(12)
+        cls.stream = Stream()
+        for station in ['A', 'B', 'C']:
+            cls.stream += Trace(data=np.random.randn(5000),
+                                header={'station': station, 'channel': 'SZ',
+                                        'sampling_rate': 10.0})
+        cls.templates = []
+        for start in [500, 1000, 2500]:
+            template = cls.stream.copy()
+            for j, tr in enumerate(template):
+                tr.data = tr.data[start + (j * 5): start + (j * 5) + 100]
+                tr.stats.starttime += (start + (j * 5)) / 10.0
+            cls.templates.append(template)
+        # Remove a channel and add a duplicate channel
+        cls.templates[1].remove(cls.templates[1][0])
+        duplicate = cls.templates[2][1].copy()
+        duplicate.stats.starttime += 1
+        duplicate.data = cls.stream[1].data[2515:2615]
+        cls.templates[2] += duplicate
+        cls.names = ['a', 'b', 'c']
+
+    def test_construct(self):
+        """Check the aligned layout of the bank."""
+        bank = TemplateBank().construct(templates=self.templates,
+                                        names=self.names)
+        self.assertEqual(len(bank), 3)
+        self.assertEqual(bank.stachans, [('', 'A', '', 'SZ'),
+                                         ('', 'B', '', 'SZ'),
+                                         ('', 'B', '', 'SZ'),
+                                         ('', 'C', '', 'SZ')])
+        self.assertEqual(bank.data.shape, (3, 4, 100))
+        self.assertEqual(bank.used.tolist(),
+                         [[True, True, False, True],
+                          [False, True, False, True],
+                          [True, True, True, True]])
+        self.assertEqual(bank.pads[2].tolist(), [0, 5, 15, 10])
+        self.assertTrue(np.allclose(bank.data[2, 2],
+                                    self.templates[2][-1].data))
+        self.assertAlmostEqual(bank.length, 11.5)
+        self.assertTrue(np.allclose(bank.means[0, 0],
+                                    self.templates[0][0].data.mean()))
+        with self.assertRaises(MatchFilterError):
+            TemplateBank().construct(templates=self.templates,
+                                     names=['a'])
+
+    def test_read_write(self):
+        """Check that banks survive a round trip to disk."""
+        bank = TemplateBank().construct(templates=self.templates,
+                                        names=self.names)
+        tempdir = tempfile.mkdtemp()
+        try:
+            bank_file = os.path.join(tempdir, 'bank.h5')
+            bank.write(bank_file)
+            self.assertEqual(bank, read_template_bank(bank_file))
+        finally:
+            shutil.rmtree(tempdir)
+        self.assertNotEqual(bank, bank[0:2])
+
+    def test_channel_loop(self):
+        """Check that banks give the same cccsums as lists of templates."""
+        bank = TemplateBank().construct(templates=self.templates,
+                                        names=self.names)
+        from_list = _channel_loop(templates=self.templates,
+                                  stream=self.stream,
+                                  xcorr_func='frequency_domain')
+        from_bank = _channel_loop(templates=bank, stream=self.stream,
+                                  xcorr_func='frequency_domain')
+        self.assertTrue(np.all(from_list[0] == from_bank[0]))
+        self.assertEqual(from_bank[1].tolist(), [3, 2, 4])
+        bank.cache_ffts = True
+        cached = _channel_loop(templates=bank, stream=self.stream,
+                               xcorr_func='frequency_domain')
+        self.assertTrue(np.allclose(cached[0], from_bank[0], atol=1e-5))
+        self.assertEqual(len(bank._ffts), 4)
+
+    def test_disjoint_channel_loop(self):
+        """Check templates are only correlated with their own channels."""
+        templates = [self.templates[0].select(station='A'),
+                     self.templates[1].select(station='C')]
+        for cores in [1, 2]:
+            cccsums, no_chans, chans = _channel_loop(
+                templates=templates, stream=self.stream, cores=cores)
+            self.assertEqual(no_chans.tolist(), [1, 1])
+            self.assertEqual(chans, [[('A', 'SZ')], [('C', 'SZ')]])
+            for template, cccsum in zip(templates, cccsums):
+                single = _channel_loop(templates=[template],
+                                       stream=self.stream)[0][0]
+                self.assertTrue(np.all(single == cccsum))
+
+    def test_match_filter(self):
+        """Check that match_filter gives the same detections for banks."""
+        bank = TemplateBank().construct(templates=self.templates,
+                                        names=self.names)
+        kwargs = dict(st=self.stream, threshold=0.8,
+                      threshold_type='av_chan_corr', trig_int=2.0,
+                      plotvar=False)
+        detections = match_filter(template_names=self.names,
+                                  template_list=self.templates, **kwargs)
+        bank_detections = match_filter(template_names=None,
+                                       template_list=bank, **kwargs)
+        self.assertEqual(len(detections), 3)
+        for detection, bank_detection in zip(detections, bank_detections):
+            self.assertEqual(detection.template_name,
+                             bank_detection.template_name)
+            self.assertEqual(detection.detect_time,
+                             bank_detection.detect_time)
+            self.assertEqual(len(bank_detection.event.picks),
+                             bank.used[self.names.index(
+                                 detection.template_name)].sum())
+
+    def test_missing_first_channel(self):
+        """Check detections are timed from the first channel in the data."""
+        bank = TemplateBank().construct(templates=self.templates,
+                                        names=self.names)
+        stream = Stream([tr for tr in self.stream
+                         if tr.stats.station != 'A'])
+        for template_list in [bank, self.templates]:
+            detections = match_filter(
+                template_names=self.names, template_list=template_list,
+                st=stream, threshold=0.8, threshold_type='av_chan_corr',
+                trig_int=2.0, plotvar=False)
+            detection = [d for d in detections if d.template_name == 'a'][0]
+            self.assertEqual(detection.detect_time,
+                             stream[0].stats.starttime + 50.5)
+            self.assertEqual(
+                sorted([(p.waveform_id.station_code, p.time)
+                        for p in detection.event.picks]),
+                [(tr.stats.station, tr.stats.starttime)
+                 for tr in self.templates[0][1:]])
+            # The bank is not changed by the detection run
+            self.assertEqual(bank.pads[0].tolist(), [0, 5, 0, 10])
+
 
 class TestSynthData(unittest.TestCase):
     def test_debug_range(self):
@@ -155,6 +460,235 @@ class TestSynthData(unittest.TestCase):
         # Test case where there are non-matching streams in the data
         test_match_filter(template_excess=True)
 
+    def test_chunked_detection(self):
+        """Check that chunked detection matches detection on all the data.
+        """
+        np.random.seed(42)
+        template = Stream()
+        for j, station in enumerate(['A', 'B', 'C']):
+            template += Trace(data=np.random.randn(50),
+                              header={'station': station, 'channel': 'SZ',
+                                      'sampling_rate': 10.0,
+                                      'starttime': UTCDateTime(0) + j})
+        st = Stream()
+        # Seeds either side of, and across, the chunk boundary at 500s
+        seeds = [1000, 4995, 12000]
+        for j, tr in enumerate(template):
+            data = np.random.randn(20000) * 0.3
+            for seed in seeds:
+                data[seed + (j * 10): seed + (j * 10) + 50] += tr.data
+            st += Trace(data=data, header={'station': tr.stats.station,
+                                           'channel': 'SZ',
+                                           'sampling_rate': 10.0,
+                                           'starttime': UTCDateTime(0)})
+        kwargs = dict(template_names=['a'], template_list=[template], st=st,
+                      threshold=2.0, threshold_type='absolute', trig_int=2.0,
+                      plotvar=False)
+        detections = match_filter(**kwargs)
+        chunked, det_cat = match_filter(chunk_length=500, output_cat=True,
+                                        **kwargs)
+        self.assertEqual(len(detections), 3)
+        self.assertEqual(len(chunked), len(detections))
+        self.assertEqual(len(det_cat), len(chunked))
+        for detection, chunked_detection in zip(detections, chunked):
+            self.assertEqual(detection.detect_time,
+                             chunked_detection.detect_time)
+            self.assertAlmostEqual(detection.detect_val,
+                                   chunked_detection.detect_val, places=2)
+        with self.assertRaises(MatchFilterError):
+            match_filter(chunk_length=5, **kwargs)
+
+    def test_float16_precision(self):
+        """Check that float16 sums give the same detections as float32."""
+        np.random.seed(3)
+        template = Stream()
+        for j in range(8):
+            template += Trace(data=np.random.randn(80),
+                              header={'station': 'S%02d' % j,
+                                      'channel': 'SZ', 'sampling_rate': 20.0,
+                                      'starttime': UTCDateTime(0) + j * 0.2})
+        st = Stream()
+        for j, tr in enumerate(template):
+            data = np.random.randn(20000)
+            for seed, amp in [(3000, 0.6), (12000, 0.45)]:
+                data[seed + j * 4: seed + j * 4 + 80] += tr.data * amp
+            st += Trace(data=data, header={'station': tr.stats.station,
+                                           'channel': 'SZ',
+                                           'sampling_rate': 20.0,
+                                           'starttime': UTCDateTime(0)})
+        kwargs = dict(template_names=['a'], template_list=[template], st=st,
+                      threshold_type='absolute', trig_int=2.0,
+                      plotvar=False)
+        detections = match_filter(threshold=2.0, **kwargs)
+        self.assertEqual(len(detections), 2)
+        # Set the threshold just below the smallest detection value
+        threshold = min([d.detect_val for d in detections]) - 0.0001
+        for xcorr_func in ['time_domain', 'frequency_domain']:
+            exact = match_filter(threshold=threshold, xcorr_func=xcorr_func,
+                                 **kwargs)
+            half = match_filter(threshold=threshold, xcorr_func=xcorr_func,
+                                precision='float16', **kwargs)
+            self.assertEqual(len(exact), 2)
+            self.assertEqual(len(half), len(exact))
+            for detection, half_detection in zip(exact, half):
+                self.assertEqual(detection.detect_time,
+                                 half_detection.detect_time)
+                self.assertAlmostEqual(detection.detect_val,
+                                       half_detection.detect_val, places=5)
+        cccsums = _channel_loop(templates=[template], stream=st,
+                                precision='float16')[0]
+        self.assertEqual(cccsums.dtype, np.float16)
+
+    def test_profile(self):
+        """Check that all stages of detection are profiled."""
+        np.random.seed(42)
+        template = Stream()
+        for j, station in enumerate(['A', 'B']):
+            template += Trace(data=np.random.randn(50),
+                              header={'station': station, 'channel': 'SZ',
+                                      'sampling_rate': 10.0,
+                                      'starttime': UTCDateTime(0) + j})
+        st = Stream()
+        for tr in template:
+            data = np.random.randn(8640) * 0.3
+            data[1000:1050] += tr.data
+            st += Trace(data=data, header={'station': tr.stats.station,
+                                           'channel': 'SZ',
+                                           'sampling_rate': 10.0,
+                                           'starttime': UTCDateTime(0)})
+        completed = []
+        profile = Profile(callback=completed.append)
+        match_filter(template_names=['a', 'b'],
+                     template_list=[template, template.copy()], st=st,
+                     threshold=2.0, threshold_type='absolute', trig_int=2.0,
+                     plotvar=False, profile=profile)
+        totals = profile.totals()
+        self.assertEqual(list(totals.keys()),
+                         ['padding', 'stachan_reconciliation', 'correlation',
+                          'summation', 'thresholding', 'peak_finding',
+                          'event_construction'])
+        self.assertEqual(len(completed), len(profile))
+        for total in totals.values():
+            self.assertEqual(total['calls'], 1)
+            self.assertTrue(total['wall'] >= 0)
+        self.assertTrue(totals['correlation']['nbytes'] > 0)
+        self.assertEqual(totals['thresholding']['nbytes'],
+                         2 * (8640 - 50 + 1) * 4)
+        self.assertEqual(profile.counts['templates'], 2)
+        self.assertAlmostEqual(profile.counts['template_days'],
+                               2 * 8639 / 864000.0)
+
+    def test_lazy_events(self):
+        """Check that events are only built when asked for."""
+        np.random.seed(42)
+        template = Stream()
+        for j, station in enumerate(['A', 'B']):
+            template += Trace(data=np.random.randn(50),
+                              header={'station': station, 'channel': 'SZ',
+                                      'sampling_rate': 10.0,
+                                      'starttime': UTCDateTime(0) + j})
+        st = Stream()
+        for j, tr in enumerate(template):
+            data = np.random.randn(5000) * 0.3
+            data[1000 + j * 10:1050 + j * 10] += tr.data
+            st += Trace(data=data, header={'station': tr.stats.station,
+                                           'channel': 'SZ',
+                                           'sampling_rate': 10.0,
+                                           'starttime': UTCDateTime(0)})
+        kwargs = dict(template_names=['a'], template_list=[template], st=st,
+                      threshold=1.5, threshold_type='absolute', trig_int=2.0,
+                      plotvar=False)
+        detections = match_filter(**kwargs)
+        self.assertEqual(len(detections), 1)
+        detection = detections[0]
+        self.assertIsNone(detection._event)
+        self.assertEqual(detection.template_index, 0)
+        self.assertEqual(detection.sample_index, 1000)
+        self.assertEqual(detection.chan_mask.tolist(), [True, True])
+        event = detection.event
+        self.assertIs(detection.event, event)
+        self.assertEqual(str(event.resource_id), detection.id)
+        self.assertEqual(sorted([(p.waveform_id.station_code, p.time)
+                                 for p in event.picks]),
+                         [('A', UTCDateTime(100)), ('B', UTCDateTime(101))])
+        detections, det_cat = match_filter(output_cat=True, **kwargs)
+        self.assertEqual(len(det_cat), 1)
+        self.assertIs(det_cat[0], detections[0].event)
+        self.assertEqual(len(det_cat[0].comments), 3)
+        # Unbuilt events survive pickling
+        detection = pickle.loads(pickle.dumps(match_filter(**kwargs)[0]))
+        self.assertEqual(len(detection.event.picks), 2)
+
+    def test_old_pickled_detection(self):
+        """Check detections pickled by older versions keep their event."""
+        from obspy.core.event import Event
+        t = UTCDateTime(2017, 1, 1)
+        detection = DETECTION('a', t, 2, 5.0, 2.0, 'corr',
+                              [('A', 'SZ'), ('B', 'SZ')])
+        # The attributes of detections from versions without lazy events
+        state = dict([(key, value)
+                      for key, value in detection.__dict__.items()
+                      if key not in ['_event', '_context', 'template_index',
+                                     'sample_index', 'chan_mask']])
+        state['event'] = Event()
+        old = DETECTION.__new__(DETECTION)
+        old.__setstate__(state)
+        self.assertIs(old.event, state['event'])
+        self.assertIs(get_catalog([old])[0], state['event'])
+        self.assertIsNone(old.chan_mask)
+
+    def test_remove_duplicate_detections(self):
+        """Check that only the best detection within trig_int is kept."""
+        t = UTCDateTime(2017, 1, 1)
+        detections = [DETECTION('a', t, 3, 5.0, 2.0, 'corr'),
+                      DETECTION('a', t, 3, 5.0, 2.0, 'corr'),
+                      DETECTION('a', t + 1, 3, -6.0, 2.0, 'corr'),
+                      DETECTION('a', t + 2.5, 3, 4.0, 2.0, 'corr'),
+                      DETECTION('b', t + 1, 3, 3.0, 2.0, 'corr')]
+        unique = _remove_duplicate_detections(detections, trig_int=2.0)
+        self.assertEqual([(d.template_name, d.detect_time) for d in unique],
+                         [('a', t + 1), ('b', t + 1)])
+
+    def test_detection_store(self):
+        """Check detections survive a store and can be selected."""
+        t = UTCDateTime(2017, 1, 1)
+        chans = [('A', 'SZ'), ('B', 'SZ')]
+        detections = [DETECTION('a', t + i, 2, 5.0 + i, 2.0, 'corr', chans)
+                      for i in range(5)]
+        detections.append(DETECTION('b', t + 10.25, 1, -8.0, 2.0, 'corr',
+                                    [('C', 'SN')]))
+        tempdir = tempfile.mkdtemp()
+        try:
+            store = DetectionStore(os.path.join(tempdir, 'detections.h5'),
+                                   block_size=4)
+            self.assertEqual(len(store), 0)
+            self.assertEqual(store.read(), [])
+            store.append(detections[0:3])
+            store.append(detections[3:])
+            self.assertEqual(len(store), 6)
+            self.assertEqual(store.template_names, ['a', 'b'])
+            read = store.read()
+            self.assertEqual(len(read), len(detections))
+            for detection, read_detection in zip(detections, read):
+                for key in ['template_name', 'detect_time', 'no_chans',
+                            'chans', 'detect_val', 'threshold',
+                            'typeofdet', 'id']:
+                    self.assertEqual(detection.__getattribute__(key),
+                                     read_detection.__getattribute__(key))
+            # Channel lists are interned
+            self.assertIs(read[0].chans, read[1].chans)
+            selected = store.read(template_names=['a'], starttime=t + 1,
+                                  endtime=t + 3)
+            self.assertEqual([d.detect_time for d in selected],
+                             [t + 1, t + 2, t + 3])
+            selected = store.read(min_value=7.5)
+            self.assertEqual([d.template_name for d in selected],
+                             ['a', 'a', 'b'])
+            array = store.read_array(template_names=['b'])
+            self.assertEqual(array['detect_val'].tolist(), [-8.0])
+        finally:
+            shutil.rmtree(tempdir)
+
 
 class TestGeoNetCase(unittest.TestCase):
     @classmethod
@@ -0,0 +1,54 @@
+"""
+Functions for testing the utils.profiling functions
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import unittest
+
+from eqcorrscan.utils.profiling import Profile, cpu_time
+
+
+class TestProfile(unittest.TestCase):
+    def test_stages(self):
+        """Check that stages are recorded in order and summed by name."""
+        completed = []
+        profile = Profile(callback=completed.append)
+        for i in range(2):
+            with profile.stage('first', nbytes=10) as stage:
+                stage.nbytes += 5
+        profile.add('second', wall=1.5, cpu=0.5, nbytes=3)
+        self.assertEqual([stage.name for stage in profile.stages],
+                         ['first', 'first', 'second'])
+        self.assertEqual(completed, profile.stages)
+        totals = profile.totals()
+        self.assertEqual(list(totals.keys()), ['first', 'second'])
+        self.assertEqual(totals['first']['calls'], 2)
+        self.assertEqual(totals['first']['nbytes'], 30)
+        self.assertEqual(totals['second']['wall'], 1.5)
+        self.assertEqual(totals['second']['cpu'], 0.5)
+        for stage in profile.stages:
+            self.assertTrue(stage.wall >= 0)
+
+    def test_counts(self):
+        """Check that counters accumulate and the profile is JSON-able."""
+        profile = Profile()
+        profile.count('templates', 2)
+        profile.count('templates', 3)
+        self.assertEqual(profile.counts['templates'], 5)
+        with profile.stage('stage'):
+            pass
+        profile_dict = json.loads(json.dumps(profile.to_dict()))
+        self.assertEqual(profile_dict['counts'], {'templates': 5})
+        self.assertEqual(len(profile_dict['stages']), 1)
+
+    def test_cpu_time(self):
+        """Check that child process time only adds to CPU time."""
+        self.assertTrue(cpu_time(children=True) >= cpu_time())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -75,6 +75,44 @@ class SimpleSubspaceMethods(unittest.TestCase):
                                                 tr_data.astype(np.float32))
         self.assertEqual((stat.max().round(6) - 0.252336).round(6), 0)
 
+    def test_stat_direct(self):
+        """Check the statistic against direct projection of each window."""
+        np.random.seed(0)
+        detector = np.linalg.qr(np.random.randn(50, 3))[0].astype(np.float32)
+        data = np.random.randn(300).astype(np.float32)
+        stat = subspace_statistic.det_statistic(detector, data,
+                                                block_size=64)
+        self.assertEqual(len(stat), 298)
+        padded = np.concatenate([data, np.zeros(50)])
+        direct = np.array([np.sum(np.dot(detector.T, padded[i:i + 50]) ** 2)
+                           for i in range(298)])
+        self.assertTrue(np.allclose(stat, direct, rtol=1e-4, atol=1e-5))
+        normalised = subspace_statistic.det_statistic(detector, data,
+                                                      normalise=True)
+        energy = np.array([np.sum(padded[i:i + 50] ** 2)
+                           for i in range(298)])
+        self.assertTrue(np.allclose(normalised, direct / energy, rtol=1e-4,
+                                    atol=1e-5))
+        self.assertTrue(np.all(normalised <= 1.0 + 1e-5))
+
+    def test_multi_stat(self):
+        """Check that grouped statistics match single detectors."""
+        np.random.seed(1)
+        detectors = [
+            np.linalg.qr(np.random.randn(length, dim))[0].astype(np.float32)
+            for length, dim in [(50, 3), (30, 5), (80, 1)]]
+        data = np.random.randn(400).astype(np.float32)
+        for normalise in [False, True]:
+            stats = subspace_statistic.multi_det_statistic(
+                detectors, data, normalise=normalise, block_size=100)
+            self.assertEqual(len(stats), 3)
+            for detector, stat in zip(detectors, stats):
+                single = subspace_statistic.det_statistic(
+                    detector, data, normalise=normalise)
+                self.assertEqual(len(stat), len(single))
+                self.assertTrue(np.allclose(stat, single, rtol=1e-4,
+                                            atol=1e-5))
+
 
 class SubspaceTestingMethods(unittest.TestCase):
     """
@@ -39,6 +39,7 @@ from __future__ import unicode_literals
 import os
 import glob
 import warnings
+import numpy as np
 import matplotlib.pyplot as plt
 
 from obspy.core.event import Catalog
@@ -46,6 +47,7 @@ from obspy import read
 
 from eqcorrscan.utils import sfile_util
 from eqcorrscan.utils.mag_calc import dist_calc
+from eqcorrscan.utils.catalog_utils import SpatialIndex
 
 
 def _cc_round(num, dp):
@@ -275,10 +277,15 @@ def write_catalog(event_list, max_sep=8, min_link=8, debug=0):
     fphase = open('phase.dat', 'w')
     stations = []
     evcount = 0
+    # Read each event once and find the pairs within max_sep
+    events = [sfile_util.readpicks(event[1]) for event in event_list]
+    index = SpatialIndex(
+        locations=[(event.origins[0].latitude, event.origins[0].longitude,
+                    event.origins[0].depth / 1000) for event in events])
+    rows, columns, distances = index.query_pairs(max_distance=max_sep)
     for i, master in enumerate(event_list):
-        master_sfile = master[1]
         master_event_id = master[0]
-        master_event = sfile_util.readpicks(master_sfile)
+        master_event = events[i]
         master_ori_time = master_event.origins[0].time
         master_location = (master_event.origins[0].latitude,
                            master_event.origins[0].longitude,
@@ -316,22 +323,18 @@ def write_catalog(event_list, max_sep=8, min_link=8, debug=0):
                                        master_ori_time, 3).rjust(6) +
                              '   ' + str(weight).ljust(5) +
                              pick.phase_hint + '\n')
-        for j in range(i + 1, len(event_list)):
+        # Pairs are sorted, so these are the later events within max_sep
+        for j in columns[np.searchsorted(rows, i, side='left'):
+                         np.searchsorted(rows, i, side='right')]:
             # Use this tactic to only output unique event pairings
-            slave_sfile = event_list[j][1]
             slave_event_id = event_list[j][0]
             # Write out the header line
             event_text = '#' + str(master_event_id).rjust(10) +\
                 str(slave_event_id).rjust(10) + '\n'
             event_text2 = '#' + str(master_event_id).rjust(10) +\
                 str(slave_event_id).rjust(10) + '\n'
-            slave_event = sfile_util.readpicks(slave_sfile)
+            slave_event = events[j]
             slave_ori_time = slave_event.origins[0].time
-            slave_location = (slave_event.origins[0].latitude,
-                              slave_event.origins[0].longitude,
-                              slave_event.origins[0].depth / 1000)
-            if dist_calc(master_location, slave_location) > max_sep:
-                continue
             links = 0  # Count the number of linkages
             for pick in master_event.picks:
                 if not hasattr(pick, 'phase_hint') or\
@@ -20,10 +20,14 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import warnings
+import numpy as np
 
 from collections import Counter
+from scipy.spatial import cKDTree
 from obspy.core.event import Catalog
 
+from eqcorrscan.utils.mag_calc import dist_calc
+
 
 def filter_picks(catalog, stations=None, channels=None, networks=None,
                  locations=None, top_n_picks=None, evaluation_mode='all'):
@@ -163,6 +167,150 @@ def filter_picks(catalog, stations=None, channels=None, networks=None,
     return tmp_catalog
 
 
+class SpatialIndex(object):
+    """
+    Index of event locations for finding pairs of nearby events.
+
+    Pairs are found with a k-d tree, then checked with the distances given
+    by :func:`eqcorrscan.utils.mag_calc.dist_calc`, so results are the same
+    as comparing every pair with dist_calc.  Longitude is scaled in the tree
+    by the smallest cosine of latitude in the index, so that tree distances
+    are never larger than dist_calc distances.
+
+    :type locations: numpy.ndarray
+    :param locations:
+        Array of latitude, longitude (decimal degrees) and depth (km), one
+        row per event.
+    :type times: numpy.ndarray
+    :param times:
+        Times of events in seconds (e.g. POSIX timestamps), defaults to
+        None, only needed for queries in time.
+
+    .. rubric:: Example
+
+    >>> locations = np.array([[-43.0, 170.0, 5.0], [-43.01, 170.0, 5.0],
+    ...                       [-44.0, 170.0, 5.0]])
+    >>> index = SpatialIndex(locations)
+    >>> rows, columns, distances = index.query_pairs(max_distance=5)
+    >>> print([(int(row), int(column)) for row, column in zip(rows, columns)])
+    [(0, 1)]
+    """
+    R = 6371.009  # Radius of the Earth in km, as used by dist_calc
+
+    def __init__(self, locations, times=None):
+        """Build the index."""
+        self.locations = np.asarray(locations,
+                                    dtype=np.float64).reshape(-1, 3)
+        if times is not None:
+            times = np.asarray(times, dtype=np.float64)
+        self.times = times
+        # cos(mean latitude) of a pair is at least the smallest cosine
+        self._lon_scale = 1.0
+        if len(self.locations):
+            self._lon_scale = max(np.cos(np.radians(
+                np.max(np.abs(self.locations[:, 0])))), 0.0)
+        self._coordinates = np.column_stack([
+            self.R * np.radians(self.locations[:, 0]),
+            self.R * self._lon_scale * np.radians(self.locations[:, 1]),
+            self.locations[:, 2]])
+        self._trees = {}
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """
+        Build the index from the origins of a catalog.
+
+        Uses the preferred origin of each event, or the first origin if none
+        is preferred.
+
+        :type catalog: obspy.core.event.Catalog
+        :param catalog: Catalog of events.
+
+        :returns: Index of the events in the catalog.
+        :rtype: :class:`eqcorrscan.utils.catalog_utils.SpatialIndex`
+        """
+        origins = [event.preferred_origin() or event.origins[0]
+                   for event in catalog]
+        locations = np.array([(origin.latitude, origin.longitude,
+                               origin.depth / 1000.0) for origin in origins])
+        times = np.array([origin.time.timestamp for origin in origins])
+        return cls(locations=locations, times=times)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def _tree(self, time_scale):
+        """Get the tree, with time scaled by time_scale km per second."""
+        if time_scale not in self._trees:
+            if time_scale is None:
+                self._trees[time_scale] = cKDTree(self._coordinates)
+            else:
+                times = (self.times - self.times.min()) * time_scale
+                self._trees[time_scale] = cKDTree(np.column_stack(
+                    [self._coordinates, times]))
+        return self._trees[time_scale]
+
+    def distances(self, rows, columns):
+        """
+        Compute distances between pairs of events.
+
+        :type rows: numpy.ndarray
+        :param rows: Index of the first event of each pair.
+        :type columns: numpy.ndarray
+        :param columns: Index of the second event of each pair.
+
+        :returns: Distances in km from dist_calc.
+        :rtype: numpy.ndarray
+        """
+        first = self.locations[rows]
+        second = self.locations[columns]
+        return dist_calc((first[:, 0], first[:, 1], first[:, 2]),
+                         (second[:, 0], second[:, 1], second[:, 2]))
+
+    def query_pairs(self, max_distance, max_time=None):
+        """
+        Find all pairs of events within a distance, and optionally a time.
+
+        :type max_distance: float
+        :param max_distance: Maximum separation in km.
+        :type max_time: float
+        :param max_time:
+            Maximum separation in seconds, defaults to None which does not
+            limit the time between events.
+
+        :returns:
+            Arrays of the first and second event of each pair (first <
+            second, sorted) and their distances in km.
+        :rtype: tuple
+        """
+        if len(self) < 2:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0)
+        # Allow for rounding in the tree so that no pairs are missed
+        radius = max_distance * (1 + 1e-9) + 1e-9
+        if max_time is not None and self.times is None:
+            raise ValueError('No times to query')
+        if max_time and max_distance > 0:
+            # Times are scaled to distances, so events within both limits
+            # are within sqrt(2) * max_distance in the tree
+            pairs = self._tree(max_distance / max_time).query_pairs(
+                np.sqrt(2) * radius, output_type='ndarray')
+        else:
+            pairs = self._tree(None).query_pairs(radius,
+                                                 output_type='ndarray')
+        pairs = pairs.reshape(-1, 2).astype(np.int64)
+        pairs.sort(axis=1)
+        rows, columns = pairs[:, 0], pairs[:, 1]
+        distances = self.distances(rows, columns)
+        keep = distances <= max_distance
+        if max_time is not None:
+            keep &= (np.abs(self.times[rows] - self.times[columns]) <=
+                     max_time)
+        order = np.lexsort((columns[keep], rows[keep]))
+        return (rows[keep][order], columns[keep][order],
+                distances[keep][order])
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -19,12 +19,15 @@ import matplotlib.pyplot as plt
 
 from multiprocessing import Pool, cpu_count
 from scipy.spatial.distance import squareform
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from scipy.cluster.hierarchy import linkage, dendrogram, fcluster
 from obspy.signal.cross_correlation import xcorr
 from obspy import Stream, Catalog
 
 from eqcorrscan.core.match_filter import normxcorr2
 from eqcorrscan.utils.mag_calc import dist_calc
+from eqcorrscan.utils.catalog_utils import SpatialIndex
 from eqcorrscan.utils import stacking
 
 
@@ -80,6 +83,203 @@ def cross_chan_coherence(st1, st2, allow_shift=False, shift_len=0.2, i=0):
         return 0, i
 
 
+def _normalise_rows(waveforms, length):
+    """
+    Demean and normalise waveforms, cut to a common length.
+
+    :type waveforms: list
+    :param waveforms: List of numpy.ndarray waveforms, at least length long.
+    :type length: int
+    :param length: Number of samples to use from the start of each waveform.
+
+    :returns:
+        Array of waveforms with zero mean and unit norm, one per row, such
+        that the dot product of two rows is their normalised correlation.
+        Rows with no variance are left as zeros.
+    :rtype: numpy.ndarray
+    """
+    rows = np.array([waveform[0:length] for waveform in waveforms],
+                    dtype=np.float64)
+    rows -= rows.mean(axis=1).reshape(-1, 1)
+    norms = np.sqrt(np.sum(rows ** 2, axis=1))
+    rows[norms > 0] /= norms[norms > 0].reshape(-1, 1)
+    rows[norms == 0] = 0
+    return rows
+
+
+def _channel_waveforms(stream_list):
+    """
+    Collect the waveforms of each channel, grouped by length.
+
+    :type stream_list: list
+    :param stream_list: List of :class:`obspy.core.stream.Stream`
+
+    :returns:
+        Dictionary keyed by (station, channel) of lists of tuples of
+        (length, stream indices, waveforms), sorted by length.
+    :rtype: dict
+    """
+    # Assume you only have one waveform for each channel
+    channels = {}
+    for i, st in enumerate(stream_list):
+        for tr in st:
+            waveforms = channels.setdefault(
+                (tr.stats.station, tr.stats.channel), {})
+            if i not in waveforms:
+                waveforms[i] = tr.data
+    for stachan, waveforms in channels.items():
+        lengths = {}
+        for i in sorted(waveforms.keys()):
+            lengths.setdefault(len(waveforms[i]), []).append(i)
+        channels[stachan] = [
+            (length, np.array(indices),
+             [waveforms[i] for i in indices])
+            for length, indices in sorted(lengths.items())]
+    return channels
+
+
+def _zero_lag_coherence(stream_list, rows=None, columns=None,
+                        channels=None):
+    """
+    Compute the zero-lag cross-channel coherence of pairs of streams.
+
+    Equivalent to :func:`cross_chan_coherence` with `allow_shift=False` for
+    every pair, but computed as one matrix product of the normalised
+    waveforms of each channel (for each pair of waveform lengths, where
+    waveforms of different lengths are correlated over the length of the
+    shorter one, as for :func:`eqcorrscan.core.match_filter.normxcorr2`).
+
+    :type stream_list: list
+    :param stream_list: List of :class:`obspy.core.stream.Stream`
+    :type rows: numpy.ndarray
+    :param rows: Indices of streams to compute rows for, defaults to all.
+    :type columns: numpy.ndarray
+    :param columns:
+        Indices of streams to compute columns for, defaults to all.
+    :type channels: dict
+    :param channels:
+        Waveforms from :func:`_channel_waveforms`, computed if not given.
+
+    :returns:
+        Matrix of cross-channel coherences, zero for pairs with no
+        channels in common.
+    :rtype: numpy.ndarray
+    """
+    n = len(stream_list)
+    rows = np.arange(n) if rows is None else np.asarray(rows)
+    columns = np.arange(n) if columns is None else np.asarray(columns)
+    if channels is None:
+        channels = _channel_waveforms(stream_list)
+    # Position of each stream in the rows and columns, -1 if not used
+    row_position = np.zeros(n, dtype=np.int64) - 1
+    row_position[rows] = np.arange(len(rows))
+    column_position = np.zeros(n, dtype=np.int64) - 1
+    column_position[columns] = np.arange(len(columns))
+    coherence = np.zeros((len(rows), len(columns)))
+    kchan = np.zeros((len(rows), len(columns)), dtype=np.uint16)
+
+    def _add_block(length, row_group, column_group):
+        row_use = row_position[row_group[1]] >= 0
+        column_use = column_position[column_group[1]] >= 0
+        if not np.any(row_use) or not np.any(column_use):
+            return
+        block = np.dot(
+            _normalise_rows([waveform for waveform, use in
+                             zip(row_group[2], row_use) if use], length),
+            _normalise_rows([waveform for waveform, use in
+                             zip(column_group[2], column_use) if use],
+                            length).T)
+        index = np.ix_(row_position[row_group[1][row_use]],
+                       column_position[column_group[1][column_use]])
+        coherence[index] += block
+        kchan[index] += 1
+
+    for stachan in sorted(channels.keys()):
+        groups = channels[stachan]
+        for k, short in enumerate(groups):
+            for other in groups[k:]:
+                # Correlate over the shorter length
+                _add_block(short[0], short, other)
+                if other is not short:
+                    _add_block(short[0], other, short)
+    if np.any(kchan == 0):
+        warnings.warn('No matching channels')
+    coherence[kchan > 0] /= kchan[kchan > 0]
+    return coherence
+
+
+def _coherence_tile(row_streams, column_streams, row_start, column_start,
+                    allow_shift=False, shift_len=0):
+    """
+    Compute cross-channel coherences for a tile of the distance matrix.
+
+    Only pairs above the diagonal of the full matrix are computed.
+
+    :type row_streams: list
+    :param row_streams: Streams for the rows of the tile.
+    :type column_streams: list
+    :param column_streams: Streams for the columns of the tile.
+    :type row_start: int
+    :param row_start: Index of the first row in the full matrix.
+    :type column_start: int
+    :param column_start: Index of the first column in the full matrix.
+    :type allow_shift: bool
+    :param allow_shift: See :func:`cross_chan_coherence`
+    :type shift_len: int
+    :param shift_len: See :func:`cross_chan_coherence`
+
+    :returns: row_start, column_start and the tile of coherences.
+    :rtype: tuple
+    """
+    tile = np.zeros((len(row_streams), len(column_streams)))
+    for i, st1 in enumerate(row_streams):
+        for j, st2 in enumerate(column_streams):
+            if column_start + j <= row_start + i:
+                continue
+            tile[i, j] = cross_chan_coherence(
+                st1=st1, st2=st2, allow_shift=allow_shift,
+                shift_len=shift_len)[0]
+    return row_start, column_start, tile
+
+
+def _coherence_tiles(stream_list, allow_shift, shift_len, cores):
+    """
+    Compute the upper triangle of the coherence matrix in tiles.
+
+    Tiles are computed by :func:`_coherence_tile` on a single pool of
+    processes and yielded as they are returned.
+
+    :type stream_list: list
+    :param stream_list: List of :class:`obspy.core.stream.Stream`
+    :type allow_shift: bool
+    :param allow_shift: See :func:`cross_chan_coherence`
+    :type shift_len: int
+    :param shift_len: See :func:`cross_chan_coherence`
+    :type cores: int
+    :param cores: Number of processes to use.
+
+    :returns:
+        Generator of row_start, column_start and tile, with zeros in the
+        tile on and below the diagonal of the full matrix.
+    :rtype: generator
+    """
+    n = len(stream_list)
+    # Tiles small enough to balance across processes, each stream is
+    # only sent to processes once per tile it appears in
+    tile_size = max(int(np.ceil(n / (2.0 * max(cores, 1)))), 1)
+    starts = range(0, n, tile_size)
+    pool = Pool(processes=cores)
+    results = [pool.apply_async(
+        _coherence_tile,
+        args=(stream_list[i:i + tile_size], stream_list[j:j + tile_size],
+              i, j, allow_shift, shift_len))
+               for i in starts for j in starts if j >= i]
+    pool.close()
+    for result in results:
+        yield result.get()
+    pool.join()
+
+
 def distance_matrix(stream_list, allow_shift=False, shift_len=0, cores=1):
     """
     Compute distance matrix for waveforms based on cross-correlations.
@@ -107,40 +307,236 @@ def distance_matrix(stream_list, allow_shift=False, shift_len=0, cores=1):
         Because distance is given as :math:`1-abs(coherence)`, negatively
         correlated and positively correlated objects are given the same
         distance.
+
+    .. note::
+        Without shifts the coherences are computed as one matrix product of
+        the normalised waveforms per channel, parallelised by numpy rather
+        than by cores.  With shifts the upper triangle of the matrix is split
+        into tiles which are computed by a single pool of processes.  See
+        :func:`sparse_distance_matrix` and :func:`condensed_distance_matrix`
+        for large numbers of streams.
     """
-    # Initialize square matrix
-    dist_mat = np.array([np.array([0.0] * len(stream_list))] *
-                        len(stream_list))
-    for i, master in enumerate(stream_list):
-        # Start a parallel processing pool
-        pool = Pool(processes=cores)
-        # Parallel processing
-        results = [pool.apply_async(cross_chan_coherence, args=(master,
-                                                                stream_list[j],
-                                                                allow_shift,
-                                                                shift_len,
-                                                                j))
-                   for j in range(len(stream_list))]
-        pool.close()
-        # Extract the results when they are done
-        dist_list = [p.get() for p in results]
-        # Close and join all the processes back to the master process
-        pool.join()
-        # Sort the results by the input j
-        dist_list.sort(key=lambda tup: tup[1])
-        # Sort the list into the dist_mat structure
-        for j in range(i, len(stream_list)):
-            if i == j:
-                dist_mat[i, j] = 0.0
-            else:
-                dist_mat[i, j] = 1 - dist_list[j][0]
-    # Reshape the distance matrix
-    for i in range(1, len(stream_list)):
-        for j in range(i):
-            dist_mat[i, j] = dist_mat.T[i, j]
+    n = len(stream_list)
+    if not allow_shift:
+        dist_mat = _zero_lag_coherence(stream_list)
+    else:
+        dist_mat = np.zeros((n, n))
+        for i, j, tile in _coherence_tiles(stream_list, allow_shift,
+                                           shift_len, cores):
+            dist_mat[i:i + tile.shape[0], j:j + tile.shape[1]] += tile
+        # Mirror the upper triangle
+        dist_mat += dist_mat.T
+    # Convert coherence to distance in place to save memory
+    np.subtract(1, dist_mat, out=dist_mat)
+    np.fill_diagonal(dist_mat, 0.0)
     return dist_mat
 
 
+def _distance_blocks(stream_list, allow_shift=False, shift_len=0, cores=1,
+                     block_size=1000):
+    """
+    Compute the upper triangle of the distance matrix in blocks.
+
+    :type stream_list: list
+    :param stream_list: List of :class:`obspy.core.stream.Stream`
+    :type allow_shift: bool
+    :param allow_shift: See :func:`distance_matrix`
+    :type shift_len: int
+    :param shift_len: See :func:`distance_matrix`
+    :type cores: int
+    :param cores: See :func:`distance_matrix`
+    :type block_size: int
+    :param block_size: Number of rows to compute at once without shifts.
+
+    :returns:
+        Generator of row_start, column_start and block of distances, only
+        entries above the diagonal of the full matrix are valid.
+    :rtype: generator
+    """
+    n = len(stream_list)
+    if not allow_shift:
+        channels = _channel_waveforms(stream_list)
+        for start in range(0, n, block_size):
+            coherence = _zero_lag_coherence(
+                stream_list, rows=np.arange(start, min(start + block_size, n)),
+                columns=np.arange(start, n), channels=channels)
+            yield start, start, np.subtract(1, coherence, out=coherence)
+    else:
+        for i, j, tile in _coherence_tiles(stream_list, allow_shift,
+                                           shift_len, cores):
+            yield i, j, np.subtract(1, tile, out=tile)
+
+
+def condensed_distance_matrix(stream_list, allow_shift=False, shift_len=0,
+                              cores=1, filename=None, block_size=1000):
+    """
+    Compute the condensed distance matrix for waveforms.
+
+    Gives the same distances as :func:`distance_matrix`, in the condensed
+    form of :func:`scipy.spatial.distance.squareform` used by
+    :func:`scipy.cluster.hierarchy.linkage`, computed in blocks and
+    optionally written to a memory-mapped file rather than held in memory.
+
+    :type stream_list: list
+    :param stream_list:
+        List of the :class:`obspy.core.stream.Stream`s to compute the distance
+        matrix for
+    :type allow_shift: bool
+    :param allow_shift: To allow templates to shift or not?
+    :type shift_len: int
+    :param shift_len: How many samples for templates to shift in time
+    :type cores: int
+    :param cores: Number of cores to parallel process using, defaults to 1.
+    :type filename: str
+    :param filename:
+        .npy file to write the condensed matrix to, if None (default) the
+        matrix is held in memory.
+    :type block_size: int
+    :param block_size: Number of rows to compute at once without shifts.
+
+    :returns: condensed distance matrix
+    :rtype: :class:`numpy.ndarray`
+    """
+    n = len(stream_list)
+    size = n * (n - 1) // 2
+    if filename:
+        dist_vec = np.lib.format.open_memmap(filename, mode='w+',
+                                             dtype=np.float64, shape=(size,))
+    else:
+        dist_vec = np.zeros(size)
+    for row_start, column_start, block in _distance_blocks(
+            stream_list, allow_shift, shift_len, cores, block_size):
+        column_end = column_start + block.shape[1]
+        for k in range(block.shape[0]):
+            i = row_start + k
+            first = max(column_start, i + 1)
+            if first >= column_end:
+                continue
+            # Pairs (i, j > i) are stored contiguously from this offset
+            offset = n * i - i * (i + 1) // 2 + first - i - 1
+            dist_vec[offset:offset + column_end - first] = \
+                block[k, first - column_start:]
+    if filename:
+        dist_vec.flush()
+    return dist_vec
+
+
+def sparse_distance_matrix(stream_list, max_distance, allow_shift=False,
+                           shift_len=0, cores=1, block_size=1000):
+    """
+    Compute the distances between waveforms within a maximum distance.
+
+    Gives the same distances as :func:`distance_matrix`, but only stores
+    pairs within max_distance, computing the matrix in blocks so that
+    memory scales with the number of close pairs.
+
+    :type stream_list: list
+    :param stream_list:
+        List of the :class:`obspy.core.stream.Stream`s to compute the distance
+        matrix for
+    :type max_distance: float
+    :param max_distance:
+        Maximum distance to keep, e.g. 1 - corr_thresh for clustering.
+    :type allow_shift: bool
+    :param allow_shift: To allow templates to shift or not?
+    :type shift_len: int
+    :param shift_len: How many samples for templates to shift in time
+    :type cores: int
+    :param cores: Number of cores to parallel process using, defaults to 1.
+    :type block_size: int
+    :param block_size: Number of rows to compute at once without shifts.
+
+    :returns:
+        Sparse upper triangle of the distance matrix, pairs with a distance
+        of zero are stored explicitly.
+    :rtype: :class:`scipy.sparse.csr_matrix`
+    """
+    n = len(stream_list)
+    rows, columns, distances = [], [], []
+    for row_start, column_start, block in _distance_blocks(
+            stream_list, allow_shift, shift_len, cores, block_size):
+        _rows, _columns = np.nonzero(block <= max_distance)
+        close = block[_rows, _columns]
+        _rows += row_start
+        _columns += column_start
+        upper = _columns > _rows
+        rows.append(_rows[upper])
+        columns.append(_columns[upper])
+        distances.append(close[upper])
+    return _sparse_pairs(n, rows, columns, distances)
+
+
+def _sparse_pairs(n, rows, columns, distances):
+    """
+    Build a sparse matrix from lists of arrays of pairs.
+
+    :type n: int
+    :param n: Size of the square matrix.
+    :type rows: list
+    :param rows: List of arrays of row indices.
+    :type columns: list
+    :param columns: List of arrays of column indices.
+    :type distances: list
+    :param distances: List of arrays of distances.
+
+    :returns: Sparse matrix
+    :rtype: :class:`scipy.sparse.csr_matrix`
+    """
+    empty = [np.zeros(0, dtype=np.int64)]
+    return coo_matrix(
+        (np.concatenate([np.zeros(0)] + distances),
+         (np.concatenate(empty + rows), np.concatenate(empty + columns))),
+        shape=(n, n)).tocsr()
+
+
+def _condensed_pairs(indices, n):
+    """
+    Convert indices of a condensed distance matrix to row and column.
+
+    :type indices: numpy.ndarray
+    :param indices: Indices into the condensed matrix.
+    :type n: int
+    :param n: Number of observations.
+
+    :returns: Rows and columns of the square matrix, rows < columns.
+    :rtype: tuple
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    rows = (n - 2 - np.floor(np.sqrt(-8 * indices + 4 * n * (n - 1) - 7) /
+                             2.0 - 0.5)).astype(np.int64)
+    columns = (indices + rows + 1 - n * (n - 1) // 2 +
+               (n - rows) * (n - rows - 1) // 2)
+    return rows, columns
+
+
+def _connected_groups(n, rows, columns):
+    """
+    Find groups of observations connected by pairs.
+
+    For single linkage, these are the flat clusters given by
+    :func:`scipy.cluster.hierarchy.fcluster` with the distance criterion
+    when the pairs are those within the threshold distance.
+
+    :type n: int
+    :param n: Number of observations.
+    :type rows: numpy.ndarray
+    :param rows: First observation of each pair.
+    :type columns: numpy.ndarray
+    :param columns: Second observation of each pair.
+
+    :returns: List of lists of indices, ordered by their first index.
+    :rtype: list
+    """
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8),
+                        (rows, columns)), shape=(n, n))
+    n_groups, labels = connected_components(graph, directed=False)
+    order = np.argsort(labels, kind='mergesort')
+    groups = np.split(order, np.cumsum(np.bincount(labels))[:-1])
+    groups = [[int(i) for i in group] for group in groups if len(group)]
+    groups.sort(key=lambda group: group[0])
+    return groups
+
+
 def cluster(template_list, show=True, corr_thresh=0.3, allow_shift=False,
             shift_len=0, save_corrmat=False,
             cores='all', debug=1):
@@ -156,6 +552,11 @@ def cluster(template_list, show=True, corr_thresh=0.3, allow_shift=False,
     similar events.  Groups are then created by clustering the distance matrix
     at distances less than 1 - corr_thresh.
 
+    Unless the linkage is shown or the distance matrix saved, only pairs
+    within 1 - corr_thresh are stored (see :func:`sparse_distance_matrix`),
+    so memory scales with the number of similar pairs.  Groups are ordered
+    by their first template.
+
     Will compute the distance matrix in parallel, using all available cores
 
     :type template_list: list
@@ -192,56 +593,46 @@ def cluster(template_list, show=True, corr_thresh=0.3, allow_shift=False,
         num_cores = cores
     # Extract only the Streams from stream_list
     stream_list = [x[0] for x in template_list]
+    n = len(stream_list)
     # Compute the distance matrix
     if debug >= 1:
         print('Computing the distance matrix using %i cores' % num_cores)
-    dist_mat = distance_matrix(stream_list, allow_shift, shift_len,
-                               cores=num_cores)
-    if save_corrmat:
-        np.save('dist_mat.npy', dist_mat)
-        if debug >= 1:
-            print('Saved the distance matrix as dist_mat.npy')
-    dist_vec = squareform(dist_mat)
-    # plt.matshow(dist_mat, aspect='auto', origin='lower',
-    #             cmap=pylab.cm.YlGnBu)
-    if debug >= 1:
-        print('Computing linkage')
-    Z = linkage(dist_vec)
-    if show:
-        if debug >= 1:
-            print('Plotting the dendrogram')
-        dendrogram(Z, color_threshold=1 - corr_thresh,
-                   distance_sort='ascending')
-        plt.show()
-    # Get the indices of the groups
+    if show or save_corrmat:
+        dist_vec = condensed_distance_matrix(stream_list, allow_shift,
+                                             shift_len, cores=num_cores)
+        if save_corrmat:
+            np.save('dist_mat.npy', squareform(dist_vec))
+            if debug >= 1:
+                print('Saved the distance matrix as dist_mat.npy')
+        if show:
+            if debug >= 1:
+                print('Computing linkage')
+            Z = linkage(dist_vec)
+            if debug >= 1:
+                print('Plotting the dendrogram')
+            dendrogram(Z, color_threshold=1 - corr_thresh,
+                       distance_sort='ascending')
+            plt.show()
+        rows, columns = _condensed_pairs(
+            np.nonzero(dist_vec <= 1 - corr_thresh)[0], n)
+        del dist_vec
+    else:
+        # Only pairs closer than the threshold are needed to cluster
+        dist_mat = sparse_distance_matrix(stream_list, 1 - corr_thresh,
+                                          allow_shift, shift_len,
+                                          cores=num_cores).tocoo()
+        rows, columns = dist_mat.row, dist_mat.col
+        del dist_mat
+    # Single linkage clusters at a distance threshold are the groups of
+    # templates linked by pairs within that distance.
     if debug >= 1:
         print('Clustering')
-    indices = fcluster(Z, t=1 - corr_thresh, criterion='distance')
-    # Indices start at 1...
-    group_ids = list(set(indices))  # Unique list of group ids
+    indices = _connected_groups(n, rows, columns)
     if debug >= 1:
-        msg = ' '.join(['Found', str(len(group_ids)), 'groups'])
+        msg = ' '.join(['Found', str(len(indices)), 'groups'])
         print(msg)
-    # Convert to tuple of (group id, stream id)
-    indices = [(indices[i], i) for i in range(len(indices))]
-    # Sort by group id
-    indices.sort(key=lambda tup: tup[0])
-    groups = []
-    if debug >= 1:
         print('Extracting and grouping')
-    for group_id in group_ids:
-        group = []
-        for ind in indices:
-            if ind[0] == group_id:
-                group.append(template_list[ind[1]])
-            elif ind[0] > group_id:
-                # Because we have sorted by group id, when the index is greater
-                # than the group_id we can break the inner loop.
-                # Patch applied by CJC 05/11/2015
-                groups.append(group)
-                break
-    # Catch the final group
-    groups.append(group)
+    groups = [[template_list[i] for i in group] for group in indices]
     return groups
 
 
@@ -735,7 +1126,48 @@ def extract_detections(detections, templates, archive, arc_type,
         return
 
 
-def dist_mat_km(catalog):
+def _catalog_locations(catalog):
+    """
+    Get the locations of events in a catalog.
+
+    Uses the preferred origin of each event, or the first origin if none is
+    preferred.
+
+    :type catalog: obspy.core.event.Catalog
+    :param catalog: Catalog of events.
+
+    :returns:
+        Array of latitude, longitude and depth (whole km) for each event.
+    :rtype: numpy.ndarray
+    """
+    locations = np.zeros((len(catalog), 3))
+    for i, event in enumerate(catalog):
+        origin = event.preferred_origin() or event.origins[0]
+        locations[i] = (origin.latitude, origin.longitude,
+                        origin.depth // 1000)
+    return locations
+
+
+def _km_block(locations, others):
+    """
+    Compute distances in km between two sets of locations.
+
+    :type locations: numpy.ndarray
+    :param locations: Array of latitude, longitude and depth, one per row.
+    :type others: numpy.ndarray
+    :param others: Array of latitude, longitude and depth, one per row.
+
+    :returns:
+        Distances from :func:`eqcorrscan.utils.mag_calc.dist_calc`, rows for
+        locations and columns for others.
+    :rtype: numpy.ndarray
+    """
+    return dist_calc((locations[:, 0:1], locations[:, 1:2],
+                      locations[:, 2:3]),
+                     (others[:, 0], others[:, 1], others[:, 2]))
+
+
+def dist_mat_km(catalog, block_size=1000):
     """
     Compute the distance matrix for all a catalog using epicentral separation.
 
@@ -743,48 +1175,112 @@ def dist_mat_km(catalog):
 
     :type catalog: obspy.core.event.Catalog
     :param catalog: Catalog for which to compute the distance matrix
+    :type block_size: int
+    :param block_size: Number of rows to compute at once.
 
     :returns: distance matrix
     :rtype: :class:`numpy.ndarray`
     """
-    # Initialize square matrix
-    dist_mat = np.array([np.array([0.0] * len(catalog))] *
-                        len(catalog))
-    # Calculate distance vector for each event
-    for i, master in enumerate(catalog):
-        mast_list = []
-        if master.preferred_origin():
-            master_ori = master.preferred_origin()
-        else:
-            master_ori = master.origins[0]
-        master_tup = (master_ori.latitude,
-                      master_ori.longitude,
-                      master_ori.depth // 1000)
-        for slave in catalog:
-            if master.preferred_origin():
-                slave_ori = slave.preferred_origin()
-            else:
-                slave_ori = slave.origins[0]
-            slave_tup = (slave_ori.latitude,
-                         slave_ori.longitude,
-                         slave_ori.depth // 1000)
-            mast_list.append(dist_calc(master_tup, slave_tup))
-        # Sort the list into the dist_mat structure
-        for j in range(i, len(catalog)):
-            dist_mat[i, j] = mast_list[j]
-    # Reshape the distance matrix
-    for i in range(1, len(catalog)):
-        for j in range(i):
-            dist_mat[i, j] = dist_mat.T[i, j]
+    locations = _catalog_locations(catalog)
+    dist_mat = np.zeros((len(catalog), len(catalog)))
+    for start in range(0, len(catalog), block_size):
+        dist_mat[start:start + block_size] = _km_block(
+            locations[start:start + block_size], locations)
     return dist_mat
 
 
+def sparse_dist_mat_km(catalog, max_distance):
+    """
+    Compute the distances between events within a maximum distance.
+
+    Gives the same distances as :func:`dist_mat_km`, but only stores pairs
+    within max_distance, found using a
+    :class:`eqcorrscan.utils.catalog_utils.SpatialIndex` so that time and
+    memory scale with the number of close pairs.
+
+    :type catalog: obspy.core.event.Catalog
+    :param catalog: Catalog for which to compute the distance matrix
+    :type max_distance: float
+    :param max_distance: Maximum distance to keep in km.
+
+    :returns:
+        Sparse upper triangle of the distance matrix, pairs with a distance
+        of zero are stored explicitly.
+    :rtype: :class:`scipy.sparse.csr_matrix`
+    """
+    index = SpatialIndex(_catalog_locations(catalog))
+    rows, columns, distances = index.query_pairs(max_distance=max_distance)
+    return _sparse_pairs(len(catalog), [rows], [columns], [distances])
+
+
+def _average_groups(n, rows, columns, distance_func, d_thresh):
+    """
+    Cluster by average linkage at a distance threshold, given close pairs.
+
+    Average linkage clusters at a threshold never span observations that
+    are not linked by pairs within that threshold, so each group of linked
+    observations is clustered separately, needing only its own distances.
+
+    :type n: int
+    :param n: Number of observations.
+    :type rows: numpy.ndarray
+    :param rows: First observation of each pair within d_thresh.
+    :type columns: numpy.ndarray
+    :param columns: Second observation of each pair within d_thresh.
+    :type distance_func: callable
+    :param distance_func:
+        Function taking a list of indices and returning their square
+        distance matrix.
+    :type d_thresh: float
+    :param d_thresh: Distance threshold for clustering.
+
+    :returns: List of lists of indices, ordered by their first index.
+    :rtype: list
+    """
+    groups = []
+    for linked in _connected_groups(n, rows, columns):
+        if len(linked) == 1:
+            groups.append(linked)
+            continue
+        Z = linkage(squareform(distance_func(linked), checks=False),
+                    method='average')
+        indices = fcluster(Z, t=d_thresh, criterion='distance')
+        for group_id in np.unique(indices):
+            groups.append([linked[i]
+                           for i in np.where(indices == group_id)[0]])
+    groups.sort(key=lambda group: group[0])
+    return groups
+
+
+def _space_groups(index, d_thresh):
+    """
+    Cluster events by average linkage of their distances.
+
+    :type index: eqcorrscan.utils.catalog_utils.SpatialIndex
+    :param index: Index of event locations.
+    :type d_thresh: float
+    :param d_thresh: Maximum inter-event distance threshold
+
+    :returns: List of lists of indices, ordered by their first index.
+    :rtype: list
+    """
+    rows, columns, distances = index.query_pairs(max_distance=d_thresh)
+    return _average_groups(
+        len(index), rows, columns,
+        distance_func=lambda linked: _km_block(index.locations[linked],
+                                               index.locations[linked]),
+        d_thresh=d_thresh)
+
+
 def space_cluster(catalog, d_thresh, show=True):
     """
     Cluster a catalog by distance only.
 
     Will compute the matrix of physical distances between events and utilize
     the :mod:`scipy.clustering.hierarchy` module to perform the clustering.
+    Only events linked by pairs within d_thresh can be clustered together,
+    so the full distance matrix is only computed within groups of linked
+    events (and to show the linkage).
 
     :type catalog: obspy.core.event.Catalog
     :param catalog: Catalog of events to clustered
@@ -814,38 +1310,16 @@ def space_cluster(catalog, d_thresh, show=True):
     ...                        minmagnitude=6, catalog="ISC")
     >>> groups = space_cluster(catalog=cat, d_thresh=1000, show=False)
     """
-    # Compute the distance matrix and linkage
-    dist_mat = dist_mat_km(catalog)
-    dist_vec = squareform(dist_mat)
-    Z = linkage(dist_vec, method='average')
-
-    # Cluster the linkage using the given threshold as the cutoff
-    indices = fcluster(Z, t=d_thresh, criterion='distance')
-    group_ids = list(set(indices))
-    indices = [(indices[i], i) for i in range(len(indices))]
-
+    locations = _catalog_locations(catalog)
     if show:
         # Plot the dendrogram...if it's not way too huge
+        Z = linkage(squareform(dist_mat_km(catalog)), method='average')
         dendrogram(Z, color_threshold=d_thresh,
                    distance_sort='ascending')
         plt.show()
-
-    # Sort by group id
-    indices.sort(key=lambda tup: tup[0])
-    groups = []
-    for group_id in group_ids:
-        group = Catalog()
-        for ind in indices:
-            if ind[0] == group_id:
-                group.append(catalog[ind[1]])
-            elif ind[0] > group_id:
-                # Because we have sorted by group id, when the index is greater
-                # than the group_id we can break the inner loop.
-                # Patch applied by CJC 05/11/2015
-                groups.append(group)
-                break
-    groups.append(group)
-    return groups
+    index = SpatialIndex(locations)
+    indices = _space_groups(index=index, d_thresh=d_thresh)
+    return [Catalog([catalog[i] for i in group]) for group in indices]
 
 
 def space_time_cluster(catalog, t_thresh, d_thresh):
@@ -853,7 +1327,9 @@ def space_time_cluster(catalog, t_thresh, d_thresh):
     Cluster detections in space and time.
 
     Use to separate repeaters from other events.  Clusters by distance
-    first, then removes events in those groups that are at different times.
+    first (see :func:`space_cluster`), then removes events in those groups
+    that are at different times: events more than t_thresh after the first
+    event of a group are put in groups of their own.
 
     :type catalog: obspy.core.event.Catalog
     :param catalog: Catalog of events to clustered
@@ -875,25 +1351,18 @@ def space_time_cluster(catalog, t_thresh, d_thresh):
     ...                         minmagnitude=6, catalog="ISC")
     >>> groups = space_time_cluster(catalog=cat, t_thresh=86400, d_thresh=1000)
     """
-    initial_spatial_groups = space_cluster(catalog=catalog, d_thresh=d_thresh,
-                                           show=False)
-    # Need initial_spatial_groups to be lists at the moment
-    initial_spatial_lists = []
-    for group in initial_spatial_groups:
-        initial_spatial_lists.append(list(group))
-    # Check within these groups and throw them out if they are not close in
-    # time.
+    index = SpatialIndex(_catalog_locations(catalog))
+    times = [(event.preferred_origin() or event.origins[0]).time
+             for event in catalog]
     groups = []
-    for group in initial_spatial_lists:
-        for master in group:
-            for event in group:
-                if abs(event.preferred_origin().time -
-                       master.preferred_origin().time) > t_thresh:
-                    # If greater then just put event in on it's own
-                    groups.append([event])
-                    group.remove(event)
-        groups.append(group)
-    return [Catalog(group) for group in groups]
+    for group in _space_groups(index=index, d_thresh=d_thresh):
+        # Split off events more than t_thresh after the first event of the
+        # group, whatever the order of the catalog.
+        first = min([times[i] for i in group])
+        late = [times[i] - first > t_thresh for i in group]
+        groups.append([i for i, split in zip(group, late) if not split])
+        groups.extend([[i] for i, split in zip(group, late) if split])
+    return [Catalog([catalog[i] for i in group]) for group in groups]
 
 
 def re_thresh_csv(path, old_thresh, new_thresh, chan_thresh):
@@ -12,11 +12,11 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import bisect
 import random
 import numpy as np
 
 from obspy import UTCDateTime
-from scipy import ndimage
 
 
 def is_prime(number):
@@ -59,7 +59,9 @@ def find_peaks2_short(arr, thresh, trig_int, debug=0, starttime=False,
     """
     Determine peaks in an array of data above a certain threshold.
 
-    Uses a mask to remove data below threshold and finds peaks in what is left.
+    Uses a mask to remove data below threshold and finds the highest point of
+    each contiguous region that is left.  Peaks are then taken from highest
+    to lowest, discarding any within trig_int of a higher peak.
 
     :type arr: numpy.ndarray
     :param arr: 1-D numpy array is required
@@ -90,92 +92,127 @@ def find_peaks2_short(arr, thresh, trig_int, debug=0, starttime=False,
     """
     if not starttime:
         starttime = UTCDateTime(0)
-    # Set everything below the threshold to zero
-    image = np.copy(arr)
-    image = np.abs(image)
-    image[image < thresh] = 0
-    if len(image[image > thresh]) == 0:
+    abs_arr = np.abs(arr)
+    if not np.any(abs_arr > thresh):
         if debug > 0:
             print('No values over threshold found')
         return []
+    # Samples above the threshold, zeros are never peaks
+    above = np.flatnonzero((abs_arr >= thresh) & (abs_arr != 0))
     if debug > 0:
-        print(' '.join(['Found', str(len(image[image > thresh])),
+        print(' '.join(['Found', str(len(above)),
                         'samples above the threshold']))
-    initial_peaks = []
-    peaks = []
-    # Find the peaks
-    labeled_image, number_of_objects = ndimage.label(image)
-    peak_slices = ndimage.find_objects(labeled_image)
-    for peak_slice in peak_slices:
-        # print('Width of peak='+str(peak_slice[0].stop-peak_slice[0].start)
-        window = arr[peak_slice[0].start: peak_slice[0].stop]
-        initial_peaks.append((max(window),
-                              int(peak_slice[0].start + np.argmax(window))))
-    # Sort initial peaks according to amplitude
-    peaks_sort = sorted(initial_peaks, key=lambda amplitude: amplitude[0],
-                        reverse=True)
-    # Debugging
+    # Find the peaks: the highest value in each contiguous run of samples
+    # above the threshold.
+    run_starts = np.concatenate([[0], np.flatnonzero(np.diff(above) > 1) + 1])
+    run_lengths = np.diff(np.concatenate([run_starts, [len(above)]]))
+    values = arr[above]
+    run_maxes = np.maximum.reduceat(values, run_starts)
+    run_ids = np.repeat(np.arange(len(run_starts)), run_lengths)
+    is_max = np.flatnonzero(values == run_maxes[run_ids])
+    # Take the first maximum in each run
+    _, first_max = np.unique(run_ids[is_max], return_index=True)
+    peak_indices = above[is_max[first_max]]
+    peak_values = arr[peak_indices]
     if debug >= 4:
-        for peak in initial_peaks:
-            print(peak)
-    if initial_peaks:
-        peaks.append(peaks_sort[0])  # Definitely take the biggest peak
-        if debug > 3:
-            print(' '.join(['Added the biggest peak of', str(peaks[0][0]),
-                            'at sample', str(peaks[0][1])]))
-        if len(initial_peaks) > 1:
-            if debug > 3:
-                msg = ' '.join(['Multiple peaks found, checking',
-                                'them now to see if they overlap'])
-                print(msg)
-            for next_peak in peaks_sort:
-                # i in range(1,len(peaks_sort)):
-                # Loop through the amplitude sorted peaks
-                # if the next highest amplitude peak is within trig_int of any
-                # peak already in peaks then we don't want it, else, add it
-                # next_peak=peaks_sort[i]
-                if debug > 3:
-                    print(next_peak)
-                for peak in peaks:
-                    # Use add as a switch for whether or not to append
-                    # next peak to peaks, if once gone through all the peaks
-                    # it is True, then we will add it, otherwise we won't!
-                    if abs(next_peak[1] - peak[1]) < trig_int:
-                        if debug > 3:
-                            msg = ' '.join(['Difference in time is',
-                                            str(next_peak[1] - peak[1]), '\n',
-                                            'Which is less than',
-                                            str(trig_int)])
-                            print(msg)
-                        add = False
-                        # Need to exit the loop here if false
-                        break
-                    else:
-                        add = True
-                if add:
-                    if debug > 3:
-                        msg = ' '.join(['Adding peak of', str(next_peak[0]),
-                                        'at sample', str(next_peak[1])])
-                        print(msg)
-                    peaks.append(next_peak)
-                elif debug > 3:
-                    msg = ' '.join(['I did not add peak of', str(next_peak[0]),
-                                    'at sample', str(next_peak[1])])
-                    print(msg)
-
-        if debug >= 3:
-            from eqcorrscan.utils import plotting
-            _fname = ''.join(['peaks_',
-                              starttime.datetime.strftime('%Y-%m-%d'),
-                              '.pdf'])
-            plotting.peaks_plot(data=image, starttime=starttime,
-                                samp_rate=samp_rate, save=True,
-                                peaks=peaks, savefile=_fname)
-        peaks = sorted(peaks, key=lambda time: time[1], reverse=False)
-        return peaks
-    else:
-        print('No peaks for you!')
-        return peaks
+        for value, index in zip(peak_values, peak_indices):
+            print((value, index))
+    peaks = _decluster(peak_values, peak_indices, trig_int)
+    if debug >= 3:
+        from eqcorrscan.utils import plotting
+        image = np.copy(abs_arr)
+        image[image < thresh] = 0
+        _fname = ''.join(['peaks_',
+                          starttime.datetime.strftime('%Y-%m-%d'),
+                          '.pdf'])
+        plotting.peaks_plot(data=image, starttime=starttime,
+                            samp_rate=samp_rate, save=True,
+                            peaks=peaks, savefile=_fname)
+    return peaks
+
+
+def _decluster(peak_values, peak_indices, trig_int):
+    """
+    Keep the highest peaks separated by at least trig_int.
+
+    Peaks are taken from highest to lowest, and any peak within trig_int of a
+    peak that has already been kept is discarded.  Kept peaks are held in
+    time order so that each peak is only compared to its neighbours.
+
+    :type peak_values: numpy.ndarray
+    :param peak_values: Values of the peaks
+    :type peak_indices: numpy.ndarray
+    :param peak_indices: Locations of the peaks in samples
+    :type trig_int: int
+    :param trig_int: The minimum difference in samples between peaks.
+
+    :return: List of tuples of peak values and locations, sorted by location.
+    :rtype: list
+
+    >>> import numpy as np
+    >>> _decluster(np.array([3.0, 5.0, 4.0]), np.array([10, 12, 30]), 5)
+    [(5.0, 12), (4.0, 30)]
+    """
+    # Stable sort so that equal peaks are taken in time order
+    order = np.argsort(-np.asarray(peak_values), kind='mergesort')
+    kept_indices = []
+    kept = []
+    for i in order:
+        index = int(peak_indices[i])
+        position = bisect.bisect_left(kept_indices, index)
+        neighbours = kept_indices[max(position - 1, 0): position + 1]
+        if any([abs(index - neighbour) < trig_int
+                for neighbour in neighbours]):
+            continue
+        kept_indices.insert(position, index)
+        kept.insert(position, (peak_values[i], index))
+    return kept
+
+
+def multi_find_peaks(arr, thresh, trig_int, debug=0, starttime=False,
+                     samp_rate=1.0):
+    """
+    Determine peaks in every row of a 2-D array above a threshold.
+
+    Wrapper on :func:`eqcorrscan.utils.findpeaks.find_peaks2_short` to find
+    peaks in, for example, the correlation sums of all templates in one call.
+
+    :type arr: numpy.ndarray
+    :param arr: 2-D numpy array, peaks will be found in each row.
+    :type thresh: float
+    :param thresh: The threshold below which will be considered noise and \
+        peaks will not be found in.  Either a single value, or a list with \
+        one threshold per row of arr.
+    :type trig_int: int
+    :param trig_int: The minimum difference in samples between triggers,\
+        if multiple peaks within this window this code will find the highest.
+    :type debug: int
+    :param debug: Optional, debug level 0-5
+    :type starttime: obspy.core.utcdatetime.UTCDateTime
+    :param starttime: Starttime for plotting, only used if debug > 2.
+    :type samp_rate: float
+    :param samp_rate: Sampling rate in Hz, only used for plotting if debug > 2.
+
+    :return: List of lists of tuples of peak values and locations, one list \
+        per row of arr.
+    :rtype: list
+
+    >>> import numpy as np
+    >>> arr = np.random.randn(2, 100)
+    >>> arr[0][40] = 20
+    >>> arr[1][60] = 100
+    >>> multi_find_peaks(arr, [10, 50], 3)
+    [[(20.0, 40)], [(100.0, 60)]]
+    """
+    if np.ndim(thresh) == 0:
+        thresh = [thresh] * len(arr)
+    if len(thresh) != len(arr):
+        raise IndexError('Need one threshold per row of arr')
+    # Rows are handled one at a time to avoid copying the whole array.
+    return [find_peaks2_short(arr=row, thresh=row_thresh, trig_int=trig_int,
+                              debug=debug, starttime=starttime,
+                              samp_rate=samp_rate)
+            for row, row_thresh in zip(arr, thresh)]
 
 
 def find_peaks_dep(arr, thresh, trig_int, debug=0, starttime=False,
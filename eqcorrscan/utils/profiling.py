@@ -0,0 +1,270 @@
+"""
+Per-stage timing and memory instrumentation for detection routines.
+
+:copyright:
+    EQcorrscan developers.
+
+:license:
+    GNU Lesser General Public License, Version 3
+    (https://www.gnu.org/copyleft/lesser.html)
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import sys
+import time
+
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+try:
+    _process_time = time.process_time
+except AttributeError:
+    # Python 2
+    _process_time = time.clock
+
+
+def cpu_time(children=False):
+    """
+    Get the CPU time used by this process.
+
+    :type children: bool
+    :param children:
+        Whether to include the CPU time of child processes which have
+        finished, such as the workers of a closed and joined pool.
+
+    :returns: CPU time in seconds.
+    :rtype: float
+    """
+    if not children:
+        return _process_time()
+    times = os.times()
+    return _process_time() + times[2] + times[3]
+
+
+def peak_rss():
+    """
+    Get the peak resident set size of this process.
+
+    :returns:
+        Peak resident set size in bytes, or None if this cannot be found on
+        this platform.
+    :rtype: int
+
+    .. Note::
+        This is the high-water mark for the life of the process, so it only
+        increases, and does not include memory used by child processes.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes on OSX, kilobytes elsewhere
+        return int(rss)
+    return int(rss) * 1024
+
+
+class Stage(object):
+    """
+    Timing and memory use of a single stage of processing.
+
+    :type name: str
+    :param name: Name of the stage.
+    :type wall: float
+    :param wall: Wall-clock time taken by the stage in seconds.
+    :type cpu: float
+    :param cpu:
+        CPU time used during the stage in seconds, by this process and any
+        pool of worker processes run by the stage.
+    :type peak_rss: int
+    :param peak_rss:
+        Peak resident set size of the process, in bytes, at the end of the
+        stage (None if not available).
+    :type nbytes: int
+    :param nbytes:
+        Approximate number of bytes of array data read or written by the
+        stage.
+    """
+
+    def __init__(self, name, wall=0.0, cpu=0.0, peak_rss=None, nbytes=0):
+        """Set up the stage."""
+        self.name = name
+        self.wall = wall
+        self.cpu = cpu
+        self.peak_rss = peak_rss
+        self.nbytes = nbytes
+
+    def __repr__(self):
+        return ('Stage(name=%s, wall=%.4f s, cpu=%.4f s, peak_rss=%s, '
+                'nbytes=%i)' % (self.name, self.wall, self.cpu,
+                                self.peak_rss, self.nbytes))
+
+    def to_dict(self):
+        """
+        Get the stage as a dictionary.
+
+        :rtype: dict
+        """
+        return {'name': self.name, 'wall': self.wall, 'cpu': self.cpu,
+                'peak_rss': self.peak_rss, 'nbytes': self.nbytes}
+
+
+class _StageContext(object):
+    """Context manager to time a stage, returned by Profile.stage."""
+
+    def __init__(self, profile, name, nbytes=0):
+        self.profile = profile
+        self.stage = Stage(name=name, nbytes=nbytes)
+
+    def __enter__(self):
+        self._wall = time.time()
+        self._cpu = cpu_time()
+        return self.stage
+
+    def __exit__(self, *args):
+        self.stage.wall = time.time() - self._wall
+        self.stage.cpu = cpu_time() - self._cpu
+        self.profile._record(self.stage)
+
+
+class Profile(object):
+    """
+    Record the time, CPU time, peak memory and data volume of stages of
+    processing.
+
+    Stages are recorded in the order they complete; stages run more than
+    once (for example for each chunk of data) are recorded each time, and
+    can be summed using :func:`Profile.totals`.
+
+    :type callback: callable
+    :param callback:
+        Function to call with each :class:`Stage` as it completes, for
+        example to log or forward timings to a scheduler.
+    :type verbose: bool
+    :param verbose: Print each stage as it completes.
+
+    .. rubric:: Example
+
+    >>> profile = Profile()
+    >>> with profile.stage('sum', nbytes=800) as stage:
+    ...     total = sum(range(100))
+    >>> profile.stages[0].name
+    'sum'
+    >>> profile.totals()['sum']['nbytes']
+    800
+    """
+
+    def __init__(self, callback=None, verbose=False):
+        """Set up an empty profile."""
+        self.callback = callback
+        self.verbose = verbose
+        self.stages = []
+        self.counts = OrderedDict()
+
+    def __repr__(self):
+        return 'Profile(%i stages: %s)' % (
+            len(self.stages), ', '.join(self.totals().keys()))
+
+    def __len__(self):
+        return len(self.stages)
+
+    def stage(self, name, nbytes=0):
+        """
+        Time a stage of processing.
+
+        :type name: str
+        :param name: Name of the stage.
+        :type nbytes: int
+        :param nbytes:
+            Number of bytes moved by the stage, can also be set on the
+            returned :class:`Stage` within the context.
+
+        :returns: Context manager giving the :class:`Stage` being timed.
+        """
+        return _StageContext(self, name=name, nbytes=nbytes)
+
+    def add(self, name, wall, cpu=0.0, nbytes=0):
+        """
+        Record a stage timed elsewhere.
+
+        Used for stages interleaved with others, which are timed in parts
+        and summed.
+
+        :type name: str
+        :param name: Name of the stage.
+        :type wall: float
+        :param wall: Wall-clock time in seconds.
+        :type cpu: float
+        :param cpu: CPU time in seconds.
+        :type nbytes: int
+        :param nbytes: Number of bytes moved by the stage.
+        """
+        self._record(Stage(name=name, wall=wall, cpu=cpu, nbytes=nbytes))
+
+    def count(self, name, value):
+        """
+        Add to a named counter, such as the number of templates or seconds
+        of data processed.
+
+        :type name: str
+        :param name: Name of the counter.
+        :type value: float
+        :param value: Amount to add.
+        """
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def _record(self, stage):
+        stage.peak_rss = peak_rss()
+        self.stages.append(stage)
+        if self.verbose:
+            print('--------- TIMER:    %s took: %.4f s (cpu %.4f s)' %
+                  (stage.name, stage.wall, stage.cpu))
+        if self.callback is not None:
+            self.callback(stage)
+
+    def totals(self):
+        """
+        Sum the stages of each name.
+
+        :returns:
+            Ordered dictionary keyed by stage name, in order of first
+            completion, of dictionaries of wall, cpu, nbytes, the maximum
+            peak_rss and the number of calls.
+        :rtype: collections.OrderedDict
+        """
+        totals = OrderedDict()
+        for stage in self.stages:
+            if stage.name not in totals:
+                totals[stage.name] = {'wall': 0.0, 'cpu': 0.0, 'nbytes': 0,
+                                      'peak_rss': None, 'calls': 0}
+            total = totals[stage.name]
+            total['wall'] += stage.wall
+            total['cpu'] += stage.cpu
+            total['nbytes'] += stage.nbytes
+            total['calls'] += 1
+            if stage.peak_rss is not None:
+                total['peak_rss'] = max(total['peak_rss'] or 0,
+                                        stage.peak_rss)
+        return totals
+
+    def to_dict(self):
+        """
+        Get the profile as a dictionary, suitable for writing as JSON.
+
+        :rtype: dict
+        """
+        return {'stages': [stage.to_dict() for stage in self.stages],
+                'totals': self.totals(), 'counts': dict(self.counts)}
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
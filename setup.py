@@ -66,7 +66,7 @@ if sys.version_info.major == 2:
     if not READ_THE_DOCS:
         install_requires = ['numpy>=1.8.0', 'obspy>=1.0.0',
                             'matplotlib>=1.3.0', 'joblib>=0.8.4',
-                            'scipy>=0.14', 'multiprocessing',
+                            'scipy>=0.18', 'multiprocessing',
                             'LatLon', 'h5py', 'cython']
     else:
         install_requires = ['numpy>=1.8.0', 'obspy>=1.0.0',
@@ -77,7 +77,7 @@ else:
     if not READ_THE_DOCS:
         install_requires = ['numpy>=1.8.0', 'obspy>=0.10.2',
                             'matplotlib>=1.3.0', 'joblib>=0.8.4',
-                            'scipy>=0.14', 'LatLon', 'h5py', 'cython']
+                            'scipy>=0.18', 'LatLon', 'h5py', 'cython']
     else:
         install_requires = ['numpy>=1.8.0', 'obspy>=0.10.2',
                             'matplotlib>=1.3.0', 'joblib>=0.8.4',